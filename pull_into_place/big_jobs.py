@@ -3,8 +3,12 @@
 import sys, os, re, json, time, subprocess
 from . import pipeline
 
-def submit(script, workspace, **params):
-    """Submit a job with the given parameters."""
+def submit(script, workspace, hold_job=None, **params):
+    """
+    Submit a job with the given parameters and return its id.  If the id of
+    another job is given as `hold_job`, the new job won't start until that one
+    has finished.
+    """
     from klab import cluster, process
 
     # Make sure the rosetta symlink has been created.
@@ -35,6 +39,8 @@ def submit(script, workspace, **params):
     qsub_command += '-t', '1-{0}'.format(nstruct),
     qsub_command += '-l', 'h_rt={0}'.format(max_runtime),
     qsub_command += '-l', 'mem_free={0}'.format(max_memory),
+    if hold_job is not None:
+        qsub_command += '-hold_jid', str(hold_job),
     qsub_command += pipeline.big_job_path(script),
     qsub_command += workspace.focus_dir,
 
@@ -59,6 +65,8 @@ def submit(script, workspace, **params):
     process.check_output(qrls_command)
     print status,
 
+    return job_id
+
 def initiate():
     """Return some relevant information about the currently running job."""
     workspace = pipeline.workspace_from_dir(sys.argv[1])
@@ -99,3 +107,27 @@ def run_command(command):
     jobnumber = os.environ['JOB_ID'] + '.' + os.environ['SGE_TASK_ID']
     print 'Job Number:', jobnumber
     subprocess.call(['/usr/local/sge/bin/linux-x64/qstat','-j',jobnumber])
+
+def write_metrics(workspace, job_id, task_id, pdb_paths):
+    """
+    Calculate metrics for the models made by this task and save them next to
+    the models (see structures.write_sidecar()), so they don't have to be
+    calculated again after the models are fetched.  The models themselves are
+    already finished by the time this is called, so problems are reported but
+    otherwise ignored.
+    """
+    import traceback
+
+    pdb_paths = sorted(pdb_paths)
+    if not pdb_paths:
+        return
+
+    print "Caching metrics for {0} models.".format(len(pdb_paths))
+    sys.stdout.flush()
+
+    try:
+        from . import structures
+        structures.write_sidecar(
+                pdb_paths, '{0}_{1}'.format(job_id, task_id), workspace)
+    except Exception:
+        traceback.print_exc()
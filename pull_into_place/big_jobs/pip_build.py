@@ -6,7 +6,7 @@
 #$ -l netapp=1G
 #$ -cwd
 
-import os, sys, subprocess
+import os, sys, glob, subprocess
 from pull_into_place import big_jobs
 
 workspace, job_id, task_id, parameters = big_jobs.initiate()
@@ -37,3 +37,6 @@ big_jobs.run_command([
 ] +     workspace.fragments_flags(workspace.input_pdb_path) + [
         '@', workspace.flags_path,
 ])
+
+big_jobs.write_metrics(workspace, job_id, task_id,
+        glob.glob(output_prefix + '*.pdb.gz'))
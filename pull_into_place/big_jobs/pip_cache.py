@@ -0,0 +1,41 @@
+#!/usr/bin/env python2
+
+#$ -S /usr/bin/python
+#$ -l mem_free=1G
+#$ -l arch=linux-x64
+#$ -l netapp=1G
+#$ -cwd
+
+import os, glob
+from pull_into_place import big_jobs, structures
+
+workspace, job_id, task_id, parameters = big_jobs.initiate()
+
+directory, names = parameters['tasks'][task_id]
+use_cache = not parameters.get('recalc', False)
+
+big_jobs.print_debug_info()
+
+# Directories with too many models for one task are cached in two steps.
+# First, each task saves the metrics for its share of the models in a
+# sidecar.  Then a second job, which waits for the first to finish, merges
+# the sidecars into the cache.  The metrics database isn't updated from the
+# cluster, because SQLite can't be trusted to lock files over NFS.  Instead,
+# it's updated from the head node once the caches have been built.
+
+if names is not None:
+    structures.write_sidecar(
+            [os.path.join(directory, x) for x in names],
+            'cache_{0}_{1}'.format(job_id, task_id), workspace)
+
+elif parameters.get('map_job') is not None:
+    structures.load(directory, update_db=False)
+    sidecar_pattern = 'metrics.cache_{0}_*.sidecar'.format(parameters['map_job'])
+    for path in glob.glob(os.path.join(directory, sidecar_pattern)):
+        os.remove(path)
+
+else:
+    structures.load(directory, use_cache=use_cache, update_db=False)
+
+if names is None and parameters.get('energies'):
+    structures.load_energies(directory, update_db=False)
@@ -8,7 +8,7 @@
 #$ -cwd
 
 
-import os, sys, subprocess
+import os, sys, glob, subprocess
 from pull_into_place import big_jobs
 
 workspace, job_id, task_id, parameters = big_jobs.initiate()
@@ -16,6 +16,7 @@ workspace, job_id, task_id, parameters = big_jobs.initiate()
 bb_models = parameters['inputs']
 bb_model = bb_models[task_id % len(bb_models)]
 design_id = task_id // len(bb_models)
+output_suffix = '_{0:03}'.format(design_id)
 
 big_jobs.print_debug_info()
 big_jobs.run_command([
@@ -24,7 +25,7 @@ big_jobs.run_command([
         '-in:file:s', workspace.input_path(bb_model),
         '-in:file:native', workspace.input_pdb_path,
         '-out:prefix', workspace.output_dir + '/',
-        '-out:suffix', '_{0:03}'.format(design_id),
+        '-out:suffix', output_suffix,
         '-out:no_nstruct_label',
         '-out:overwrite',
         '-out:pdb_gz',
@@ -37,3 +38,7 @@ big_jobs.run_command([
         '-packing:resfile', workspace.resfile_path,
         '@', workspace.flags_path,
 ])
+
+big_jobs.write_metrics(workspace, job_id, task_id, glob.glob(os.path.join(
+        workspace.output_dir,
+        bb_model[:-len('.pdb.gz')] + output_suffix + '.pdb.gz')))
@@ -6,13 +6,14 @@
 #$ -l netapp=1G
 #$ -cwd
 
-import os, sys, subprocess
+import os, sys, glob, subprocess
 from pull_into_place import big_jobs
 
 workspace, job_id, task_id, parameters = big_jobs.initiate()
 
 designs = parameters['inputs']
 design = designs[task_id % len(designs)]
+output_suffix = '_{0:03d}'.format(task_id / len(designs))
 test_run = parameters.get('test_run', False)
 
 big_jobs.print_debug_info()
@@ -22,7 +23,7 @@ big_jobs.run_command([
         '-in:file:s', workspace.input_path(design),
         '-in:file:native', workspace.input_pdb_path,
         '-out:prefix', workspace.output_subdir(design) + '/',
-        '-out:suffix', '_{0:03d}'.format(task_id / len(designs)),
+        '-out:suffix', output_suffix,
         '-out:no_nstruct_label',
         '-out:overwrite',
         '-out:pdb_gz',
@@ -37,3 +38,7 @@ big_jobs.run_command([
 ] +     workspace.fragments_flags(design) + [
         '@', workspace.flags_path,
 ])
+
+big_jobs.write_metrics(workspace, job_id, task_id, glob.glob(os.path.join(
+        workspace.output_subdir(design),
+        os.path.basename(design)[:-len('.pdb.gz')] + output_suffix + '.pdb.gz')))
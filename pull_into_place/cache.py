@@ -0,0 +1,647 @@
+#!/usr/bin/env python2
+
+"""\
+This module reads and writes the files that structures.load() uses to remember
+the metrics it calculates for each directory of structures.  The cache itself
+(``metrics.npz``) has one plain numpy array per column and a JSON description
+of the columns, so it can be read without unpickling anything.  The
+coordinates of the restrained atoms and the loop backbone atoms of each
+structure are kept in memory-mappable ``*.npy`` files next to it, as are the
+per-residue score tables, if they were asked for.  Records calculated since
+the cache was last written are kept in a journal (``metrics.journal``), so an
+interrupted load() can pick up where it left off, and records calculated by
+the cluster jobs that made the structures are kept in sidecars
+(``metrics.*.sidecar``) until they're merged into the cache.
+
+Records are passed around as a data frame plus a dictionary with an array of
+coordinates for each set of atoms, with one row per record in each.
+"""
+
+import os, json, collections, struct, uuid, zipfile
+import numpy as np, pandas as pd
+from . import pipeline
+
+def is_categorical(column):
+    return isinstance(column.dtype, pd.api.types.CategoricalDtype)
+
+cache_version = 2
+
+def read_cache(cache_path, columns=None):
+    """
+    Return a data frame with the metrics cached in the given file.  If
+    `columns` is given, only those columns will be read from disk.  Caches
+    written with older versions of the format are migrated on the fly.
+    """
+    try:
+        with np.load(cache_path) as npz:
+            schema = json.loads(npz['__schema__'].item())
+            schema = upgrade_schema(cache_path, schema)
+
+            data = collections.OrderedDict()
+            for column in schema['columns']:
+                if columns is not None and column['name'] not in columns:
+                    continue
+                array = npz[column['key']]
+                if column['kind'] == 'str':
+                    array = array.astype(object)
+                    if 'nulls' in column:
+                        array[npz[column['nulls']]] = np.nan
+                if column['kind'] == 'category':
+                    array = pd.Categorical.from_codes(
+                            array, npz[column['categories']].astype(object))
+                data[column['name']] = array
+
+    except CacheError:
+        raise
+    except Exception as error:
+        raise CacheError("Couldn't load '{}': {}".format(cache_path, error))
+
+    return pd.DataFrame(data, index=pd.RangeIndex(schema['num_rows']))
+
+def iter_cache(cache_path, chunk_size=10000, columns=None):
+    """
+    Yield data frames with the metrics cached in the given file, `chunk_size`
+    rows at a time.  The arrays in the cache are memory mapped, so only one
+    chunk has to be in memory at once, no matter how big the cache is.  The
+    index of each data frame gives the position of its rows in the cache.
+    """
+    try:
+        schema = upgrade_schema(cache_path, read_schema(cache_path))
+        arrays = {}
+        selected_columns = [
+                x for x in schema['columns']
+                if columns is None or x['name'] in columns]
+        for column in selected_columns:
+            for key in column['key'], column.get('nulls'):
+                if key is not None:
+                    arrays[key] = memmap_npz(cache_path, key)
+            if column['kind'] == 'category':
+                with np.load(cache_path) as npz:
+                    arrays[column['categories']] = \
+                            npz[column['categories']].astype(object)
+
+    except CacheError:
+        raise
+    except Exception as error:
+        raise CacheError("Couldn't load '{}': {}".format(cache_path, error))
+
+    num_rows = schema['num_rows']
+
+    for start in range(0, num_rows, chunk_size):
+        stop = min(start + chunk_size, num_rows)
+        data = collections.OrderedDict()
+        for column in selected_columns:
+            array = np.array(arrays[column['key']][start:stop])
+            if column['kind'] == 'str':
+                array = array.astype(object)
+                if 'nulls' in column:
+                    array[arrays[column['nulls']][start:stop]] = np.nan
+            if column['kind'] == 'category':
+                array = pd.Categorical.from_codes(
+                        array, arrays[column['categories']])
+            data[column['name']] = array
+
+        yield pd.DataFrame(data, index=pd.RangeIndex(start, stop))
+
+def memmap_npz(npz_path, key):
+    """
+    Return a memory map of the array with the given name in the given ``*.npz``
+    file.  This only works because ``np.savez()`` doesn't compress the arrays
+    it saves, so each one is stored in the zip file as a complete ``*.npy``
+    file.  Compressed arrays are just loaded normally.
+    """
+    with zipfile.ZipFile(npz_path) as zip:
+        info = zip.getinfo(key + '.npy')
+
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(npz_path) as npz:
+            return npz[key]
+
+    with open(npz_path, 'rb') as file:
+        # Skip the local header of the zip entry, which has a fixed size part
+        # followed by the file name and an "extra" field.
+        file.seek(info.header_offset)
+        header = file.read(30)
+        name_size, extra_size = struct.unpack('<HH', header[26:30])
+        file.seek(info.header_offset + 30 + name_size + extra_size)
+
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(file)
+        else:
+            header = np.lib.format.read_array_header_2_0(file)
+        shape, fortran_order, dtype = header
+        offset = file.tell()
+
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+
+    return np.memmap(npz_path, dtype=dtype, mode='r', shape=shape,
+            offset=offset, order='F' if fortran_order else 'C')
+
+def upgrade_schema(cache_path, schema):
+    """
+    Migrate the given schema, which was read from the given cache, to the
+    current version of the cache format.
+    """
+    if schema['version'] > cache_version:
+        raise CacheError("'{}' was made by a newer version of PIP.".format(cache_path))
+
+    while schema['version'] < cache_version:
+        schema = cache_migrations[schema['version']](schema)
+
+    return schema
+
+def write_cache(cache_path, records, coords=None, failures=None,
+        sidecars=None, restraints=None):
+    """
+    Save the given data frame to the given path.  Numeric columns are stored as
+    they are, categorical columns are stored as integer codes plus a single
+    array of the distinct values, and everything else is stored as a unicode
+    string array, so that the cache can be read without unpickling anything.
+    The file is written under a temporary name and then renamed, so anyone
+    reading the cache at the same time will never see a partially written
+    file.
+
+    If given, `coords` should map names to Coords tuples with one row for each
+    record.  Each array is saved to its own ``*.npy`` file, which is written
+    before the cache itself so that the cache never refers to coordinates that
+    aren't there yet.  Every write gets a new "generation" token, which is
+    part of the names of the coordinate files, so the coordinate files of one
+    cache are never mistaken for those of another.  The coordinate files of
+    the cache being replaced are kept for one more generation (in case
+    someone is still reading them) and deleted the next time the cache is
+    written.
+
+    If given, `failures` should be a list of dictionaries describing files
+    that couldn't be read (see read_failures()), and `sidecars` should be a
+    list of dictionaries describing the sidecars that have been merged into
+    the cache (see read_merged_sidecars()).  If either isn't given, it's
+    carried over from the cache being replaced, if there is one, so that
+    rewriting the records doesn't lose track of either.
+
+    `restraints` should be the digest of the restraints that the records were
+    calculated with (see structures.RestraintSet.digest), if it's known.
+    Unlike the failures and the sidecars, this isn't carried over.
+    """
+    try:
+        old_schema = read_schema(cache_path)
+    except CacheError:
+        old_schema = {}
+    if failures is None:
+        failures = old_schema.get('failures', [])
+    if sidecars is None:
+        sidecars = old_schema.get('sidecars', [])
+
+    schema = {
+            'version': cache_version,
+            'generation': uuid.uuid4().hex,
+            'num_rows': len(records),
+            'columns': [],
+            'coords': [],
+            'failures': failures,
+            'sidecars': sidecars,
+            'restraints': restraints,
+    }
+    arrays = {}
+
+    for i, name in enumerate(records.columns):
+        values = records[name].values
+        column = {'name': name, 'key': 'column_{}'.format(i)}
+
+        if values.dtype.kind in 'biuf':
+            column['kind'] = 'number'
+            arrays[column['key']] = values
+        elif is_categorical(records[name]):
+            column['kind'] = 'category'
+            column['categories'] = column['key'] + '_categories'
+            arrays[column['key']] = values.codes.astype(np.int32)
+            arrays[column['categories']] = np.array(
+                    [unicode(x) for x in values.categories], dtype=np.unicode_)
+        else:
+            nulls = pd.isnull(values)
+            column['kind'] = 'str'
+            arrays[column['key']] = np.array(
+                    [u'' if x else unicode(y) for x, y in zip(nulls, values)],
+                    dtype=np.unicode_)
+            if nulls.any():
+                column['nulls'] = column['key'] + '_nulls'
+                arrays[column['nulls']] = nulls
+
+        schema['columns'].append(column)
+
+    prefix = os.path.splitext(os.path.basename(cache_path))[0]
+
+    for name, (atoms, xyz) in (coords or {}).items():
+        if len(xyz) != len(records):
+            raise ValueError("expected {} rows of '{}', not {}".format(
+                len(records), name, len(xyz)))
+        entry = {
+                'name': name,
+                'file': '{}.{}.{}.npy'.format(
+                    prefix, name, schema['generation'][:12]),
+                'atoms': [list(x) for x in atoms],
+        }
+        pipeline.save_atomically(
+                os.path.join(os.path.dirname(cache_path), entry['file']),
+                lambda file: np.save(file, xyz.astype(np.float32)))
+        schema['coords'].append(entry)
+
+    current_files = set(x['file'] for x in schema['coords'])
+    old_files = set(x['file'] for x in old_schema.get('coords', []))
+    schema['stale_coords'] = sorted(old_files - current_files)
+
+    arrays['__schema__'] = np.array(json.dumps(schema), dtype=np.unicode_)
+    pipeline.save_atomically(
+            cache_path, lambda file: np.savez(file, **arrays))
+
+    # Now that the new cache is in place, delete the coordinate files that
+    # were already stale when the old cache was written.
+
+    for file in old_schema.get('stale_coords', []):
+        if file not in current_files:
+            try:
+                os.remove(os.path.join(os.path.dirname(cache_path), file))
+            except OSError:
+                pass
+
+def upgrade_cache_v1(schema):
+    # Version 2 added categorical columns, so version 1 caches (which don't
+    # have any) can be read as they are.
+    return dict(schema, version=2)
+
+# Functions to upgrade the schema of a cache made with an older version of the
+# format to the next version, keyed by the version they upgrade from.
+cache_migrations = {
+        1: upgrade_cache_v1,
+}
+
+Coords = collections.namedtuple('Coords', 'atoms xyz')
+
+def read_coords(cache_path, name, mmap_mode='r', schema=None):
+    """
+    Return the coordinates with the given name (e.g. "restraint_coords" or
+    "loop_coords") that were stored alongside the given cache, or None if
+    there aren't any.  The coordinates are returned as a named tuple with a
+    list of the (residue id, atom name) pairs that were stored and a float32
+    array of shape (num_rows, num_atoms, 3).  By default the array is memory
+    mapped, so only the rows that are actually used will be read from disk.
+    Atoms that weren't found in a structure have NaN coordinates.  If the
+    schema of the cache has already been read, it can be given, so the
+    coordinates are sure to belong to the same version of the cache.
+    """
+    if schema is None:
+        schema = read_schema(cache_path)
+
+    for entry in schema.get('coords', []):
+        if entry['name'] == name:
+            break
+    else:
+        return None
+
+    path = os.path.join(os.path.dirname(cache_path), entry['file'])
+    atoms = [tuple(x) for x in entry['atoms']]
+
+    try:
+        xyz = np.load(path, mmap_mode=mmap_mode)
+    except Exception as error:
+        raise CacheError("Couldn't load '{}': {}".format(path, error))
+
+    if xyz.shape != (schema['num_rows'], len(atoms), 3):
+        raise CacheError("'{}' doesn't match '{}'".format(path, cache_path))
+
+    return Coords(atoms, xyz)
+
+def read_failures(cache_path):
+    """
+    Return a list of the files that couldn't be read when the given cache was
+    made.  Each is described by a dictionary with the name of the file, the
+    reason it couldn't be read, and its fingerprint (see
+    structures.fingerprint()).
+    """
+    return read_schema(cache_path).get('failures', [])
+
+def read_merged_sidecars(cache_path):
+    """
+    Return a list of the sidecars (see structures.write_sidecar()) that were
+    merged into the given cache.  Each is described by a dictionary with the
+    name of the file and its fingerprint (see structures.fingerprint()).
+    """
+    return read_schema(cache_path).get('sidecars', [])
+
+def read_all_coords(cache_path, mmap_mode='r'):
+    """
+    Return an ordered dictionary of all the coordinates stored alongside the
+    given cache, keyed by name.
+    """
+    schema = read_schema(cache_path)
+    return collections.OrderedDict(
+            (x['name'], read_coords(cache_path, x['name'], mmap_mode, schema))
+            for x in schema.get('coords', []))
+
+def read_schema(cache_path):
+    try:
+        with np.load(cache_path) as npz:
+            return json.loads(npz['__schema__'].item())
+    except Exception as error:
+        raise CacheError("Couldn't load '{}': {}".format(cache_path, error))
+
+def remap_coords(coords, atoms):
+    """
+    Return an array with the stored coordinates of the given atoms, in the
+    given order.  Atoms that weren't stored are NaN.  If the atoms are the
+    same as the ones that were stored, the stored array is returned as is.
+    """
+    if coords.atoms == list(atoms):
+        return coords.xyz
+
+    xyz = np.full((len(coords.xyz), len(atoms), 3), np.nan, dtype=np.float32)
+    stored_atoms = dict((k, i) for i, k in enumerate(coords.atoms))
+    for i, key in enumerate(atoms):
+        if key in stored_atoms:
+            xyz[:, i] = coords.xyz[:, stored_atoms[key]]
+    return xyz
+
+Energies = collections.namedtuple('Energies', 'residues terms table')
+
+def energies_paths(cache_path):
+    prefix = os.path.splitext(cache_path)[0]
+    return prefix + '.energies.npy', prefix + '.energies.json'
+
+def read_energies(cache_path, mmap_mode='r'):
+    """
+    Return the per-residue score tables stored alongside the given cache (see
+    structures.load_energies()), or ([], None) if there aren't any.  The tables
+    are returned as an Energies tuple, along with a list of the (path, file
+    size, file modification time) of the model in each row.
+    """
+    table_path, index_path = energies_paths(cache_path)
+    if not os.path.exists(index_path):
+        return [], None
+
+    try:
+        with open(index_path) as file:
+            index = json.load(file)
+        table = np.load(table_path, mmap_mode=mmap_mode)
+    except Exception as error:
+        raise CacheError("Couldn't load '{}': {}".format(table_path, error))
+
+    keys = [tuple(x) for x in index['models']]
+    shape = len(keys), len(index['residues']), len(index['terms'])
+    if table.shape != shape:
+        raise CacheError("'{}' doesn't match '{}'".format(
+            table_path, index_path))
+
+    return keys, Energies(index['residues'], index['terms'], table)
+
+def write_energies(cache_path, keys, residues, terms, tables):
+    """
+    Save per-residue score tables alongside the given cache.  The tables are
+    given as an iterable of (num_residues, num_terms) arrays, one for each of
+    the given (path, file size, file modification time) keys, and are
+    written one at a time so they never all have to be in memory at once.
+    The array is written before the index describing it, so the index never
+    refers to an array that isn't there yet.
+    """
+    table_path, index_path = energies_paths(cache_path)
+    shape = len(keys), len(residues), len(terms)
+
+    def save_table(file):
+        np.lib.format.write_array_header_1_0(file, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+            'fortran_order': False,
+            'shape': shape,
+        })
+        for table in tables:
+            file.write(np.asarray(table, dtype=np.float32).tostring())
+
+    def save_index(file):
+        json.dump({
+            'residues': residues,
+            'terms': terms,
+            'models': keys,
+        }, file)
+
+    pipeline.save_atomically(table_path, save_table)
+    pipeline.save_atomically(index_path, save_index)
+
+def empty_records():
+    return pd.DataFrame({'path': np.array([], dtype=object)})
+
+def empty_coords(atoms_by_name, num_rows):
+    return conform_coords({}, atoms_by_name, num_rows)
+
+def conform_coords(coords, atoms_by_name, num_rows):
+    """
+    Return a dictionary with an array of coordinates for each of the given
+    sets of atoms.  Arrays from the given dictionary are used if they're
+    there.  If they're missing any atoms (e.g. because they were calculated
+    before extra atoms were added to the set) those atoms are NaN, and if
+    they're missing altogether every atom is NaN.
+    """
+    conformed = collections.OrderedDict()
+
+    for name, atoms in atoms_by_name.items():
+        xyz = coords.get(name)
+        if xyz is None or xyz.shape[1] != len(atoms):
+            padded = np.full(
+                    (num_rows, len(atoms), 3), np.nan, dtype=np.float32)
+            if xyz is not None:
+                padded[:, :xyz.shape[1]] = xyz
+            xyz = padded
+        conformed[name] = xyz
+
+    return conformed
+
+def concat_records(records, coords):
+    """
+    Concatenate the given data frames, and the given dictionaries of
+    coordinates (one for each data frame).  Empty data frames are skipped, so
+    nothing is copied if only one has any records.
+    """
+    nonempty = [i for i, x in enumerate(records) if len(x)] or [0]
+
+    if len(nonempty) == 1:
+        return records[nonempty[0]], coords[nonempty[0]]
+
+    all_records = pd.concat(
+            [records[i] for i in nonempty], ignore_index=True, sort=False)
+    all_coords = collections.OrderedDict(
+            (k, np.concatenate([coords[i][k] for i in nonempty]))
+            for k in coords[nonempty[0]])
+
+    return all_records, all_coords
+
+def take_records(records, coords, rows):
+    """
+    Return the given rows (either a boolean mask or a list of indices) of the
+    given data frame and dictionary of coordinates.
+    """
+    rows = np.asarray(rows)
+    if rows.dtype == bool and rows.all():
+        return records, coords
+
+    records = records.iloc[rows].reset_index(drop=True)
+    coords = collections.OrderedDict((k, v[rows]) for k, v in coords.items())
+    return records, coords
+
+def read_cache_and_coords(cache_path, atoms_by_name):
+    """
+    Return the records, the coordinates of each of the given sets of atoms
+    (see read_cached_coords()), and the schema of the given cache.  The cache
+    might be rewritten by another process while it's being read, so its
+    generation is checked once everything has been read, to make sure the
+    records and the coordinates came from the same version of the cache.
+    """
+    schema = read_schema(cache_path)
+    records = read_cache(cache_path)
+    coords = read_cached_coords(
+            cache_path, atoms_by_name, len(records), schema)
+
+    if read_schema(cache_path).get('generation') != schema.get('generation'):
+        raise CacheError("'{}' changed while it was being read".format(
+            cache_path))
+
+    return records, coords, schema
+
+def read_cached_coords(cache_path, atoms_by_name, num_rows, schema=None):
+    """
+    Return a dictionary with the coordinates of each of the given sets of atoms
+    stored alongside the given cache.  Coordinates that can't be found are
+    NaN.  Any extra atoms that were stored (e.g. by rescore_restraints()) are
+    appended to the given lists of atoms, so they aren't lost when the cache
+    is next written.  The arrays are mapped copy-on-write, so they can be
+    modified without reading the whole file or changing it on disk.
+    """
+    coords = {}
+
+    for name, atoms in atoms_by_name.items():
+        stored_coords = read_coords(
+                cache_path, name, mmap_mode='c', schema=schema)
+        if stored_coords is not None:
+            atoms.extend(x for x in stored_coords.atoms if x not in atoms)
+            coords[name] = remap_coords(stored_coords, atoms)
+
+    return conform_coords(coords, atoms_by_name, num_rows)
+
+def read_journal(journal_path, atoms_by_name):
+    """
+    Return the records saved in the given journal, as a data frame and a
+    dictionary of coordinates for each of the given sets of atoms.  Each line
+    of the journal is a JSON object describing one batch of records, column by
+    column.  If the process writing the journal was killed, the last line may
+    be incomplete, so any line that can't be parsed (and everything after it)
+    is ignored.
+    """
+    records, coords = [], []
+
+    try:
+        with open(journal_path) as file:
+            for line in file:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    break
+
+                batch_records, batch_coords = parse_batch(batch, atoms_by_name)
+                records.append(batch_records)
+                coords.append(batch_coords)
+
+    except EnvironmentError:
+        pass
+
+    if not records:
+        return empty_records(), empty_coords(atoms_by_name, 0)
+
+    return concat_records(records, coords)
+
+def parse_batch(batch, atoms_by_name):
+    """
+    Return the records in the given batch (see format_batch()) as a data frame
+    and a dictionary of coordinates for each of the given sets of atoms.
+    """
+    num_rows = batch['num_rows']
+    records = pd.DataFrame(batch['columns'], index=pd.RangeIndex(num_rows))
+    coords = empty_coords(atoms_by_name, num_rows)
+
+    for name, values in batch.get('coords', {}).items():
+        if name not in coords:
+            continue
+        try:
+            values = np.array(values, dtype=float)
+            coords[name][:, :values.shape[1]] = values
+        except (TypeError, ValueError, IndexError):
+            pass
+
+    return records, coords
+
+def append_journal(journal_path, records, coords=None):
+    """
+    Append a batch of records (a data frame and, optionally, a dictionary of
+    coordinates) to the given journal.  The batch is written as a single line
+    and flushed to disk before returning, so it will survive the process being
+    killed.
+    """
+    if not len(records):
+        return
+
+    with open(journal_path, 'a') as file:
+        file.write(json.dumps(format_batch(records, coords)) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+def format_batch(records, coords=None):
+    """
+    Return a dictionary describing the given records (and coordinates) column
+    by column, which can be saved as JSON.
+    """
+    def to_json(values):
+        nulls = pd.isnull(values)
+        return [None if null else x for x, null in zip(values.tolist(), nulls)]
+
+    return {
+            'num_rows': len(records),
+            'columns': dict(
+                (k, to_json(records[k].values)) for k in records.columns),
+            'coords': dict(
+                (k, v.tolist()) for k, v in (coords or {}).items()),
+    }
+
+def read_sidecars(workspace, sidecar_paths, atoms_by_name):
+    """
+    Return the records (as a data frame and a dictionary of coordinates for
+    each of the given sets of atoms) and the failures saved in the given
+    sidecars (see structures.write_sidecar()).  Any filters the sidecars found
+    are added to the workspace's list of filters.  Sidecars that can't be read
+    are reported and skipped.
+    """
+    records, coords, failures, filter_list = [], [], [], []
+
+    for sidecar_path in sidecar_paths:
+        try:
+            with open(sidecar_path) as file:
+                batch = json.load(file)
+            batch_records, batch_coords = parse_batch(batch, atoms_by_name)
+        except (EnvironmentError, ValueError, KeyError) as error:
+            print "Couldn't load '{}': {}".format(sidecar_path, error)
+            continue
+
+        records.append(batch_records)
+        coords.append(batch_coords)
+        failures += batch.get('failures', [])
+        filter_list += [
+                x for x in batch.get('filters', []) if x not in filter_list]
+
+    if filter_list:
+        pipeline.update_filters(
+                workspace.root_dir, filter_list, workspace.filters_list)
+
+    if not records:
+        return empty_records(), empty_coords(atoms_by_name, 0), failures
+
+    records, coords = concat_records(records, coords)
+    return records, coords, failures
+
+class CacheError (IOError):
+    no_stack_trace = True
+
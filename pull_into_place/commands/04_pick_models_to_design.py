@@ -23,6 +23,10 @@ Options:
     --dry-run, -d
         Choose which models to pick, but don't actually make any symlinks.
 
+    --jobs NUM, -j NUM
+        Use the given number of processes to calculate metrics for models that 
+        haven't been cached yet.
+
 Queries:
     The queries provided after the workspace name and round number are used to
     decide which models to carry forward and which to discard.  Any number of
@@ -80,24 +84,31 @@ def main():
     num_models, num_selected, num_duplicates = 0, 0, 0
 
     for input_subdir in predecessor.output_subdirs:
-        # Find models meeting the criteria specified on the command line.
+        # Find models meeting the criteria specified on the command line.  The
+        # models are queried a chunk at a time, so only the paths of the
+        # selected models have to be kept in memory.
 
-        all_score_dists = structures.load(
+        chunks = structures.iter_records(
                 input_subdir,
                 use_cache=not args['--recalc'],
+                workers=int(args['--jobs'] or 1),
         )
-        # Any column with spaces in the name or a [[ ]] tag has the spaces
-        # replaced with "_" and the [[ ]] tag removed.
-        cols = [c for c in all_score_dists.columns]
-        for index, title in enumerate(cols):
-            title = structures.parse_filter_name(title)[0]
-            title.replace(' ','_')
-            cols[index] = title.replace(' ','_')
-        all_score_dists.columns = cols
-        best_score_dists = all_score_dists.query(query)
-        best_inputs = set(best_score_dists['path'])
-
-        num_models += len(all_score_dists)
+        best_inputs = set()
+
+        for all_score_dists in chunks:
+            # Any column with spaces in the name or a [[ ]] tag has the spaces
+            # replaced with "_" and the [[ ]] tag removed.
+            cols = [c for c in all_score_dists.columns]
+            for index, title in enumerate(cols):
+                title = structures.parse_filter_name(title)[0]
+                title.replace(' ','_')
+                cols[index] = title.replace(' ','_')
+            all_score_dists.columns = cols
+            best_score_dists = all_score_dists.query(query)
+            best_inputs.update(best_score_dists['path'])
+
+            num_models += len(all_score_dists)
+
         num_selected += len(best_inputs)
 
         # Figure out which models have already been considered.
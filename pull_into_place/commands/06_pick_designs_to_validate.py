@@ -27,6 +27,10 @@ Options:
     --dry-run
         Don't actually fill in the input directory of the validation workspace.  
         Instead just report how many designs would be picked.
+
+    --jobs NUM, -j NUM
+        Use the given number of processes to calculate metrics for models that 
+        haven't been cached yet.
 """
 
 import os, sys
@@ -60,6 +64,7 @@ def main():
     seqs_scores = structures.load(
             predecessor.output_dir,
             use_cache=not args['--recalc'],
+            workers=int(args['--jobs'] or 1),
     )
     seqs_scores.dropna(inplace=True)
     print 'Total number of designs:      ', len(seqs_scores)
@@ -71,10 +76,11 @@ def main():
         print '    minus given query:        ', len(seqs_scores)
 
     # Keep only the lowest scoring model for each set of identical sequences.
+    # The sequences are categorical, so they can be grouped by their integer
+    # codes without comparing any strings.
 
-    groups = seqs_scores.groupby('sequence', group_keys=False)
-    seqs_scores = groups.\
-            apply(lambda df: df.ix[df.total_score.idxmin()]).\
+    groups = seqs_scores.groupby('sequence', observed=True)
+    seqs_scores = seqs_scores.loc[groups.total_score.idxmin().values].\
             reset_index(drop=True)
     print '    minus duplicate sequences:', len(seqs_scores)
     
@@ -32,15 +32,19 @@ Options:
         Specify a prefix to append to all the files generated by this script.
         This is useful for discriminating files generated by different runs.
 
+    -j, --jobs NUM
+        Use the given number of processes to load the designs (and cache any
+        models that haven't been cached yet).
+
     -v, --verbose
         Output sanity checks and debugging information for each calculation.
 """
 
 from __future__ import division
 
-import os, re, sys, string, itertools, yaml, numpy as np
+import os, re, sys, string, itertools, numpy as np
 from klab import docopt, scripting
-from .. import pipeline, structures
+from .. import pipeline, structures, cache
 
 class Metric (object):
     """
@@ -281,6 +285,23 @@ class StructureClusterMetric (Metric):
         return design.structure_cluster
 
     def read_loop_coords(self, design):
+        # The loop backbone coordinates are usually stored alongside the
+        # cached metrics, so there's no need to read the PDB file.  Fall back
+        # to reading it if they aren't or if any atoms are missing.
+
+        try:
+            coords = structures.load_coords(design.directory, 'loop_coords')
+        except cache.CacheError:
+            coords = None
+
+        if coords is not None:
+            loop_coords = np.asarray(coords.xyz[design.rep], dtype=float)
+            if len(loop_coords) and not np.isnan(loop_coords).any():
+                design.loop_coords = loop_coords
+                return
+
+        pipeline.fetch_models([design.rep_path])
+
         if design.rep_path.endswith('.gz'):
             from gzip import open
         else:
@@ -380,6 +401,7 @@ class StructureClusterMetric (Metric):
 
                 if raw_input("  View in pymol? [y/N] ") == 'y':
                     import subprocess
+                    pipeline.fetch_models(command[2:])
                     subprocess.check_output(command)
 
                 print
@@ -548,7 +570,8 @@ def find_validation_workspaces(name, round=None):
 
     return workspaces
 
-def find_reasonable_designs(workspaces, threshold=None, verbose=False):
+def find_reasonable_designs(workspaces, threshold=None, verbose=False,
+        workers=None):
     """
     Return a list of design where the representative model has a restraint
     distance less that the given threshold.  The default threshold (1.2) is
@@ -556,20 +579,22 @@ def find_reasonable_designs(workspaces, threshold=None, verbose=False):
     """
     print "Loading designs..."
 
-    designs = []
-
     if threshold is None:
         threshold = 1.2
 
-    for workspace in workspaces:
-        for directory in workspace.output_subdirs:
-            if verbose:
-                print '  ' + directory
-            design = structures.Design(directory)
-            if design.rep_distance < float(threshold):
-                designs.append(design)
+    directories = [
+            directory
+            for workspace in workspaces
+            for directory in workspace.output_subdirs]
 
-    return designs
+    if verbose:
+        for directory in directories:
+            print '  ' + directory
+
+    return [
+            design for design in structures.load_designs(
+                directories, workers=workers)
+            if design.rep_distance < float(threshold)]
 
 def discover_custom_metrics(metrics, workspaces):
     """
@@ -762,16 +787,20 @@ def annotate_designs(designs):
         with open(annotation_path, 'w') as file:
             file.write('\n'.join(annotation_lines))
 
-def discover_filter_metrics(metrics,workspaces):
+def discover_filter_metrics(metrics, workspaces):
+    """
+    Add a metric for each of the custom filters that have been found in any of
+    the given workspaces.
+    """
+    filters = []
     for workspace in workspaces:
-        filter_list = pipeline.workspace_from_dir(docopt.docopt(__doc__)['<workspace>']).filters_list
-        filters = []
-        with open(filter_list,"r") as file:
-            filters = yaml.load(file)
-        if filters:
-            for record in filters:
-                filterclass = ExtraFilterHandler(record)
-                metrics.append(filterclass)
+        for record in pipeline.load_filters(
+                workspace.focus_dir, workspace.filters_list):
+            if record not in filters:
+                filters.append(record)
+
+    for record in filters:
+        metrics.append(ExtraFilterHandler(record))
 
 @scripting.catch_and_print_errors()
 def main():
@@ -781,7 +810,8 @@ def main():
     workspaces = find_validation_workspaces(
             args['<workspace>'], args['<round>'])
     designs = find_reasonable_designs(
-            workspaces, args['--threshold'], args['--verbose'])
+            workspaces, args['--threshold'], args['--verbose'],
+            int(args['--jobs'] or 1))
     metrics = [
             DesignNameMetric(),
             ResfileSequenceMetric(),
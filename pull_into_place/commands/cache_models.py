@@ -9,24 +9,141 @@ Usage:
     pull_into_place cache_models <directory> [options]
 
 Options:
-    -r PATH, --restraints PATH
-        Specify a restraints file that can be used to calculate the "restraint 
-        distance" metric.  If the directory specified above was created by the 
-        01_setup_pipeline script, this flag is optional and will default to the 
-        restraints used in that pipeline.
-        
     -f, --recalc
         Force the cache to be regenerated.
+
+    -j NUM, --jobs NUM
+        Use the given number of processes to calculate metrics for models that 
+        haven't been cached yet.
+
+    -e, --energies
+        Also cache the full per-residue score table of every model, which is 
+        much bigger than the other metrics and is therefore only cached when 
+        asked for.
+
+    -c, --on-cluster
+        Submit a job array to build the caches on the cluster, where the models 
+        already are, instead of building them here.  If the given directory 
+        isn't itself an output directory (e.g. it's the workspace itself or 
+        its inputs), every output directory in the same workspace is cached, 
+        each by its own task.  Directories with more 
+        models than the chunk size are split between several tasks, and a 
+        second job merges the results once they've all finished.  The jobs 
+        don't update the workspace's metrics database, so run `pull_into_place 
+        query_models <workspace> --update` once they're done.
+
+    -n NUM, --chunk-size NUM    [default: 2000]
+        The most models to cache in a single task, if --on-cluster is given.
+
+    --max-runtime TIME          [default: 6:00:00]
+        The runtime limit for each task, if --on-cluster is given.
 """
 
+import os, glob
 from klab import docopt, scripting
-from .. import structures
+from .. import pipeline, structures
 
 @scripting.catch_and_print_errors()
 def main():
     args = docopt.docopt(__doc__)
+
+    if args['--on-cluster']:
+        submit_cache_jobs(
+                args['<directory>'],
+                chunk_size=int(args['--chunk-size']),
+                max_runtime=args['--max-runtime'],
+                recalc=args['--recalc'],
+                energies=args['--energies'],
+        )
+        return
+
     print structures.load(
             args['<directory>'],
-            args['--restraints'],
-            not args['--recalc']).head()
+            use_cache=not args['--recalc'],
+            workers=int(args['--jobs'] or 1),
+    ).head()
+
+    if args['--energies']:
+        energies = structures.load_energies(
+                args['<directory>'],
+                workers=int(args['--jobs'] or 1),
+        )
+        print "Cached {} residues x {} score terms for {} models".format(
+                len(energies.residues), len(energies.terms),
+                len(energies.table))
+
+def submit_cache_jobs(directory, chunk_size, max_runtime, recalc=False,
+        energies=False):
+    """
+    Submit a job array with one task for each output directory to cache (or
+    each chunk of the models in a large directory), followed by a job that
+    merges the chunks once they're done.
+    """
+    from klab import cluster
+    from .. import big_jobs
+
+    cluster.require_qsub()
+
+    workspace = pipeline.workspace_from_dir(directory)
+    if not isinstance(workspace, pipeline.BigJobWorkspace):
+        scripting.print_error_and_die(
+                "'{0}' doesn't contain any cluster job outputs.", directory)
+
+    # Only the output directories of the workspace are cached on the cluster.
+    # The inputs are few enough to cache locally, and they may not even be on
+    # the cluster.
+
+    directories = [
+            os.path.normpath(os.path.abspath(x))
+            for x in workspace.output_subdirs]
+    directory = os.path.normpath(os.path.abspath(directory))
+    if directory in directories:
+        directories = [directory]
+
+    # Decide which models each task will cache.  Small directories are
+    # cached in one go, while big directories are split into chunks.
+
+    tasks = []
+    chunked_dirs = []
+
+    for pdb_dir in directories:
+        names = sorted(
+                os.path.basename(x)
+                for x in glob.glob(os.path.join(pdb_dir, '*.pdb.gz')))
+        if not names:
+            continue
+        if len(names) <= chunk_size:
+            tasks.append((pdb_dir, None))
+        else:
+            chunked_dirs.append(pdb_dir)
+            tasks += [
+                    (pdb_dir, names[i:i+chunk_size])
+                    for i in range(0, len(names), chunk_size)]
+
+    if not tasks:
+        print "No models to cache."
+        return
+
+    job_id = big_jobs.submit(
+            'pip_cache.py', workspace,
+            nstruct=len(tasks),
+            max_runtime=max_runtime,
+            tasks=tasks,
+            recalc=recalc,
+            energies=energies,
+    )
+
+    if chunked_dirs:
+        big_jobs.submit(
+                'pip_cache.py', workspace,
+                hold_job=job_id,
+                nstruct=len(chunked_dirs),
+                max_runtime=max_runtime,
+                tasks=[(x, None) for x in chunked_dirs],
+                map_job=job_id,
+                energies=energies,
+        )
 
+    print "Once the jobs are done, update the metrics database by running:"
+    print "pull_into_place query_models {0} --update".format(
+            os.path.relpath(workspace.root_dir))
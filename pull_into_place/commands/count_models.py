@@ -13,10 +13,9 @@ Options:
     --recalc, -f
         Recalculate all the metrics that will be used to choose designs.
 
-    --restraints PATH
-        The path to a set of restraints that can be used to recalculate the 
-        restraint_distance metric.  This is only necessary if the cache is 
-        being regenerated in a directory that is not a workspace.
+    --jobs NUM, -j NUM
+        Use the given number of processes to calculate metrics for models that 
+        haven't been cached yet.
 
 Queries:
     The query string uses the same syntax as the query() method of pandas 
@@ -44,7 +43,7 @@ Queries:
     'buried_unsat_score <= 4'
 """
 
-import os
+import os, re
 from klab import docopt, scripting
 from .. import pipeline, structures
 
@@ -53,12 +52,25 @@ def main():
     args = docopt.docopt(__doc__)
     num_models = 0
 
+    # Only load the metrics that are mentioned in the query.  Words that
+    # aren't metrics (e.g. "and") are ignored by load().
+
+    columns = re.findall(r'[A-Za-z_][A-Za-z0-9_]*', args['--query'] or '')
+
+    # The models are counted a chunk at a time, so that directories with any
+    # number of models can be counted without running out of memory.
+
     for directory in args['<directories>']:
-        records = structures.\
-                load(directory, args['--restraints'], not args['--recalc'])
-        if args['--query']:
-            records = records.query(args['--query'])
-        num_models += len(records)
+        chunks = structures.iter_records(
+                directory,
+                columns=columns,
+                use_cache=not args['--recalc'],
+                workers=int(args['--jobs'] or 1),
+        )
+        for records in chunks:
+            if args['--query']:
+                records = records.query(args['--query'])
+            num_models += len(records)
 
     print num_models
 
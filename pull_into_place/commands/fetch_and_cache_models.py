@@ -20,6 +20,12 @@ Options:
         else.  Note that these files are often quite large, so this may take 
         significantly longer.
 
+    --metrics-only, -m
+        Only fetch the metrics for each model (i.e. cached metrics, sidecars 
+        made by the cluster jobs, and score files), not the models themselves.  
+        This is much faster, and models can still be downloaded individually 
+        when they're needed, e.g. by plot_funnels or 09_compare_best_designs.
+
     --keep-going, -k
         Keep attempting to fetch and cache new models until you press Ctrl-C.  
         You can run this command with this flag at the start of a long job, and 
@@ -47,6 +53,7 @@ def main():
                     args['<directory>'],
                     args['--remote'],
                     args['--include-logs'],
+                    args['--metrics-only'],
             )
 
             print "Waiting {} min...".format(wait_time // 60)
@@ -57,4 +64,5 @@ def main():
                 args['<directory>'],
                 args['--remote'],
                 args['--include-logs'],
+                args['--metrics-only'],
         )
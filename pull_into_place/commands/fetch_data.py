@@ -19,6 +19,12 @@ Options:
         else.  Note that these files are often quite large, so this may take 
         significantly longer.
 
+    --metrics-only, -m
+        Only fetch the metrics for each model (i.e. cached metrics, sidecars 
+        made by the cluster jobs, and score files), not the models themselves.  
+        This is much faster, and models can still be downloaded individually 
+        when they're needed, e.g. by plot_funnels or 09_compare_best_designs.
+
     --dry-run, -d
         Output the rsync command that would be used to fetch data.
         
@@ -35,6 +41,7 @@ def main():
             args['--remote'],
             args['--include-logs'],
             args['--dry-run'],
+            args['--metrics-only'],
     )
 
 
@@ -4,7 +4,12 @@
 Create a web logos for sequences generated by the design pipeline.
 
 Usage:
-    pull_into_place make_web_logo <workspace> <round> <pdf_output>
+    pull_into_place make_web_logo <workspace> <round> <pdf_output> [options]
+
+Options:
+    -j, --jobs NUM
+        Use the given number of processes to load the designs (and cache any
+        models that haven't been cached yet).
 
 It would be nice to pass all unparsed options through to weblogo.  I'll have to 
 think a bit about how to do that.
@@ -29,7 +34,11 @@ def main():
     workspace = pipeline.ValidatedDesigns(root, round)
     workspace.check_paths()
 
-    designs = [structures.Design(x) for x in workspace.output_subdirs]
+    designs = structures.load_designs(
+            workspace.output_subdirs,
+            columns=['sequence'],
+            workers=int(args['--jobs'] or 1),
+    )
     sequences = corebio.seq.SeqList(
             [corebio.seq.Seq(x.resfile_sequence) for x in designs],
             alphabet=corebio.seq.unambiguous_protein_alphabet,
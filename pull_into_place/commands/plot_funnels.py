@@ -18,6 +18,10 @@ Options:
     -q, --quiet
         Build the cache, but don't launch the GUI.
 
+    -j, --jobs NUM
+        Use the given number of processes to build the caches for all the
+        given directories at once, before launching the GUI.
+
 This command launches a GUI designed to visualize the results for the loop
 modeling simulations in PIP and to help you identify promising designs.  To
 this end, the following features are supported:
@@ -70,7 +74,9 @@ containing the model in question and going down all the way to the root of the
 file system.  Any scripts that are found are added to the menu you get by
 right-clicking on a point, using simple rules (the first letter is capitalized
 and underscores are converted to spaces) to convert the file name into a menu
-item name.
+item name.  If only the metrics for a directory were fetched (see the
+--metrics-only option to fetch_data), each model is downloaded the first time
+any of these actions are taken on it.
 
 The tool bar below the plot can be used to pan around, zoom in or out, save an
 image of the plot, or change the axes.  If the mouse is over the plot, its
@@ -92,7 +98,7 @@ Hotkeys:
     escape: Unfocus the search and description forms.
 """
 
-import os, glob, yaml, numpy as np
+import os, glob, numpy as np
 from .. import pipeline, structures
 
 def main():
@@ -116,20 +122,32 @@ def main():
                     require_io_dir=False,
             )
 
-    try:
-        workspace = pipeline.workspace_from_dir(args['<pdb_directories>'][0])
-    except pipeline.WorkspaceNotFound:
-        raise IOError("'{}' is not a workspace".format(pdb_dir))
+            # show_my_designs treats every column that isn't an object (i.e.
+            # isn't a string) as a metric that can be plotted, so undo the
+            # categorical columns that load() makes to save memory.
+
+            for name in structures.categorical_columns:
+                if name in self._models:
+                    self._models[name] = self._models[name].astype(object)
 
-    filter_path = workspace.filters_list
     smd.gui.Design = PipDesign
 
+    # Every action that opens a model (i.e. the ``*.sho`` scripts and the
+    # pymol and chimera menu items) runs a command with the path to the model
+    # as its last argument.  Download the model first, in case only the
+    # metrics were fetched.
+
+    def try_to_run_command(command, run=smd.gui.try_to_run_command):
+        pipeline.fetch_models(command[-1:])
+        run(command)
+
+    smd.gui.try_to_run_command = try_to_run_command
+
     try:
-        with open(filter_path,'r') as file:
-            records = yaml.load(file)
-    except IOError:
-        with open(filter_path,'w') as file:
-            records = []
+        records = pipeline.load_filters(args['<pdb_directories>'][0])
+    except pipeline.WorkspaceNotFound:
+        raise IOError("'{}' is not a workspace".format(
+            args['<pdb_directories>'][0]))
 
     smd.default_x_metric = 'restraint_dist'
     smd.default_y_metric = 'total_score'
@@ -151,9 +169,23 @@ def main():
     smd.metric_guides['restraint_dist'] = 1.0
     smd.metric_guides['loop_dist'] = 1.0
 
+    # Build (or update) the caches for all the directories at once, so the
+    # GUI only has to read them.
+
+    use_cache = not args['--force']
+
+    if args['--jobs']:
+        structures.load_many(
+                args['<pdb_directories>'],
+                workers=int(args['--jobs']),
+                use_cache=use_cache,
+                require_io_dir=False,
+        )
+        use_cache = True
+
     smd.show_my_designs(
             args['<pdb_directories>'],
-            use_cache=not args['--force'],
+            use_cache=use_cache,
             launch_gui=not args['--quiet'],
             fork_gui=not args['--no-fork'],
     )
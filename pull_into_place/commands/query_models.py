@@ -0,0 +1,98 @@
+#!/usr/bin/env python2
+
+"""\
+Find the models in a workspace meeting the given queries, across every stage 
+and round of the design pipeline.  This uses a database of metrics that is 
+kept up to date whenever models are cached, so it's fast even when the 
+workspace contains hundreds of thousands of models.
+
+Usage:
+    pull_into_place query_models <workspace> [<queries>...] [options]
+
+Options:
+    --stage STAGE, -s STAGE
+        Only consider models from the given stage of the pipeline, which must 
+        be one of "restrained_models", "fixbb_designs", or "validated_designs".
+
+    --round NUM, -r NUM
+        Only consider models from the given round of design.
+
+    --update, -u
+        Cache any models that haven't been cached yet before running the query.
+
+    --recalc, -f
+        Recalculate all the metrics for every model in the workspace before 
+        running the query.  This implies --update.
+
+    --jobs NUM, -j NUM
+        Use the given number of processes to calculate metrics for models that 
+        haven't been cached yet.
+
+    --count, -c
+        Only print the number of models meeting the queries.
+
+    --fetch
+        Download any of the models meeting the queries that haven't been 
+        downloaded yet, i.e. because only their metrics were fetched.
+
+Queries:
+    Each query is an SQL expression, which for simple comparisons is the same 
+    as the query syntax used by the other commands.  Only models that satisfy 
+    every query are included.  Metrics with spaces or other special characters 
+    in their names (e.g. custom filters) must be enclosed in double quotes.  
+    Some example query strings:
+
+    'restraint_dist < 1.0'
+    'total_score < -300 and buried_unsat_score <= 4'
+    '"[[+]]PackStat Score" > 0.67'
+"""
+
+from klab import docopt, scripting
+from .. import pipeline, database
+
+@scripting.catch_and_print_errors()
+def main():
+    args = docopt.docopt(__doc__)
+    workspace = pipeline.Workspace(args['<workspace>'])
+    query = ' and '.join('({0})'.format(x) for x in args['<queries>'])
+
+    if args['--update'] or args['--recalc']:
+        database.sync(
+                workspace,
+                use_cache=not args['--recalc'],
+                workers=int(args['--jobs'] or 1),
+        )
+
+    # Let the database count the models, unless they have to be fetched, in
+    # which case their paths are needed anyway.
+
+    if args['--count'] and not args['--fetch']:
+        print database.count(
+                workspace, query,
+                stage=args['--stage'],
+                round=args['--round'],
+        )
+        return
+
+    columns = ['path']
+    if not args['--count']:
+        columns += ['stage', 'round', 'total_score', 'restraint_dist']
+
+    models = database.query(
+            workspace, query,
+            columns=columns,
+            stage=args['--stage'],
+            round=args['--round'],
+    )
+
+    if args['--fetch']:
+        import os
+        pipeline.fetch_models(
+                os.path.join(workspace.root_dir, x) for x in models['path'])
+
+    if args['--count']:
+        print len(models)
+    else:
+        import pandas as pd
+        with pd.option_context('display.max_colwidth', 1000):
+            print models.to_string(index=False)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python2
+
+"""\
+Recalculate the restraint distance for every model in a workspace, e.g. after 
+changing the restraints file.  This uses the coordinates that were stored when 
+the models were cached, so the PDB files only have to be read for models that 
+are missing some of the restrained atoms (e.g. atoms that weren't restrained 
+before).  By default the new distances replace the "restraint_dist" metric, 
+but they can instead be saved under a different name so that different sets 
+of restraints can be compared side by side.
+
+Usage:
+    pull_into_place rescore_restraints <workspace> [<directories>...] [options]
+
+Options:
+    -r PATH, --restraints PATH
+        Use the given restraints file instead of the one in the workspace.
+
+    -c NAME, --column NAME
+        Save the new distances under the given name rather than replacing the 
+        "restraint_dist" metric.  The name can be used in queries like any 
+        other metric.
+
+    -j NUM, --jobs NUM
+        Use the given number of processes to read any PDB files that need to be 
+        read, either because they haven't been cached yet or because they're 
+        missing some of the restrained atoms.
+
+If no directories are given, every output directory in the workspace (i.e. 
+from every stage and round of the pipeline) is rescored.
+"""
+
+import os, glob
+from klab import docopt, scripting
+from .. import pipeline, structures, database
+
+@scripting.catch_and_print_errors()
+def main():
+    args = docopt.docopt(__doc__)
+    workspace = pipeline.Workspace(args['<workspace>'])
+    directories = args['<directories>'] or [
+            x for x in database.output_dirs(workspace)
+            if glob.glob(os.path.join(x, '*.pdb.gz'))]
+
+    for directory in directories:
+        distances = structures.rescore_restraints(
+                directory,
+                restraints_path=args['--restraints'],
+                column=args['--column'] or 'restraint_dist',
+                workers=int(args['--jobs'] or 1),
+        )
+        print "Rescored {} models in '{}'".format(
+                len(distances), os.path.relpath(directory))
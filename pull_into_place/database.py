@@ -0,0 +1,290 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+
+"""\
+This module keeps a single SQLite database of the metrics calculated for every
+model in a workspace, from the restrained models through the validated designs
+of every round.  The per-directory caches made by ``structures.load()`` remain
+the primary source of these metrics; the database is a secondary index that is
+updated whenever one of those caches changes.  Its purpose is to make queries
+spanning many directories (e.g. "every validated model with a restraint
+distance less than 1Å") fast, by answering them with indexed lookups rather
+than by loading every directory into a pandas data frame.
+
+Each model is identified by its path relative to the workspace root and is
+labeled with the stage of the pipeline it came from (``restrained_models``,
+``fixbb_designs``, or ``validated_designs``), the round (which is null for
+restrained models), and the design (which is the name of the output
+subdirectory for validated designs and null otherwise).  Every metric gets its
+own column.  Note that SQLite relies on file locking, which may not be
+reliable on some network file systems.
+"""
+
+import os, glob, sqlite3
+from . import pipeline
+
+# Metrics that are indexed.  Queries involving other metrics still work, but
+# have to scan every model.
+indexed_metrics = 'total_score', 'restraint_dist'
+
+def connect(workspace):
+    """
+    Open the metrics database for the given workspace.  This doesn't create
+    the tables, so that reading the database never has to wait for (or take)
+    the write lock; that's left to update() (see create_tables()).
+    """
+    return sqlite3.connect(workspace.metrics_db_path, timeout=60)
+
+def create_tables(db):
+    """
+    Create the models table and its indices, if they don't exist yet.  This
+    should be called after taking the write lock, in case other processes are
+    trying to create the tables at the same time.
+    """
+    db.execute("""\
+CREATE TABLE IF NOT EXISTS models (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    round INTEGER,
+    design TEXT,
+    total_score REAL,
+    restraint_dist REAL,
+    sequence TEXT
+)""")
+    db.execute('CREATE INDEX IF NOT EXISTS models_directory '
+               'ON models (directory)')
+    db.execute('CREATE INDEX IF NOT EXISTS models_stage_round '
+               'ON models (stage, round)')
+    for name in indexed_metrics:
+        db.execute('CREATE INDEX IF NOT EXISTS {0} ON models ({1})'.format(
+            quote('models_' + name), quote(name)))
+
+def has_tables(db):
+    """
+    Return true if the models table has been created yet.
+    """
+    return db.execute(
+            "SELECT COUNT(*) FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'models'").fetchone()[0] > 0
+
+def update(directory, records, workspace=None):
+    """
+    Replace the models in the database that came from the given directory
+    with the given records, which should be a data frame as returned by
+    ``structures.load()``.  Directories that aren't output directories (e.g.
+    input directories, which only contain symlinks to the outputs of the
+    previous step) are not included in the database.
+    """
+    if workspace is None:
+        workspace = pipeline.workspace_from_dir(directory)
+
+    stage, round, design = describe_directory(workspace, directory)
+    if stage is None:
+        return
+
+    rel_dir = os.path.relpath(directory, workspace.root_dir)
+    paths = [os.path.join(rel_dir, x) for x in records['path']]
+    metrics = [x for x in records.columns if x != 'path']
+    columns = ['path', 'directory', 'stage', 'round', 'design'] + metrics
+
+    def rows():
+        values = [records[x].values for x in metrics]
+        for i, path in enumerate(paths):
+            row = [path, rel_dir, stage, round, design]
+            row += [to_sql(x[i]) for x in values]
+            yield row
+
+    # Take the write lock before creating the tables or looking at which
+    # columns they have, so that other processes updating the database at the
+    # same time (e.g. to load other directories) can't add the same columns
+    # in the meantime.  The transaction is managed by hand, because otherwise
+    # the sqlite3 module would commit it before adding any columns.
+
+    db = connect(workspace)
+    db.isolation_level = None
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            create_tables(db)
+            add_columns(db, records[metrics])
+            db.execute('DELETE FROM models WHERE directory = ?', (rel_dir,))
+            db.executemany(
+                    'INSERT OR REPLACE INTO models ({0}) VALUES ({1})'.format(
+                        ', '.join(quote(x) for x in columns),
+                        ', '.join('?' for x in columns)),
+                    rows())
+        except:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+    finally:
+        db.close()
+
+def num_models(directory, workspace=None):
+    """
+    Return the number of models in the database from the given directory.
+    """
+    if workspace is None:
+        workspace = pipeline.workspace_from_dir(directory)
+    if not os.path.exists(workspace.metrics_db_path):
+        return 0
+
+    rel_dir = os.path.relpath(directory, workspace.root_dir)
+    db = connect(workspace)
+    try:
+        if not has_tables(db):
+            return 0
+        return db.execute(
+                'SELECT COUNT(*) FROM models WHERE directory = ?',
+                (rel_dir,)).fetchone()[0]
+    finally:
+        db.close()
+
+def query(workspace, where=None, columns=None, stage=None, round=None):
+    """
+    Return a data frame of the models in the given workspace that satisfy the
+    given SQL expression (e.g. "restraint_dist < 1.0"), optionally limited to
+    a particular stage and/or round.  By default every column is returned, but
+    a list of column names can be given instead.  If nothing has been added
+    to the database yet, the data frame is empty.
+    """
+    import pandas as pd
+
+    if not os.path.exists(workspace.metrics_db_path):
+        return pd.DataFrame(columns=columns or [])
+
+    conditions, params = where_clause(where, stage, round)
+    sql = 'SELECT {0} FROM models'.format(
+            ', '.join(quote(x) for x in columns) if columns else '*')
+    sql += conditions
+
+    db = connect(workspace)
+    try:
+        if not has_tables(db):
+            return pd.DataFrame(columns=columns or [])
+        return pd.read_sql_query(sql, db, params=params)
+    finally:
+        db.close()
+
+def count(workspace, where=None, stage=None, round=None):
+    """
+    Return the number of models that query() would return for the same
+    arguments, without reading any of them.
+    """
+    if not os.path.exists(workspace.metrics_db_path):
+        return 0
+
+    conditions, params = where_clause(where, stage, round)
+    db = connect(workspace)
+    try:
+        if not has_tables(db):
+            return 0
+        return db.execute(
+                'SELECT COUNT(*) FROM models' + conditions,
+                params).fetchone()[0]
+    finally:
+        db.close()
+
+def where_clause(where=None, stage=None, round=None):
+    """
+    Return the WHERE clause (which is empty if there are no conditions) and
+    the parameters for a query limited to models that satisfy the given SQL
+    expression and come from the given stage and/or round.
+    """
+    conditions, params = [], []
+    if where:
+        conditions.append('({0})'.format(where))
+    if stage is not None:
+        conditions.append('stage = ?')
+        params.append(stage)
+    if round is not None:
+        conditions.append('round = ?')
+        params.append(int(round))
+
+    if not conditions:
+        return '', params
+    return ' WHERE ' + ' AND '.join(conditions), params
+
+def sync(workspace, use_cache=True, workers=None):
+    """
+    Make sure every output directory in the given workspace is represented in
+    the database, calculating metrics for any models that haven't been cached
+    yet.  Directories that were cached without updating the database (e.g.
+    by cluster jobs) are added now, even if their caches are up to date.
+    """
+    from . import structures
+
+    for directory in output_dirs(workspace):
+        if glob.glob(os.path.join(directory, '*.pdb.gz')) or \
+                pipeline.read_remote_models(directory):
+            records = structures.load(
+                    directory, use_cache=use_cache, workers=workers)
+            if num_models(directory, workspace) != len(records):
+                structures.update_database(directory, records, workspace)
+
+def output_dirs(workspace):
+    """
+    Return every output directory in the given workspace, in pipeline order.
+    """
+    import itertools
+
+    root = workspace.root_dir
+    dirs = pipeline.RestrainedModels(root).output_subdirs
+
+    for round in itertools.count(1):
+        fixbb = pipeline.FixbbDesigns(root, round)
+        validated = pipeline.ValidatedDesigns(root, round)
+        if not fixbb.exists() and not validated.exists():
+            break
+        dirs += fixbb.output_subdirs + validated.output_subdirs
+
+    return dirs
+
+def describe_directory(workspace, directory):
+    """
+    Return the stage, round, and design that the models in the given
+    directory belong to, or (None, None, None) if the directory isn't an
+    output directory.
+    """
+    is_output_dir = any(
+            os.path.exists(x) and os.path.samefile(directory, x)
+            for x in workspace.output_subdirs)
+    if not is_output_dir:
+        return None, None, None
+
+    if isinstance(workspace, pipeline.RestrainedModels):
+        return 'restrained_models', None, None
+    if isinstance(workspace, pipeline.FixbbDesigns):
+        return 'fixbb_designs', workspace.round, None
+    if isinstance(workspace, pipeline.ValidatedDesigns):
+        design = os.path.basename(os.path.normpath(directory))
+        return 'validated_designs', workspace.round, design
+
+    return None, None, None
+
+def add_columns(db, records):
+    """
+    Add a column to the models table for each metric in the given data frame
+    that doesn't already have one.
+    """
+    existing = set(x[1] for x in db.execute('PRAGMA table_info(models)'))
+    for name in records.columns:
+        if name not in existing:
+            kind = 'REAL' if records[name].dtype.kind in 'biuf' else 'TEXT'
+            db.execute('ALTER TABLE models ADD COLUMN {0} {1}'.format(
+                quote(name), kind))
+
+def quote(name):
+    return '"{0}"'.format(name.replace('"', '""'))
+
+def to_sql(value):
+    """
+    Convert numpy scalars to the python types that sqlite understands, and NaN
+    to NULL.
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
@@ -79,6 +79,10 @@ class Workspace (object):
     def filters_list(self):
         return os.path.join(self.root_dir, 'filters.yaml')
 
+    @property
+    def metrics_db_path(self):
+        return os.path.join(self.root_dir, 'metrics.db')
+
     @property
     def rosetta_dir(self):
         return self.find_path('rosetta')
@@ -330,7 +334,7 @@ class BigJobWorkspace (Workspace):
     @property
     def rsync_exclude_patterns(self):
         parent_patterns = super(BigJobWorkspace, self).rsync_exclude_patterns
-        return parent_patterns + ['stderr/', 'stdout/', '*.sc']
+        return parent_patterns + ['stderr/', 'stdout/']
 
     def job_params_path(self, job_id):
         return os.path.join(self.focus_dir, '{0}.json'.format(job_id))
@@ -600,7 +604,72 @@ def load_resfile(directory, resfile_path=None):
     from klab.rosetta.input_files import Resfile
     return Resfile(resfile_path)
 
-def fetch_data(directory, remote_url=None, include_logs=False, dry_run=False):
+def load_filters(directory, filters_path=None):
+    """
+    Return a list of the custom filters (i.e. the "EXTRA_SCORE_" metrics) that
+    have been found in any of the models in the workspace containing the given
+    directory.  The list is empty if no filters have been found yet.
+    """
+    import yaml
+
+    if filters_path is None:
+        workspace = workspace_from_dir(directory)
+        filters_path = workspace.filters_list
+
+    try:
+        with open(filters_path) as file:
+            return yaml.safe_load(file) or []
+    except IOError:
+        return []
+
+def update_filters(directory, filters, filters_path=None):
+    """
+    Add any of the given filters that aren't already listed to the list of
+    custom filters for the workspace containing the given directory.  Several
+    processes may be caching models at the same time, so the list is updated
+    while holding a lock and the new list is renamed into place, so readers
+    never see a partially written file.
+    """
+    import yaml, fcntl
+
+    if filters_path is None:
+        workspace = workspace_from_dir(directory)
+        filters_path = workspace.filters_list
+
+    with open(filters_path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        known_filters = load_filters(directory, filters_path)
+        new_filters = [x for x in filters if x not in known_filters]
+        if not new_filters:
+            return
+
+        save_atomically(filters_path, lambda file:
+                yaml.safe_dump(known_filters + new_filters, file))
+
+def save_atomically(path, save):
+    """
+    Call the given function with a file object to write, then move the file
+    to the given path.  The file is written under a temporary name in the
+    same directory, so anyone reading the path will either see the old file or
+    the complete new one.
+    """
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    umask = os.umask(0); os.umask(umask)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            save(file)
+        os.chmod(temp_path, 0666 & ~umask)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+def fetch_data(directory, remote_url=None, include_logs=False, dry_run=False,
+        metrics_only=False):
     import os, subprocess
 
     workspace = workspace_from_dir(directory)
@@ -626,23 +695,28 @@ def fetch_data(directory, remote_url=None, include_logs=False, dry_run=False):
             '--exclude', 'rosetta',
             '--exclude', 'rsync_url',
             '--exclude', 'core.*',
+            '--exclude', 'metrics.journal',
+            '--exclude', remote_models_name,
     ]
     if not include_logs:
         rsync_command += [
                 '--exclude', 'stdout',
                 '--exclude', 'stderr',
-                '--exclude', '*.sc',
         ]
 
-    # This code is trying to combine the remote URL with a directory path.
-    # Originally I was just using os.path.join() to do this, but that caused a
-    # bug when the URL was something like "chef:".  This is supposed to specify
-    # a path relative to the user's home directory, but os.path.join() adds a
-    # slash and turns the path into an absolute path.
+    # Score files (*.sc) are always copied, because structures.load() reads
+    # the scores and filters from them instead of from the models.  If only
+    # metrics were asked for, the models themselves aren't copied at all.
+    # Instead, the models on the remote host are listed, so load() knows
+    # which models exist and fetch_models() can download them when they're
+    # actually needed.
 
-    sep = '' if remote_url.endswith(':') else '/'
-    remote_dir = os.path.normpath(
-            remote_url + sep + os.path.relpath(directory, workspace.parent_dir))
+    if metrics_only:
+        rsync_command += [
+                '--exclude', '*.pdb.gz',
+        ]
+
+    remote_dir = remote_path(workspace, directory, remote_url)
     rsync_command += [
             remote_dir + '/',
             directory,
@@ -653,12 +727,123 @@ def fetch_data(directory, remote_url=None, include_logs=False, dry_run=False):
     else:
         subprocess.call(rsync_command)
 
-def fetch_and_cache_data(directory, remote_url=None, include_logs=False):
+    if metrics_only and not dry_run:
+        list_remote_models(directory, remote_dir)
+
+def fetch_models(paths, remote_url=None, dry_run=False):
+    """
+    Download any of the given models that haven't been downloaded yet, e.g.
+    because only the metrics for the directories they're in were fetched.
+    Models that already exist are left alone, so it's cheap to call this
+    before opening any model.  Return the paths that were fetched.
+    """
+    import subprocess
+
+    missing = [os.path.abspath(x) for x in paths if not os.path.exists(x)]
+    models_by_workspace = {}
+
+    for path in missing:
+        workspace = workspace_from_dir(os.path.dirname(path))
+        models_by_workspace.setdefault(workspace.parent_dir, []).append(
+                (workspace, path))
+
+    for parent_dir, models in sorted(models_by_workspace.items()):
+        workspace = models[0][0]
+        url = remote_url if remote_url is not None else workspace.rsync_url
+        names = [os.path.relpath(path, parent_dir) for _, path in models]
+        rsync_command = [
+                'rsync', '-av', '--files-from=-',
+                remote_path(workspace, parent_dir, url) + '/',
+                parent_dir,
+        ]
+
+        if dry_run:
+            print ' '.join(rsync_command)
+            print '\n'.join('    ' + x for x in names)
+        else:
+            process = subprocess.Popen(rsync_command, stdin=subprocess.PIPE)
+            process.communicate('\n'.join(names) + '\n')
+
+    return missing
+
+def remote_path(workspace, directory, remote_url):
+    # This code is trying to combine the remote URL with a directory path.
+    # Originally I was just using os.path.join() to do this, but that caused a
+    # bug when the URL was something like "chef:".  This is supposed to specify
+    # a path relative to the user's home directory, but os.path.join() adds a
+    # slash and turns the path into an absolute path.
+
+    sep = '' if remote_url.endswith(':') else '/'
+    return os.path.normpath(
+            remote_url + sep + os.path.relpath(directory, workspace.parent_dir))
+
+def list_remote_models(directory, remote_dir):
+    """
+    Record the size and modification time of every model in the given remote
+    directory (and its subdirectories), so that the models can be accounted
+    for even though they haven't been downloaded.  The models are listed
+    (using ``rsync --list-only``) in a file in each local directory, which
+    read_remote_models() reads.  rsync only lists modification times to the
+    nearest second.
+    """
+    import subprocess, time
+
+    listing = subprocess.check_output([
+            'rsync', '-r', '--list-only',
+            '--include', '*/',
+            '--include', '*.pdb.gz',
+            '--exclude', '*',
+            remote_dir + '/',
+    ])
+    line_pattern = re.compile(
+            r'^-\S*\s+([\d,.]+)\s+(\d+/\d+/\d+ \d+:\d+:\d+)\s+(.*\.pdb\.gz)$')
+    models_by_dir = {}
+
+    for line in listing.splitlines():
+        match = line_pattern.match(line)
+        if not match:
+            continue
+        size, mtime, path = match.groups()
+        size = int(re.sub('[,.]', '', size))
+        mtime = int(time.mktime(time.strptime(mtime, '%Y/%m/%d %H:%M:%S')))
+        subdir, name = os.path.split(path)
+        models_by_dir.setdefault(subdir, {})[name] = size, mtime
+
+    for subdir, models in models_by_dir.items():
+        local_dir = os.path.join(directory, subdir)
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        with open(os.path.join(local_dir, remote_models_name), 'w') as file:
+            json.dump(models, file)
+
+def read_remote_models(directory):
+    """
+    Return a dictionary mapping the name of every model in the given directory
+    that exists on the remote host but hasn't been downloaded (see
+    list_remote_models()) to its size and modification time.
+    """
+    try:
+        with open(os.path.join(directory, remote_models_name)) as file:
+            models = json.load(file)
+    except (IOError, ValueError):
+        return {}
+
+    return dict(
+            (name, tuple(info)) for name, info in models.items()
+            if not os.path.exists(os.path.join(directory, name)))
+
+# The name of the file listing the models that are on the remote host but
+# haven't been downloaded.
+remote_models_name = 'remote_models.json'
+
+def fetch_and_cache_data(directory, remote_url=None, include_logs=False,
+        metrics_only=False):
     from . import structures
-    fetch_data(directory, remote_url, include_logs)
+    fetch_data(directory, remote_url, include_logs, metrics_only=metrics_only)
 
     # Don't try to cache anything if nothing has been downloaded yet.
-    if glob.glob(os.path.join(directory, '*.pdb*')):
+    if glob.glob(os.path.join(directory, '*.pdb*')) or \
+            read_remote_models(directory):
         structures.load(directory)
 
 def push_data(directory, remote_url=None, dry_run=False):
@@ -676,6 +861,7 @@ def push_data(directory, remote_url=None, dry_run=False):
             'rsync', '-avr',
             '--exclude', 'rosetta', '--exclude', 'rsync_url',
             '--exclude', 'stdout', '--exclude', 'stderr',
+            '--exclude', remote_models_name,
             directory + '/', remote_dir,
     ]
 
@@ -4,23 +4,89 @@
 This module provides a function that will read a directory of PDB files and
 return a pandas data frame containing a number of score, distance, and sequence
 metrics for each structure.  This information is also cached, because it takes
-a while to calculate up front.  Note that the cache files are pickles and seem
-to depend very closely on the version of pandas used to generate them.  For
-example, caches generated with pandas 0.15 can't be read by pandas 0.14.
+a while to calculate up front.  The cache is a ``*.npz`` file with one plain
+numpy array per column and a JSON description of the columns, so unlike the
+pickles that were used previously, it doesn't depend on the version of pandas
+(or python) that created it.  The coordinates of the restrained atoms and
+the loop backbone atoms in each structure are also kept, in memory-mappable
+``*.npy`` files next to the cache, so that they can be used again without
+having to re-read any PDB files.  The full per-residue score table of each
+structure can be kept in the same way, but only if asked for (see
+load_energies()).  The files themselves are read and written by the ``cache``
+module.
 """
 
-import sys, os, re, glob, collections, gzip, re, yaml
+import sys, os, re, glob, json, collections, gzip, zlib, sqlite3, struct, time
 import numpy as np, scipy as sp, pandas as pd
-from . import pipeline
+from klab.bio.basics import residue_type_3to1_map
+from . import pipeline, database, cache
 
 
-def load(pdb_dir, use_cache=True, job_report=None, require_io_dir=True):
+def load(pdb_dir, use_cache=True, job_report=None, require_io_dir=True,
+        workers=None, check_hash=False, in_progress_age=3600, columns=None,
+        groups=None, workspace=None, extractors=None, update_db=True):
     """
     Return a variety of score and distance metrics for the structures found in
-    the given directory.  As much information as possible will be cached.  Note
-    that new information will only be calculated for file names that haven't
-    been seen before.  If a file changes or is deleted, the cache will not be
-    updated to reflect this and you may be presented with stale data.
+    the given directory.  As much information as possible will be cached.  Each
+    cached record is stamped with the size and modification time of the file
+    it came from (and, if `check_hash` is true, a hash of the first block of
+    the file), so new information will only be calculated for files that are
+    new or have changed since they were cached.  Records for files that have
+    been deleted are dropped.  Structures that are symlinks to structures in
+    other directories reuse the metrics cached in those directories, if
+    there are any.  Likewise, metrics that were calculated by the cluster
+    jobs that made the structures (see write_sidecar()) are merged into the
+    cache rather than being calculated again.  If `workers` is greater than 1,
+    that many processes will be used to calculate metrics for the structures
+    that haven't been cached yet.
+
+    Structures that exist on the remote host but haven't been downloaded
+    (see pipeline.fetch_data()) are included if their metrics were fetched,
+    i.e. if they're in a cache, a sidecar, or a score file.  Their metrics are
+    kept as long as the remote files haven't changed, but metrics that can
+    only be calculated from the structures themselves are left blank until
+    they're downloaded (see pipeline.fetch_models()).
+
+    Files that can't be read are also remembered (along with their fingerprint
+    and the reason they couldn't be read), and skipped until they change.  The
+    exception is files that seem to be incomplete (i.e. empty or truncated)
+    and were modified less than `in_progress_age` seconds ago, which are
+    assumed to still be being written (or downloaded) and are tried again the
+    next time this function is called.
+
+    If a list of `columns` is given, only those metrics (plus the path of each
+    structure) are returned.  If the cache is up to date, only those columns
+    are read from it, which is much faster than loading everything when there
+    are a lot of custom filters or a lot of directories to load.  Metrics that
+    haven't been calculated for any structure are silently left out.
+
+    The metrics are calculated in groups (e.g. "scores", "sequence",
+    "restraints"; see MetricExtractor), and if a list of `groups` is given,
+    only those groups are calculated for structures that haven't been cached
+    yet.  By default, every group is calculated, unless `columns` is given, in
+    which case only the groups needed for those columns are.  If no groups are
+    needed (or an empty list is given), just the "scores" group is calculated,
+    so that every structure still gets a record.  Groups that are asked for
+    but were skipped when a structure was cached are calculated and added to
+    the cache without throwing away what was already there.
+
+    Structures that are listed in one of the score files (``*.sc``) that
+    Rosetta writes alongside its output get their scores and filters from
+    that file, which is much faster than reading the structures themselves.
+    The structures are then only read if metrics that can't be found in a
+    score file (e.g. sequences or restraint distances) are asked for.
+
+    If the workspace containing the given directory and/or the extractors
+    for that workspace (see ExtractorSet.from_workspace()) are already known,
+    they can be given so they don't have to be looked up and read again.
+    This is what load_many() does.
+
+    Unless `update_db` is false, the workspace's metrics database is updated
+    with the new records (see database.update()).  Cluster jobs shouldn't
+    update the database, because SQLite's locking isn't reliable on network
+    file systems.  Instead, the database is brought up to date by
+    database.sync() (e.g. with ``pull_into_place query_models --update``)
+    once the jobs are done.
     """
 
     # Make sure the given directory seems to be a reasonable place to look for
@@ -32,16 +98,18 @@ def load(pdb_dir, use_cache=True, job_report=None, require_io_dir=True):
         raise IOError("'{}' is not a directory".format(pdb_dir))
     if not os.listdir(pdb_dir):
         raise IOError("'{}' is empty".format(pdb_dir))
-    if not glob.glob(os.path.join(pdb_dir, '*.pdb*')):
+    remote_models = pipeline.read_remote_models(pdb_dir)
+    if not glob.glob(os.path.join(pdb_dir, '*.pdb*')) and not remote_models:
         raise IOError("'{}' doesn't contain any PDB files".format(pdb_dir))
 
     # The given directory must also be a workspace, so that the restraint file
     # can be found and used to calculate the "restraint_dist" metric later on.
 
-    try:
-        workspace = pipeline.workspace_from_dir(pdb_dir)
-    except pipeline.WorkspaceNotFound:
-        raise IOError("'{}' is not a workspace".format(pdb_dir))
+    if workspace is None:
+        try:
+            workspace = pipeline.workspace_from_dir(pdb_dir)
+        except pipeline.WorkspaceNotFound:
+            raise IOError("'{}' is not a workspace".format(pdb_dir))
     if require_io_dir and not any(
             os.path.samefile(pdb_dir, x) for x in workspace.io_dirs):
         raise IOError("'{}' is not an input or output directory".format(pdb_dir))
@@ -49,237 +117,2581 @@ def load(pdb_dir, use_cache=True, job_report=None, require_io_dir=True):
     # already been cached and which haven't.
 
     pdb_paths = glob.glob(os.path.join(pdb_dir, '*.pdb.gz'))
-    base_pdb_names = set(os.path.basename(x) for x in pdb_paths)
-    cache_path = os.path.join(pdb_dir, 'distances.pkl')
-    filter_path = workspace.filters_list
-
-    if use_cache and os.path.exists(cache_path):
-        try:
-            cached_records = pd.read_pickle(cache_path).to_dict('records')
-            cached_paths = set(x['path'] for x in cached_records)
-            uncached_paths = [
-                    pdb_path for pdb_path in pdb_paths
-                    if os.path.basename(pdb_path) not in cached_paths]
-        except:
-            print "Couldn't load '{}'".format(cache_path)
-            cached_records = []
-            uncached_paths = pdb_paths
+    if extractors is None:
+        extractors = ExtractorSet.from_workspace(workspace)
+    coord_atoms = extractors.coords
+
+    if groups is None and columns is not None:
+        groups = extractors.groups_for_columns(columns)
+    if groups is None:
+        groups = extractors.groups
+    groups = set(groups) or {'scores'}
+    fingerprints = dict(
+            (os.path.basename(x), fingerprint(x, check_hash))
+            for x in pdb_paths)
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+    journal_path = os.path.join(pdb_dir, 'metrics.journal')
+
+    if use_cache and columns is not None:
+        records = read_cached_columns(
+                cache_path, journal_path, fingerprints, columns, groups,
+                remote_models)
+        if records is not None:
+            return records
+
+    cached_records = cache.empty_records()
+    cached_coords = cache.empty_coords(coord_atoms, 0)
+    schema = {}
+
+    if use_cache:
+        cached_records, cached_coords, schema = \
+                read_cached_records(pdb_dir, coord_atoms)
+
+    cached_failures = schema.get('failures', [])
+    merged_sidecars = schema.get('sidecars', [])
+
+    # Merge in the metrics that were calculated by the cluster jobs that made
+    # these structures (see write_sidecar()).  If the cache isn't being used,
+    # everything is recalculated anyway, so the sidecars are just remembered.
+
+    sidecars, unmerged_sidecars = find_sidecars(pdb_dir, merged_sidecars)
+    if not use_cache:
+        unmerged_sidecars = []
+
+    sidecar_records, sidecar_coords, sidecar_failures = cache.read_sidecars(
+            workspace, unmerged_sidecars, coord_atoms)
+    cached_failures += sidecar_failures
+
+    if len(sidecar_records):
+        cached_records, cached_coords = cache.concat_records(
+                [cached_records, sidecar_records],
+                [cached_coords, sidecar_coords])
+
+    # If a previous attempt to build the cache was interrupted, pick up the
+    # records it managed to calculate from the journal.  These are newer than
+    # anything in the cache, so they take precedence.
+
+    num_journal_records = 0
+
+    if use_cache:
+        journal_records, journal_coords = \
+                cache.read_journal(journal_path, coord_atoms)
+        num_journal_records = len(journal_records)
+        if num_journal_records:
+            print "Resuming from '{}' ({} records)".format(
+                    journal_path, len(journal_records))
+            cached_records, cached_coords = cache.concat_records(
+                    [cached_records, journal_records],
+                    [cached_coords, journal_coords])
+    elif os.path.exists(journal_path):
+        os.remove(journal_path)
+
+    if len(cached_records):
+        latest = ~cached_records['path'].duplicated(keep='last').values
+        cached_records, cached_coords = cache.take_records(
+                cached_records, cached_coords, latest)
+
+    # Structures that haven't been downloaded can't be fingerprinted, but
+    # cached records that agree with what's known about the remote files are
+    # kept.
+
+    fingerprints.update(match_remote_models(cached_records, remote_models))
+
+    # Throw out any cached records for files that have been deleted or changed
+    # since they were cached.  The files that are left over (i.e. those that
+    # are new or have changed) need to be read.
+
+    num_stale_records = len(cached_records)
+    cached_records, cached_coords = cache.take_records(
+            cached_records, cached_coords,
+            match_fingerprints(cached_records, fingerprints))
+    num_stale_records -= len(cached_records)
+
+    # Keep track of which restraints the records were calculated with, so
+    # other directories know whether they can reuse the metrics that depend
+    # on the restraints (see read_linked_records()).  The cache is trusted to
+    # go with the workspace's restraints unless it says otherwise, but if it
+    # does, it's no longer known which restraints were used.
+
+    restraints_digest = extractors.restraints.digest
+    if len(cached_records) and \
+            schema.get('restraints', restraints_digest) != restraints_digest:
+        restraints_digest = None
+
+    cached_failures = [
+            x for x in cached_failures
+            if fingerprint_matches(x, fingerprints.get(x['path']))]
+    if cached_failures:
+        print "Skipping {} models that couldn't be read last time.".format(
+                len(cached_failures))
+
+    num_sidecar_records = \
+            cached_records['path'].isin(sidecar_records['path']).sum()
+
+    cached_paths = set(cached_records['path'])
+    cached_paths.update(x['path'] for x in cached_failures)
+    uncached_paths = [
+            pdb_path for pdb_path in pdb_paths
+            if os.path.basename(pdb_path) not in cached_paths]
+
+    # Models that are symlinks to models in other directories (e.g. the inputs
+    # of each design step, which link to the outputs of the step before) can
+    # reuse the metrics cached for their targets, as long as the targets
+    # haven't changed since then.  These records are treated just like the
+    # ones from this directory's own cache, so they aren't used if the cache
+    # isn't.
+
+    if use_cache:
+        linked_records, linked_coords = read_linked_records(
+                uncached_paths, fingerprints, coord_atoms, extractors)
     else:
-        cached_records = []
-        uncached_paths = pdb_paths
-
-    # Calculate score and distance metrics for the uncached paths, then combine
-    # the cached and uncached data into a single data frame.
-    uncached_records = read_and_calculate(workspace, uncached_paths)
-    all_records = pd.DataFrame(cached_records + uncached_records)
-
-
-
-    # Make sure all the expected metrics were calculated.
+        linked_records, linked_coords = cache.empty_records(), None
+    num_linked_records = len(linked_records)
+
+    if num_linked_records:
+        cached_records, cached_coords = cache.concat_records(
+                [cached_records, linked_records],
+                [cached_coords, linked_coords])
+        linked_paths = set(linked_records['path'])
+        uncached_paths = [
+                pdb_path for pdb_path in uncached_paths
+                if os.path.basename(pdb_path) not in linked_paths]
+
+    # Get whatever metrics can be found in Rosetta's score files for the
+    # models that are still left.  These records only have some groups of
+    # metrics (e.g. no sequences or coordinates), so they're also treated like
+    # cached records, and the models are only read if the other groups are
+    # asked for (see below).
+
+    remote_paths = [
+            os.path.join(pdb_dir, x) for x in sorted(remote_models)
+            if x not in cached_paths]
+    scored_records = read_score_files(
+            workspace, pdb_dir, uncached_paths + remote_paths, extractors,
+            fingerprints)
+    num_scored_records = len(scored_records)
+
+    if num_scored_records:
+        stamp_fingerprints(scored_records, fingerprints)
+        cached_records, cached_coords = cache.concat_records(
+                [cached_records, scored_records],
+                [cached_coords,
+                    cache.empty_coords(coord_atoms, num_scored_records)])
+        scored_paths = set(scored_records['path'])
+        uncached_paths = [
+                pdb_path for pdb_path in uncached_paths
+                if os.path.basename(pdb_path) not in scored_paths]
+        remote_paths = [
+                pdb_path for pdb_path in remote_paths
+                if os.path.basename(pdb_path) not in scored_paths]
+
+    # Any structures that haven't been downloaded and still don't have any
+    # metrics are left out until they (or their metrics) are fetched.
+
+    num_unfetched = len(remote_paths)
+    if num_unfetched:
+        print "Skipping {} models that haven't been fetched yet.".format(
+                num_unfetched)
+
+    # Calculate score and distance metrics for the uncached paths.  New
+    # records are appended to the journal in batches as they're calculated, so
+    # that the work isn't lost if this process is interrupted.
+
+    def checkpoint(block):
+        records = block.to_frame()
+        stamp_fingerprints(records, fingerprints)
+        cache.append_journal(journal_path, records, block.coords)
+
+    failures = []
+    uncached_block = read_and_calculate(
+            workspace, uncached_paths, workers=workers, checkpoint=checkpoint,
+            extractors=extractors.select(groups), failures=failures)
+    uncached_records = uncached_block.to_frame()
+    uncached_coords = cache.conform_coords(
+            uncached_block.coords, coord_atoms, len(uncached_records))
+    stamp_fingerprints(uncached_records, fingerprints)
+
+    # Calculate any groups of metrics that were asked for but skipped when
+    # some of the cached records were made.
+
+    num_backfilled_records = backfill_groups(
+            workspace, pdb_dir, cached_records, cached_coords, groups,
+            extractors, remote_models, journal_path, workers)
+
+    # Remember which files couldn't be read, so they won't be read again
+    # until they change.  Files that might just not have been completely
+    # written yet are left to be tried again next time.
+
+    uncached_failures, num_deferred = sort_failures(
+            failures, fingerprints, in_progress_age)
+
+    # Combine the cached and uncached data into a single data frame, along
+    # with the coordinates, which are kept separately from the rest of the
+    # metrics in one array per set of atoms.
+
+    all_records, all_coords = cache.concat_records(
+            [cached_records, uncached_records],
+            [cached_coords, uncached_coords])
+
+    # Make sure all the expected metrics were calculated, at least for the
+    # groups that were asked for.  Structures that haven't been downloaded
+    # only have the metrics that could be fetched (e.g. from score files), so
+    # if they're the only structures, the metrics that have to be calculated
+    # from the structures themselves are just left blank.
 
     expected_metrics = [
-            'total_score',
-            'restraint_dist',
-            'sequence',
+            x for x in ['total_score', 'restraint_dist', 'sequence']
+            if groups.issuperset(extractors.groups_for_columns([x]))
     ]
+    unfetched_only = len(all_records) and \
+            all_records['path'].isin(list(remote_models)).all()
+
     for metric in expected_metrics:
-        if metric not in all_records:
-            print all_records.keys()
-            raise IOError("'{}' wasn't calculated for the models in '{}'".format(metric, pdb_dir))
+        if metric in all_records:
+            continue
+        if unfetched_only and metric != 'total_score':
+            all_records[metric] = np.nan
+            continue
+        print all_records.keys()
+        raise IOError("'{}' wasn't calculated for the models in '{}'".format(metric, pdb_dir))
 
-    # If everything else looks good, cache the data frame so we can load faster
-    # next time.
+    all_records = all_records.reindex(columns=sorted(all_records.columns))
+    categorize(all_records)
 
-    all_records.to_pickle(cache_path)
+    # If everything else looks good, cache the data frame so we can load faster
+    # next time.  Once the cache is safely written, the journal is redundant.
+    # If nothing has changed since the cache was written, it's left alone.
+
+    num_changed_records = len(uncached_records) + num_stale_records + \
+            num_sidecar_records + num_linked_records + num_scored_records + \
+            num_backfilled_records
+
+    def sidecar_paths(sidecars):
+        return sorted((x['path'], x['file_size'], x['file_mtime'])
+                for x in sidecars)
+
+    cache_changed = num_changed_records or num_journal_records or \
+            uncached_failures or not use_cache or check_hash or \
+            schema.get('version') != cache.cache_version or \
+            schema.get('restraints') != restraints_digest or \
+            len(cached_failures) != len(schema.get('failures', [])) or \
+            sidecar_paths(sidecars) != sidecar_paths(merged_sidecars)
+
+    if cache_changed:
+        all_coords = collections.OrderedDict(
+                (k, cache.Coords(coord_atoms[k], v))
+                for k, v in all_coords.items())
+        cache.write_cache(cache_path, all_records, all_coords,
+                failures=cached_failures + uncached_failures,
+                sidecars=sidecars, restraints=restraints_digest)
+
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+
+    # Keep the workspace-wide metrics database up to date, but don't bother if
+    # the cache hasn't changed.  Records that are missing some of the metrics
+    # that come with PIP (e.g. because only a few columns were asked for) are
+    # kept out of the database until the rest of their metrics are calculated.
+    # Directories that were cached without updating the database (e.g. by
+    # cluster jobs) are caught up by database.sync().
+
+    records = all_records.drop(
+            [x for x in hidden_columns if x in all_records], axis=1)
+
+    if update_db and cache_changed and \
+            is_complete(all_records, extractors, remote_models) and (
+            num_changed_records or
+            database.num_models(pdb_dir, workspace) != len(records)):
+        update_database(pdb_dir, records, workspace)
 
     # Report how many structures had to be cached, in case the caller is
-    # interested, and return to loaded data frame.
+    # interested, and return to loaded data frame.  The fingerprints are only
+    # meaningful to the cache, so they aren't returned.
+
+    if columns is not None:
+        records = records[project_columns(records.columns, columns)]
 
     if job_report is not None:
         job_report['new_records'] = len(uncached_records)
-        job_report['old_records'] = len(cached_records)
+        job_report['old_records'] = len(cached_records) - \
+                num_sidecar_records - num_linked_records - num_scored_records
+        job_report['sidecar_records'] = num_sidecar_records
+        job_report['linked_records'] = num_linked_records
+        job_report['scored_records'] = num_scored_records
+        job_report['stale_records'] = num_stale_records
+        job_report['backfilled_records'] = num_backfilled_records
+        job_report['failed_records'] = len(cached_failures + uncached_failures)
+        job_report['deferred_records'] = num_deferred
+        job_report['unfetched_records'] = num_unfetched
 
-    return all_records
+    return records
 
-class Restraint(object):
-    # Class for defining restraints. atom1_coords and atom2_coords are for AtomPair constraints.
-    # This should allow for relatively easy implementation of additional constraint types.
-    def __init__(self):
-        self.restraint_type = None
-        self.atom_name = None
-        self.residue_id = None
-        self.atom2_name = None
-        self.residue2_id = None
-        self.position = None # For AtomPair constraints, position is the desired distance between atoms.
-        self.atom1_coords = None
-        self.atom2_coords = None
-
-def read_and_calculate(workspace, pdb_paths):
-    """
-    Calculate a variety of score and distance metrics for the given structures.
-    """
-
-    # Parse the given restraints file.  The restraints definitions are used to
-    # calculate the "restraint_dist" metric, which reflects how well each
-    # structure achieves the desired geometry. Note that this is calculated
-    # whether or not restraints were used to create the structures in question.
-    # For example, the validation runs don't use restraints but the restraint
-    # distance is a very important metric for deciding which designs worked.
-
-    restraints = []
-    filter_list = []
-    with open(workspace.restraints_path) as file:
-        for line in file:
-            if not line.startswith('#'):
-                fields = line.split()
-                restraint = Restraint()
-                restraint.restraint_type=fields[0]
-                restraint.atom_name=fields[1]
-                restraint.atom2_name=fields[3]
-                restraint.residue_id=fields[2]
-                restraint.residue2_id=fields[4]
-                restraint.position=None
-                if restraint.restraint_type == 'CoordinateConstraint':
-                    restraint.position=xyz_to_array(fields[5:8])
-                elif restraint.restraint_type=='AtomPair':
-                    restraint.position=float(fields[6])
-                restraints.append(restraint)
-
-
-            elif not line.strip():
-                pass
+def load_many(pdb_dirs, workers=None, **kwargs):
+    """
+    Return a list with the data frame returned by load() for each of the
+    given directories, in the same order.  The workspace and the extractors
+    (i.e. the restraints and loops) are only looked up once for all the
+    directories that share a parent directory, e.g. all the output
+    subdirectories of a round of validated designs.  If `workers` is greater
+    than 1, the directories are divided between that many processes, each of
+    which loads (or builds the cache for) one directory at a time.  Any extra
+    keyword arguments are passed on to load().
+    """
+    pdb_dirs = list(pdb_dirs)
+    return map_load(pdb_dirs, load_contexts(pdb_dirs), workers, kwargs)
+
+def load_designs(pdb_dirs, columns=None, workers=None, **kwargs):
+    """
+    Return a Design for each of the given directories, in the same order.  The
+    directories are loaded as they are by load_many(), and the loops and
+    resfile are likewise only read once for each parent directory.
+    """
+    pdb_dirs = list(pdb_dirs)
+    contexts = load_contexts(pdb_dirs)
+
+    if columns is not None:
+        columns = list(columns) + ['total_score']
+
+    records = map_load(
+            pdb_dirs, contexts, workers, dict(kwargs, columns=columns))
+    inputs = {}
+    designs = []
+
+    for pdb_dir, (workspace, extractors), structures in \
+            zip(pdb_dirs, contexts, records):
+        key = workspace.loops_path, workspace.resfile_path
+        if key not in inputs:
+            inputs[key] = (
+                    pipeline.load_loops(pdb_dir, workspace.loops_path),
+                    pipeline.load_resfile(pdb_dir, workspace.resfile_path))
+        loops, resfile = inputs[key]
+        designs.append(Design(
+            pdb_dir, structures=structures, loops=loops, resfile=resfile))
+
+    return designs
+
+def load_contexts(pdb_dirs):
+    """
+    Return a (workspace, extractors) tuple for each of the given directories,
+    which can be passed to load() so it doesn't have to look them up itself.
+    Directories with the same parent directory share the same tuple.
+    """
+    contexts = {}
+
+    for pdb_dir in pdb_dirs:
+        parent_dir = os.path.dirname(os.path.normpath(pdb_dir))
+        if parent_dir in contexts:
+            continue
+        try:
+            workspace = pipeline.workspace_from_dir(pdb_dir)
+        except pipeline.WorkspaceNotFound:
+            raise IOError("'{}' is not a workspace".format(pdb_dir))
+        contexts[parent_dir] = \
+                workspace, ExtractorSet.from_workspace(workspace)
+
+    return [
+            contexts[os.path.dirname(os.path.normpath(x))]
+            for x in pdb_dirs]
+
+def map_load(pdb_dirs, contexts, workers, kwargs):
+    """
+    Call load() for each of the given directories, with the given contexts
+    (see load_contexts()) and keyword arguments, and return the results in
+    order.  If `workers` is greater than 1, the directories are loaded by a
+    pool of that many processes.
+    """
+    tasks = [
+            (pdb_dir, workspace, extractors, kwargs)
+            for pdb_dir, (workspace, extractors) in zip(pdb_dirs, contexts)]
+
+    if workers > 1 and len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(
+                min(workers, len(tasks)), _init_load_worker)
+        try:
+            return pool.map(_load_worker, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    return [_load_worker(x) for x in tasks]
 
+def rescore_restraints(pdb_dir, restraints_path=None, column='restraint_dist',
+        workers=None):
+    """
+    Recalculate the restraint distance for every model in the given directory,
+    using the given restraints file (by default, the one in the workspace).
+    The coordinates stored alongside the cache are used, so the restraints can
+    be changed and re-evaluated without having to re-read every PDB file.  The
+    PDB files are only read for models missing some of the restrained atoms,
+    e.g. because they weren't restrained when the cache was made, and the new
+    coordinates are stored for next time.
+
+    The new distances are saved in the cache (and the metrics database) under
+    the given column name.  By default "restraint_dist" is replaced, but any
+    other name can be given to compare different sets of restraints side by
+    side.  A data frame with the path and the new distance of each model is
+    returned.
+    """
+    workspace = pipeline.workspace_from_dir(pdb_dir)
+    if restraints_path is None:
+        restraints_path = workspace.restraints_path
+    restraints = RestraintSet.from_file(restraints_path)
+
+    # Make sure every model has been cached, then get the stored coordinates
+    # of the atoms involved in the given restraints.
+
+    load(pdb_dir, workers=workers)
+
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+    records = cache.read_cache(cache_path)
+    all_coords = cache.read_all_coords(cache_path)
+    stored_coords = all_coords.get('restraint_coords') or cache.Coords(
+            [], np.empty((len(records), 0, 3), dtype=np.float32))
+
+    atoms = stored_coords.atoms + [
+            x for x in restraints.atom_keys if x not in stored_coords.atoms]
+    xyz = np.array(cache.remap_coords(stored_coords, atoms))
+
+    # Read any missing coordinates from the PDB files themselves.  Atoms that
+    # really aren't in some models will be looked for every time, but this is
+    # rare for atoms that are being restrained.
+
+    rows = [atoms.index(x) for x in restraints.atom_keys]
+    missing = np.isnan(xyz[:, rows]).any(axis=(1, 2))
+
+    if missing.any():
+        missing_paths = [
+                os.path.join(pdb_dir, x) for x in records['path'][missing]]
+        extractors = ExtractorSet(restraints, [RestraintExtractor])
+        fetched = read_and_calculate(
+                workspace, missing_paths, workers=workers,
+                extractors=extractors)
+        fetched_rows = dict(
+                (x, i) for i, x in enumerate(fetched.to_frame()['path']))
+        fetched_xyz = fetched.coords['restraint_coords']
+
+        for i in np.flatnonzero(missing):
+            if records['path'][i] in fetched_rows:
+                xyz[i, rows] = fetched_xyz[fetched_rows[records['path'][i]]]
+
+    # Evaluate the restraints for every model at once, then save the results
+    # and the coordinates that were read.
+
+    records[column] = restraints.calculate_restraint_dist(
+            xyz[:, rows].astype(float))
+    all_coords['restraint_coords'] = cache.Coords(atoms, xyz)
+
+    # If the restraint distances were replaced with ones calculated from
+    # different restraints, the other metrics that depend on the restraints
+    # (i.e. the Dunbrack scores) no longer go with either set.
+
+    restraints_digest = cache.read_schema(cache_path).get('restraints')
+    if column == 'restraint_dist' and restraints.digest != restraints_digest:
+        restraints_digest = None
+
+    cache.write_cache(cache_path, records, all_coords,
+            restraints=restraints_digest)
+    update_database(pdb_dir, records.drop(
+        [x for x in hidden_columns if x in records], axis=1), workspace)
+
+    return records[['path', column]]
+
+def load_energies(pdb_dir, workers=None, update_db=True):
+    """
+    Return the per-residue score table of every model in the given directory,
+    as an Energies tuple with a list of residue ids, a list of score terms,
+    and a float32 array of shape (num_models, num_residues, num_terms).  The
+    rows of the array correspond to the rows of the data frame returned by
+    load().  The array is memory mapped, so per-residue analyses spanning lots
+    of models (e.g. the average repulsive energy at each designable position)
+    are just numpy slices, and only the slices that are used are read.
+    `update_db` is passed on to load().
+
+    These tables are much bigger than the rest of the metrics put together,
+    so they're only extracted when this function is called (see
+    EnergyExtractor).  They're stored in ``metrics.energies.npy`` next to the
+    cache, and after that only models that are new or have changed have to be
+    read again.  The residues and terms are taken from the tables that were
+    already stored or, if there aren't any, from the first model that's read.
+    Any residues or terms missing from a model are NaN, and any that only
+    appear in some models after that are left out.
+    """
+    workspace = pipeline.workspace_from_dir(pdb_dir)
+
+    # Make sure every model has been cached, so the tables can be lined up
+    # with the rows of the cache.
+
+    load(pdb_dir, workers=workers, columns=['path'], update_db=update_db)
+
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+    records = cache.read_cache(cache_path, ['path', 'file_size', 'file_mtime'])
+    keys = zip(records['path'],
+            records['file_size'].tolist(), records['file_mtime'].tolist())
+
+    try:
+        stored_keys, stored = cache.read_energies(cache_path)
+    except cache.CacheError as error:
+        print error
+        stored_keys, stored = [], None
+
+    if stored is not None and stored_keys == keys:
+        return stored
+
+    # Reuse the tables of any models that haven't changed since they were
+    # stored, and read the rest.
+
+    stored_rows = dict((k, i) for i, k in enumerate(stored_keys))
+    missing_paths = [
+            os.path.join(pdb_dir, k[0]) for k in keys if k not in stored_rows]
+    extractors = ExtractorSet(
+            RestraintSet.from_file(workspace.restraints_path),
+            [EnergyExtractor])
+
+    if stored is not None:
+        residues, terms = stored.residues, stored.terms
+    else:
+        residues, terms = [], []
+        for path in missing_paths:
+            record = read_and_calculate_one(
+                    path, extractors, stop_after={'energies'})[1]
+            if record and 'energies' in record:
+                residues = record['energies'].residues
+                terms = record['energies'].terms
+                break
+
+    tables = read_energy_tables(
+            missing_paths, residues, terms, extractors, workers=workers)
+
+    def iter_tables():
+        for key in keys:
+            if key in stored_rows:
+                yield stored.table[stored_rows[key]]
             else:
-                print "Skipping unrecognized restraint: '{}...'".format(line[:46])
+                yield next(tables)
 
-    score_table_pattern = re.compile(r'^[A-Z]{3}(?:_[A-Z])?_([1-9]+) ')
+    cache.write_energies(cache_path, keys, residues, terms, iter_tables())
+    return cache.read_energies(cache_path)[1]
 
+def read_cached_columns(cache_path, journal_path, fingerprints, columns,
+        groups=(), remote_models=None):
+    """
+    Return a data frame with only the given columns from the given cache, or
+    None if the cache isn't up to date with the given fingerprints or doesn't
+    have all the given groups of metrics (in which case the cache needs to be
+    updated the slow way).  Any structures that haven't been downloaded
+    should be described by `remote_models` (see match_remote_models()).
+    """
+    if not os.path.exists(cache_path) or os.path.exists(journal_path):
+        return None
 
-    # Calculate score and distance metrics for each structure.
+    try:
+        records = cache.read_cache(cache_path,
+                ['path', 'metric_groups'] + list(fingerprint_columns) +
+                list(columns))
+        failures = cache.read_failures(cache_path)
+    except cache.CacheError:
+        return None
+
+    if remote_models:
+        fingerprints = fingerprints.copy()
+        fingerprints.update(match_remote_models(records, remote_models))
+
+    # Every file must either have a cached record or a cached failure, and
+    # every fingerprint must match.  Records without fingerprints are left
+    # for load() to stamp.
+
+    paths = list(records['path']) + [x['path'] for x in failures]
+    if len(paths) != len(fingerprints) or set(paths) != set(fingerprints):
+        return None
+
+    if 'file_size' not in records or 'file_mtime' not in records:
+        return None
+
+    info = [fingerprints[x] for x in records['path']]
+    if (records['file_size'].values != [x['file_size'] for x in info]).any():
+        return None
+    if (records['file_mtime'].values != [x['file_mtime'] for x in info]).any():
+        return None
+
+    if any('file_hash' in x for x in info):
+        if 'file_hash' not in records:
+            return None
+        if (records['file_hash'].values != [x['file_hash'] for x in info]).any():
+            return None
+
+    for failure in failures:
+        if not fingerprint_matches(failure, fingerprints[failure['path']]):
+            return None
+
+    if 'metric_groups' in records:
+        for key in records['metric_groups'].unique():
+            if pd.isnull(key) or not set(groups).issubset(key.split(',')):
+                return None
+
+    categorize(records)
+    return records[project_columns(records.columns, columns)]
+
+def project_columns(available, columns):
+    """
+    Return the path column followed by whichever of the given columns are
+    available, in the order they were given.
+    """
+    return ['path'] + [x for x in columns if x != 'path' and x in available]
 
-    records = []
-    from scipy.spatial.distance import euclidean
-    from klab.bio.basics import residue_type_3to1_map
+def categorize(records):
+    """
+    Convert any of the columns that are expected to have lots of repeated
+    values (see categorical_columns) to categorical columns, in place.
+    Columns read from the cache are usually categorical already.
+    """
+    for name in categorical_columns:
+        if name in records and not cache.is_categorical(records[name]):
+            records[name] = records[name].astype('category')
 
-    for i, path in enumerate(pdb_paths):
-        record = {'path': os.path.basename(path)}
-        sequence = ""
-        last_residue_id = None
-        dunbrack_index = None
-        dunbrack_scores = []
-        restraint_distances = []
-        # Update the user on our progress, because this is often slow.
+def parse_groups(key, extractors):
+    """
+    Return the set of metric groups described by the given key, which lists
+    the groups that were calculated for a record.  Records cached before
+    metrics were calculated in groups (i.e. with a null key) have all the
+    groups that come with PIP.
+    """
+    if key is None or key != key:
+        return set(
+                group_name(x) for x in extractors
+                if type(x) in builtin_extractors)
+    return set(key.split(',')) if key else set()
+
+def merge_block(records, coords, block, rows_by_path, extractors):
+    """
+    Add the metrics in the given block, which were calculated for structures
+    that are already in the given records but with different groups of
+    metrics, to those records (and coordinates) in place.  Return the rows
+    that were updated.
+    """
+    new_records = block.to_frame()
+    rows = np.array(
+            [rows_by_path[x] for x in new_records['path']], dtype=int)
+
+    if not len(rows):
+        return rows
+
+    for name in new_records.columns:
+        if name in ('path', 'metric_groups'):
+            continue
+        if name not in records:
+            records[name] = np.nan
+        if cache.is_categorical(records[name]):
+            records[name] = records[name].astype(object)
+        records.iloc[rows, records.columns.get_loc(name)] = \
+                new_records[name].values
+
+    old_keys = records['metric_groups'].values[rows]
+    new_keys = new_records['metric_groups'].values
+    records.iloc[rows, records.columns.get_loc('metric_groups')] = [
+            ','.join(sorted(
+                parse_groups(a, extractors) | parse_groups(b, extractors)))
+            for a, b in zip(old_keys, new_keys)]
+
+    for name, xyz in block.coords.items():
+        coords[name][rows, :xyz.shape[1]] = xyz
+
+    return rows
+
+def read_cached_records(pdb_dir, atoms_by_name):
+    """
+    Return the records (and coordinates, for each of the given sets of atoms)
+    cached for the given directory, along with the schema of the cache (see
+    cache.write_cache()).  If there's no cache, or it can't be read, nothing
+    is returned.
+    """
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+    legacy_cache_path = os.path.join(pdb_dir, 'distances.pkl')
+
+    if os.path.exists(cache_path):
+        try:
+            return cache.read_cache_and_coords(cache_path, atoms_by_name)
+        except cache.CacheError as error:
+            print error
+
+    # Caches made by older versions of this script were pickled data frames.
+    # Use them if they can be read with the version of pandas that's
+    # installed; they'll be saved in the new format by load().
+
+    elif os.path.exists(legacy_cache_path):
+        try:
+            records = pd.read_pickle(legacy_cache_path)
+            records = records.reset_index(drop=True)
+            return records, cache.empty_coords(atoms_by_name, len(records)), {}
+        except:
+            print "Couldn't load '{}'".format(legacy_cache_path)
+
+    return cache.empty_records(), cache.empty_coords(atoms_by_name, 0), {}
+
+def find_sidecars(pdb_dir, merged_sidecars):
+    """
+    Return a list describing every sidecar (see write_sidecar()) in the given
+    directory, and a list of the paths to the ones that haven't been merged
+    into the cache yet.  The sidecars are fetched along with the structures
+    every time, so the ones that have already been merged are remembered in
+    the cache and skipped.  Only the sidecars that still exist are
+    remembered, so sidecars that have been deleted (e.g. by pip_cache.py) are
+    forgotten.
+    """
+    def sidecar_key(info):
+        return info['path'], info['file_size'], info['file_mtime']
+
+    sidecars = [
+            dict(path=os.path.basename(x), **fingerprint(x))
+            for x in glob.glob(os.path.join(pdb_dir, 'metrics.*.sidecar'))]
+    merged_keys = set(sidecar_key(x) for x in merged_sidecars)
+    unmerged_sidecars = [
+            os.path.join(pdb_dir, x['path'])
+            for x in sidecars if sidecar_key(x) not in merged_keys]
+
+    return sidecars, unmerged_sidecars
+
+def backfill_groups(workspace, pdb_dir, records, coords, groups, extractors,
+        remote_models, journal_path, workers=None):
+    """
+    Calculate any of the given groups of metrics that the given records
+    don't have yet (e.g. because they weren't asked for when the records were
+    cached), and merge them into the records (and coordinates) in place.  The
+    merged records are journaled as they're calculated, like new records are.
+    Structures that haven't been downloaded are skipped.  Return the number
+    of records that were updated.
+    """
+    missing_groups = collections.defaultdict(list)
+
+    if len(records):
+        if 'metric_groups' not in records:
+            records['metric_groups'] = np.nan
+        keys = records['metric_groups'].values
+        fetched = ~records['path'].isin(list(remote_models)).values
+        for key in pd.unique(keys):
+            missing = groups - parse_groups(key, extractors)
+            if missing:
+                rows = np.flatnonzero(fetched & (
+                        pd.isnull(keys) if pd.isnull(key) else keys == key))
+                missing_groups[frozenset(missing)].extend(rows)
+
+    num_backfilled = 0
+
+    for missing, rows in missing_groups.items():
+        paths = records['path'].values[rows]
+        rows_by_path = dict(zip(paths, rows))
+
+        def checkpoint(block):
+            merged_rows = merge_block(
+                    records, coords, block, rows_by_path, extractors)
+            cache.append_journal(journal_path, *cache.take_records(
+                    records, coords, merged_rows))
+
+        num_backfilled += len(read_and_calculate(
+                workspace, [os.path.join(pdb_dir, x) for x in paths],
+                workers=workers, checkpoint=checkpoint,
+                extractors=extractors.select(missing)))
+
+    return num_backfilled
+
+def sort_failures(failures, fingerprints, in_progress_age):
+    """
+    Return a list describing each of the given (path, ReadFailure) tuples
+    that should be remembered in the cache (see cache.read_failures()), and
+    the number that were left out because the files seem to be incomplete
+    and were modified less than `in_progress_age` seconds ago, i.e. are
+    probably still being written.
+    """
+    remembered = []
+    num_deferred = 0
+
+    for path, failure in failures:
+        info = fingerprints[os.path.basename(path)]
+        if failure.incomplete and \
+                time.time() - info['file_mtime'] < in_progress_age:
+            num_deferred += 1
+            continue
+        remembered.append(dict(
+                path=os.path.basename(path), reason=failure.reason, **info))
+
+    if num_deferred:
+        print "Deferring {} models that seem to still be being written."\
+                .format(num_deferred)
+
+    return remembered, num_deferred
+
+def is_complete(records, extractors, remote_models):
+    """
+    Return true if every one of the given records has all the groups of
+    metrics that come with PIP.  Structures that haven't been downloaded
+    can't have all of these metrics, so their records are taken as they are.
+    """
+    if 'metric_groups' not in records:
+        return True
+
+    builtin_groups = parse_groups(None, extractors)
+    fetched = ~records['path'].isin(list(remote_models)).values
+    keys = records['metric_groups'][fetched].unique()
+    return all(builtin_groups <= parse_groups(x, extractors) for x in keys)
+
+def update_database(pdb_dir, records, workspace):
+    """
+    Replace the given directory's models in the workspace's metrics database
+    (see database.update()).  The cache is the authoritative copy of these
+    metrics, so problems with the database are reported but not fatal.
+    """
+    try:
+        database.update(pdb_dir, records, workspace)
+    except sqlite3.Error as error:
+        print "Couldn't update '{}': {}".format(
+                workspace.metrics_db_path, error)
+
+def iter_records(pdb_dir, chunk_size=10000, columns=None, groups=None,
+        **kwargs):
+    """
+    Yield the same metrics returned by load(), but as a series of data frames
+    with `chunk_size` rows each, rather than as one big data frame.  Only one
+    chunk is in memory at a time, so this is the way to filter or count the
+    models in directories with too many models to load all at once.  The
+    cache is brought up to date first, and any extra keyword arguments are
+    passed on to load() for that purpose.
+
+    Note that this only limits memory once the cache exists.  Bringing the
+    cache up to date is done by load(), which holds every record (and all
+    the coordinates) in memory while it rewrites the cache, so the first
+    call on a cold (or stale) cache needs as much memory as load() does.
+    Only the path column is returned from that call, though.
+    """
+    if groups is None:
+        workspace = pipeline.workspace_from_dir(pdb_dir)
+        extractors = ExtractorSet.from_workspace(workspace)
+        if columns is None:
+            groups = extractors.groups
+        else:
+            groups = extractors.groups_for_columns(columns)
+
+    load(pdb_dir, columns=['path'], groups=groups, **kwargs)
+
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+    cache_columns = None if columns is None else ['path'] + list(columns)
+
+    for records in cache.iter_cache(cache_path, chunk_size, cache_columns):
+        if columns is None:
+            yield records.drop(
+                    [x for x in hidden_columns if x in records], axis=1)
+        else:
+            yield records[project_columns(records.columns, columns)]
+
+fingerprint_columns = 'file_size', 'file_mtime', 'file_hash'
+
+# Columns that are only meaningful to the cache, and aren't returned by load().
+hidden_columns = fingerprint_columns + ('metric_groups',)
+
+def fingerprint(path, check_hash=False, block_size=64*1024):
+    """
+    Return a dictionary of information that can be used to tell if the given
+    file has changed since it was cached: its size, its modification time, and
+    optionally an MD5 hash of its first block.  The hash is useful for catching
+    files that were overwritten without their size or modification time
+    changing, e.g. by ``rsync --times``.
+    """
+    stat = os.stat(path)
+    info = {
+            'file_size': stat.st_size,
+            'file_mtime': stat.st_mtime,
+    }
+    if check_hash:
+        import hashlib
+        with open(path, 'rb') as file:
+            info['file_hash'] = hashlib.md5(file.read(block_size)).hexdigest()
+    return info
+
+def fingerprint_matches(record, info):
+    """
+    Return true if the given cached record was calculated from a file with the
+    given fingerprint.  Records cached before fingerprints were recorded are
+    trusted and stamped with the current fingerprint, and likewise for hashes.
+    """
+    if info is None:
+        return False
+
+    def has(key):
+        value = record.get(key)
+        return value is not None and value == value  # NaN != NaN
+
+    if not has('file_size') or not has('file_mtime'):
+        record.update(info)
+        return True
+
+    if record['file_size'] != info['file_size']:
+        return False
+    if record['file_mtime'] != info['file_mtime']:
+        return False
 
-        sys.stdout.write("\rReading '{}' [{}/{}]".format(
-            os.path.dirname(path), i+1, len(pdb_paths)))
-        sys.stdout.flush()
+    if 'file_hash' in info:
+        if has('file_hash') and record['file_hash'] != info['file_hash']:
+            return False
+        record['file_hash'] = info['file_hash']
 
-        # Read the PDB file, which we are assuming is gzipped.
+    return True
 
+# Columns that usually have the same value for many models (e.g. all the
+# models of a validated design have the same sequence).  These are returned as
+# categorical columns, which store each distinct value once and make grouping
+# by these columns fast.
+categorical_columns = 'sequence',
+
+def load_coords(pdb_dir, name):
+    """
+    Return the coordinates with the given name for the structures in the given
+    directory (see cache.read_coords()).  The rows of the array correspond to
+    the rows of the data frame returned by load(), which should be called
+    first to make sure the cache is up to date.
+    """
+    return cache.read_coords(os.path.join(pdb_dir, 'metrics.npz'), name)
+
+def read_linked_records(pdb_paths, fingerprints, atoms_by_name, extractors):
+    """
+    Return the records (and coordinates, for each of the given sets of atoms)
+    cached for the targets of any of the given paths that are symlinks to
+    files in other directories.  Records are only returned if their targets
+    still have the fingerprints they were cached with, and they're given the
+    names of the links rather than those of the targets.
+
+    If the targets were cached with different restraints than the given
+    extractors have (e.g. because a design step has its own restraints), the
+    metrics that depend on the restraints are left out of the records (see
+    forget_restrained_metrics()), so that load() calculates them again.
+    """
+    links_by_dir = collections.OrderedDict()
+
+    for pdb_path in pdb_paths:
+        real_path = os.path.realpath(pdb_path)
+        real_dir = os.path.dirname(real_path)
+        if real_dir == os.path.realpath(os.path.dirname(pdb_path)):
+            continue
+        links_by_dir.setdefault(real_dir, []).append(
+                (os.path.basename(pdb_path), os.path.basename(real_path)))
+
+    records = [cache.empty_records()]
+    coords = [cache.empty_coords(atoms_by_name, 0)]
+
+    for real_dir, links in links_by_dir.items():
+        cache_path = os.path.join(real_dir, 'metrics.npz')
+        if not os.path.exists(cache_path):
+            continue
+
+        # Read the coordinates of the target directory into copies of the
+        # lists of atoms, because any extra atoms stored there shouldn't be
+        # added to this directory.  Extra atoms are always added after the
+        # given ones, so they're easy to drop.
+
+        target_atoms = collections.OrderedDict(
+                (k, list(v)) for k, v in atoms_by_name.items())
         try:
-            with gzip.open(path) as file:
-                lines = file.readlines()
-        except IOError:
-            print "\nFailed to read '{}'".format(path)
+            target_records, target_coords, schema = \
+                    cache.read_cache_and_coords(cache_path, target_atoms)
+        except cache.CacheError:
             continue
 
-        if not lines:
-            print "\n{} is empty".format(path)
+        target_coords = collections.OrderedDict(
+                (k, v[:, :len(atoms_by_name[k])])
+                for k, v in target_coords.items())
+        target_rows = dict(
+                (x, i) for i, x in enumerate(target_records['path']))
+
+        def has(i, key):
+            return key in target_records and \
+                    pd.notnull(target_records[key].values[i])
+
+        rows, names = [], []
+
+        for name, target_name in links:
+            i = target_rows.get(target_name)
+            info = fingerprints[name]
+            if i is None:
+                continue
+            if not has(i, 'file_size') or not has(i, 'file_mtime'):
+                continue
+            if target_records['file_size'].values[i] != info['file_size']:
+                continue
+            if target_records['file_mtime'].values[i] != info['file_mtime']:
+                continue
+            if 'file_hash' in info and has(i, 'file_hash') and \
+                    target_records['file_hash'].values[i] != info['file_hash']:
+                continue
+            rows.append(i)
+            names.append(name)
+
+        if rows:
+            linked_records, linked_coords = cache.take_records(
+                    target_records, target_coords, rows)
+            linked_records['path'] = names
+            stamp_fingerprints(linked_records, fingerprints)
+            if schema.get('restraints') != extractors.restraints.digest:
+                forget_restrained_metrics(linked_records, extractors)
+            records.append(linked_records)
+            coords.append(linked_coords)
+
+    return cache.concat_records(records, coords)
+
+def forget_restrained_metrics(records, extractors):
+    """
+    Remove the metrics that depend on the restraints (see
+    MetricExtractor.restrained) from the given records, in place, along with
+    their groups, so that they'll be calculated again if they're asked for.
+    The coordinates don't depend on the restraints, so they're kept.
+    """
+    restrained = [x for x in extractors if x.restrained]
+    restrained_groups = set(group_name(x) for x in restrained)
+    restrained_columns = [
+            name for x in restrained for name in x.columns if name in records]
+
+    records.drop(restrained_columns, axis=1, inplace=True)
+    records['metric_groups'] = [
+            ','.join(sorted(parse_groups(x, extractors) - restrained_groups))
+            for x in records.get('metric_groups', [None] * len(records))]
+
+def read_score_files(workspace, pdb_dir, pdb_paths, extractors, fingerprints):
+    """
+    Return a data frame with the metrics that can be found for the given
+    structures in the score files (``*.sc``) in the given directory.  Only
+    the groups of metrics that every extractor in the group can find in a
+    score file are included (see MetricExtractor.consume_scores()), and
+    these groups are recorded for each record as usual.  Structures that
+    aren't in any score file, or that are newer than all the score files
+    they're in (i.e. were made again since their scores were written), are
+    left out.  The modification time of each structure is taken from the
+    given fingerprints, because it might not have been downloaded.
+    """
+    score_paths = glob.glob(os.path.join(pdb_dir, '*.sc'))
+    if not pdb_paths or not score_paths:
+        return cache.empty_records()
+
+    names = dict(
+            (os.path.basename(x)[:-len('.pdb.gz')], os.path.basename(x))
+            for x in pdb_paths)
+    scores = {}
+
+    for score_path in sorted(score_paths, key=os.path.getmtime):
+        score_mtime = os.path.getmtime(score_path)
+        for tag, row in iter_score_file(score_path):
+            name = names.get(os.path.basename(tag))
+            if name is None:
+                continue
+            if fingerprints[name]['file_mtime'] > score_mtime:
+                continue
+            scores[name] = row
+
+    block = RecordBlock(capacity=len(scores))
+    filter_list = []
+    known_filters = pipeline.load_filters(
+            workspace.root_dir, workspace.filters_list)
+
+    for name in sorted(scores):
+        found_groups = {}
+        found_metrics = {}
+
+        for extractor in extractors:
+            state = {'known_filters': known_filters}
+            extractor.start(state)
+            metrics = {}
+            found = extractor.consume_scores(scores[name], metrics, state)
+            group = group_name(extractor)
+            found_groups[group] = found_groups.get(group, True) and found
+            if found:
+                found_metrics.setdefault(group, []).append(
+                        (metrics, extractor.custom_metrics(state)))
+
+        # Only keep the metrics from groups that were completely found.
+
+        groups = sorted(k for k, v in found_groups.items() if v)
+        if not groups:
             continue
 
-        # Get different information from different lines in the PDB file.  Some
-        # of these lines are specific to different simulations.
+        record = block.new_row()
+        record['path'] = name
+
+        for group in groups:
+            for metrics, custom_metrics in found_metrics[group]:
+                for metric, value in metrics.items():
+                    record[metric] = value
+                filter_list += [x for x in custom_metrics if x not in filter_list]
+
+        record['metric_groups'] = ','.join(groups)
+        record.commit()
+
+    if filter_list:
+        pipeline.update_filters(
+                workspace.root_dir, filter_list, workspace.filters_list)
+
+    if not len(block):
+        return cache.empty_records()
+
+    return block.to_frame()
+
+def iter_score_file(score_path):
+    """
+    Yield a (description, scores) tuple for each model listed in the given
+    score file, where the scores are a dictionary of the numeric terms.  Both
+    the plain text format (with "SCORE:" lines) and the JSON format (with one
+    object per line) are understood.
+
+    The names in the header of the plain text format can have spaces in them
+    (e.g. the names of filters), so they can't just be split on whitespace.
+    Instead, Rosetta right-aligns each name with the values below it, so each
+    name is taken to be whatever is between the ends of the values on either
+    side of it.  Rows that don't line up with the header are skipped.
+    """
+    header = None
+
+    with open(score_path) as file:
+        for line in file:
+            if line.startswith('{'):
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                tag = row.pop('decoy', None) or row.pop('description', None)
+                if tag:
+                    yield tag, dict(
+                            (k, v) for k, v in row.items()
+                            if is_number(v) and not isinstance(v, bool))
+
+            elif line.startswith('SCORE:'):
+                line = line.rstrip()
+                if line.endswith(' description'):
+                    header = line
+                    continue
+                if header is None:
+                    continue
+
+                fields = parse_score_row(header, line)
+                if fields is None:
+                    continue
+
+                row = {}
+                for term, value in fields[:-1]:
+                    try:
+                        row[term] = float(value)
+                    except ValueError:
+                        pass
+                yield fields[-1][1], row
+
+def parse_score_row(header, line):
+    """
+    Return a list of (name, value) tuples for the given row of a plain text
+    score file, or None if the row doesn't line up with the given header.
+    The last tuple is always the description (i.e. the tag of the model),
+    which is the last value in the row.  Rosetta doesn't pad the tags to the
+    width of the header, so only the scores are lined up with it.
+    """
+    values = list(re.finditer(r'\S+', line))[1:]
+    if not values:
+        return None
+
+    scores, tag = values[:-1], ('description', values[-1].group())
+    header = header[:-len(' description')]
+    names = []
+    start = len('SCORE:')
+
+    for value in scores:
+        end = value.end()
+        if end > len(header) or header[end - 1].isspace() or \
+                (end < len(header) and not header[end].isspace()):
+            break
+        names.append(header[start:end].strip())
+        start = end
+    else:
+        if not header[start:].strip():
+            return [(name, x.group()) for name, x in zip(names, scores)] + [tag]
 
-        for line in lines:
-            score_table_match = \
-                    dunbrack_index and score_table_pattern.match(line)
+    # Fall back on splitting the header on whitespace, in case the columns
+    # weren't aligned but none of the names have spaces in them.
+    names = header.split()[1:]
+    if len(names) != len(scores):
+        return None
+    return [(name, x.group()) for name, x in zip(names, scores)] + [tag]
 
-            if line.startswith('pose'):
-                record['total_score'] = float(line.split()[1])
+def match_remote_models(records, remote_models):
+    """
+    Return fingerprints (see fingerprint()) for the given structures, which
+    exist on the remote host but haven't been downloaded.  Each is given as
+    a (size, modification time) tuple, as listed by pipeline.read_remote_models().
+    The modification times are only known to the nearest second, so if a
+    cached record agrees with both, the record is assumed to be up to date
+    and its own fingerprint is used.
+    """
+    fingerprints = dict(
+            (name, {'file_size': size, 'file_mtime': float(mtime)})
+            for name, (size, mtime) in remote_models.items())
+
+    if not fingerprints or not len(records) or \
+            'file_size' not in records or 'file_mtime' not in records:
+        return fingerprints
+
+    for i in np.flatnonzero(records['path'].isin(list(remote_models)).values):
+        record = records.iloc[i]
+        size, mtime = remote_models[record['path']]
+        if record['file_size'] != size or \
+                np.floor(record['file_mtime']) != mtime:
+            continue
+        info = fingerprints[record['path']]
+        info['file_mtime'] = record['file_mtime']
+        if 'file_hash' in records and pd.notnull(record['file_hash']):
+            info['file_hash'] = record['file_hash']
 
-            elif line.startswith('delta_buried_unsats'):
-                record['buried_unsat_score'] = float(line.split()[1])
+    return fingerprints
 
-            elif line.startswith('label'):
+def match_fingerprints(records, fingerprints):
+    """
+    Return a boolean mask indicating which of the given records were
+    calculated from files with the given fingerprints (see
+    fingerprint_matches()).  Records cached before fingerprints were recorded
+    are trusted and stamped with the current fingerprint, and likewise for
+    hashes.
+    """
+    if not len(records):
+        return np.zeros(0, dtype=bool)
+
+    info = [fingerprints.get(x) for x in records['path']]
+    found = np.array([x is not None for x in info])
+
+    def current(key):
+        return np.array([x.get(key) if x else None for x in info])
+
+    for key in 'file_size', 'file_mtime':
+        if key not in records:
+            records[key] = np.nan
+
+    size, mtime = current('file_size'), current('file_mtime')
+    unstamped = records['file_size'].isnull().values | \
+                records['file_mtime'].isnull().values
+    matches = found & (unstamped | (
+        (records['file_size'].values == size) &
+        (records['file_mtime'].values == mtime)))
+
+    # Only assign (numeric) values if there's something to stamp, otherwise
+    # pandas turns the columns into object columns.
+    stamp = found & unstamped
+    if stamp.any():
+        records.loc[stamp, 'file_size'] = size[stamp].astype(float)
+        records.loc[stamp, 'file_mtime'] = mtime[stamp].astype(float)
+
+    if any(x and 'file_hash' in x for x in info):
+        hashes = current('file_hash')
+        if 'file_hash' in records:
+            stamped = records['file_hash'].notnull().values
+            matches &= ~stamped | (records['file_hash'].values == hashes)
+        records['file_hash'] = np.where(
+                matches, hashes, records.get('file_hash', np.nan))
+
+    return matches
+
+def stamp_fingerprints(records, fingerprints):
+    """
+    Add the fingerprints of the files the given records were calculated from
+    to the records, as new columns.
+    """
+    if not len(records):
+        return
+
+    info = [fingerprints[x] for x in records['path']]
+    for key in fingerprint_columns:
+        if key in info[0]:
+            records[key] = [x[key] for x in info]
+
+def write_sidecar(pdb_paths, name, workspace=None):
+    """
+    Calculate the metrics for the given structures and save them, along with
+    their fingerprints, to a sidecar in the directory the structures are in.
+    This is meant to be called by cluster jobs as soon as they've made their
+    structures, so that load() can merge the metrics into the cache instead of
+    calculating them again after the structures have been fetched.  Each job
+    should use a different name, so the sidecars don't overwrite each other.
+    The workspace's list of filters isn't updated, because that means taking
+    a lock on it, and locks aren't reliable on the network file systems that
+    cluster jobs usually write to.  Instead, the filters are listed in the
+    sidecar and added to the list when it's merged.
+    """
+    pdb_paths = list(pdb_paths)
+    pdb_dirs = set(os.path.dirname(os.path.abspath(x)) for x in pdb_paths)
+    if len(pdb_dirs) != 1:
+        raise ValueError("the structures in a sidecar must all be in the same directory")
+
+    pdb_dir = pdb_dirs.pop()
+    sidecar_path = os.path.join(pdb_dir, 'metrics.{}.sidecar'.format(name))
+
+    if workspace is None:
+        workspace = pipeline.workspace_from_dir(pdb_dir)
+
+    extractors = ExtractorSet.from_workspace(workspace)
+    failures = []
+    block = read_and_calculate(
+            workspace, pdb_paths, extractors=extractors, failures=failures,
+            update_filters=False)
+    records = block.to_frame()
+    coords = cache.conform_coords(
+            block.coords, extractors.coords, len(records))
+    stamp_fingerprints(records, dict(
+            (os.path.basename(x), fingerprint(x)) for x in pdb_paths))
+
+    batch = cache.format_batch(records, coords)
+    batch['filters'] = [
+            x for x in records.columns
+            if x not in extractors.columns and x not in hidden_columns
+            and x != 'path']
+    batch['failures'] = [
+            dict(path=os.path.basename(path), reason=failure.reason,
+                **fingerprint(path))
+            for path, failure in failures if not failure.incomplete]
+
+    pipeline.save_atomically(
+            sidecar_path, lambda file: json.dump(batch, file))
+    return sidecar_path
+
+class RecordBlock(object):
+    """
+    Accumulate the metrics calculated for a number of structures, column by
+    column.
+
+    Numeric metrics are kept in preallocated float64 arrays, while everything
+    else (e.g. sequences and paths) is dictionary encoded, i.e. stored as an
+    array of integer codes plus a list of the distinct values.  Coordinates
+    are kept in float32 arrays of shape (num_rows, num_atoms, 3).  Missing
+    values are NaN (or -1 for codes).  This avoids keeping a dictionary for
+    every structure, and it makes blocks cheap to send between processes, so
+    each worker sends back one block for every chunk of structures it reads.
+    """
+
+    def __init__(self, atoms_by_name=None, capacity=16):
+        self.num_rows = 0
+        self.capacity = max(capacity, 1)
+        self.numbers = collections.OrderedDict()
+        self.codes = collections.OrderedDict()
+        self.categories = {}
+        self.category_codes = {}
+        self.atoms_by_name = collections.OrderedDict(atoms_by_name or {})
+        self.xyz = collections.OrderedDict(
+                (k, self._new_xyz(len(v)))
+                for k, v in self.atoms_by_name.items())
+
+    def __len__(self):
+        return self.num_rows
+
+    def append(self, record):
+        """
+        Add the metrics for one structure, given as a dictionary.
+        """
+        self.reserve(self.num_rows + 1)
+
+        for name, value in record.items():
+            self._set(self.num_rows, name, value)
+
+        self.num_rows += 1
+
+    def new_row(self):
+        """
+        Return a RecordRow, which can be used like a dictionary to write the
+        metrics for one structure directly into this block.
+        """
+        return RecordRow(self)
+
+    def extend(self, block):
+        """
+        Add all the structures from another block.
+        """
+        self.reserve(self.num_rows + block.num_rows)
+        rows = slice(self.num_rows, self.num_rows + block.num_rows)
+
+        for name, values in block.numbers.items():
+            values = values[:block.num_rows]
+            if name in self.codes:
+                self.codes[name][rows] = [self._code(name, x) for x in values]
+            else:
+                if name not in self.numbers:
+                    self.numbers[name] = self._new_numbers()
+                self.numbers[name][rows] = values
+
+        for name, codes in block.codes.items():
+            if name in self.numbers:
+                self._encode(name)
+            if name not in self.codes:
+                self._new_codes(name)
+            mapping = np.array(
+                    [self._code(name, x) for x in block.categories[name]] +
+                    [-1], dtype=np.int32)
+            self.codes[name][rows] = mapping[codes[:block.num_rows]]
+
+        for name, xyz in block.xyz.items():
+            if name in self.xyz:
+                self.xyz[name][rows, :xyz.shape[1]] = xyz[:block.num_rows]
+
+        self.num_rows += block.num_rows
+
+    def reserve(self, num_rows):
+        """
+        Make sure there's room for the given number of rows, growing the
+        arrays geometrically if there isn't.
+        """
+        if num_rows <= self.capacity:
+            return
+
+        capacity = max(num_rows, 2 * self.capacity)
+
+        def grow(array, fill):
+            grown = np.full((capacity,) + array.shape[1:], fill, array.dtype)
+            grown[:self.capacity] = array
+            return grown
+
+        for name in self.numbers:
+            self.numbers[name] = grow(self.numbers[name], np.nan)
+        for name in self.codes:
+            self.codes[name] = grow(self.codes[name], -1)
+        for name in self.xyz:
+            self.xyz[name] = grow(self.xyz[name], np.nan)
+
+        self.capacity = capacity
+
+    def to_frame(self):
+        """
+        Return the metrics in this block as a data frame.
+        """
+        n = self.num_rows
+        data = collections.OrderedDict()
+
+        for name, values in self.numbers.items():
+            data[name] = values[:n]
+
+        for name, codes in self.codes.items():
+            categories = np.empty(len(self.categories[name]) + 1, dtype=object)
+            categories[:-1] = self.categories[name]
+            categories[-1] = np.nan
+            data[name] = categories[codes[:n]]
+
+        return pd.DataFrame(data, index=pd.RangeIndex(n))
+
+    @property
+    def coords(self):
+        return collections.OrderedDict(
+                (k, v[:self.num_rows]) for k, v in self.xyz.items())
+
+    def _set(self, i, name, value):
+        if name in self.xyz:
+            value = np.asarray(value)
+            self.xyz[name][i, :len(value)] = value
+        elif name not in self.codes and is_number(value):
+            if name not in self.numbers:
+                self.numbers[name] = self._new_numbers()
+            self.numbers[name][i] = value
+        else:
+            if name in self.numbers:
+                self._encode(name)
+            if name not in self.codes:
+                self._new_codes(name)
+            self.codes[name][i] = self._code(name, value)
+
+    def _unset(self, i, name):
+        if name in self.xyz:
+            self.xyz[name][i] = np.nan
+        elif name in self.numbers:
+            self.numbers[name][i] = np.nan
+        elif name in self.codes:
+            self.codes[name][i] = -1
+
+    def _drop(self, name):
+        self.numbers.pop(name, None)
+        if self.codes.pop(name, None) is not None:
+            del self.categories[name]
+            del self.category_codes[name]
+
+    def _new_numbers(self):
+        return np.full(self.capacity, np.nan)
+
+    def _new_codes(self, name):
+        self.codes[name] = np.full(self.capacity, -1, dtype=np.int32)
+        self.categories[name] = []
+        self.category_codes[name] = {}
+
+    def _new_xyz(self, num_atoms):
+        return np.full((self.capacity, num_atoms, 3), np.nan, dtype=np.float32)
+
+    def _code(self, name, value):
+        if value is None or value != value:
+            return -1
+        codes = self.category_codes[name]
+        if value not in codes:
+            codes[value] = len(self.categories[name])
+            self.categories[name].append(value)
+        return codes[value]
+
+    def _encode(self, name):
+        # Switch a column from numbers to codes, e.g. because a value that
+        # isn't a number was found.
+        values = self.numbers.pop(name)
+        self._new_codes(name)
+        self.codes[name][:] = [self._code(name, x) for x in values]
+
+class RecordRow(object):
+    """
+    Write the metrics for one structure into the next row of a RecordBlock,
+    as if the row were a dictionary.  This saves building a dictionary for
+    every structure just to copy it into the block.  The row only becomes
+    part of the block once it's committed.  If the structure turns out to be
+    unreadable, the row should be discarded instead, which forgets whatever
+    was written to it (including any columns that only it had).
+    """
+
+    def __init__(self, block):
+        block.reserve(block.num_rows + 1)
+        self.block = block
+        self.new_columns = set()
+        self.names = set()
+
+    def __setitem__(self, name, value):
+        block = self.block
+        if name not in block.numbers and name not in block.codes and \
+                name not in block.xyz:
+            self.new_columns.add(name)
+        block._set(block.num_rows, name, value)
+        self.names.add(name)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def commit(self):
+        self.block.num_rows += 1
+
+    def discard(self):
+        for name in self.names:
+            if name in self.new_columns:
+                self.block._drop(name)
+            else:
+                self.block._unset(self.block.num_rows, name)
+
+def is_number(value):
+    return isinstance(value, (int, long, float, np.number)) and \
+            not isinstance(value, np.datetime64)
+
+class Restraint(object):
+    """
+    Describe the geometry that a single restraint is trying to achieve.
+
+    Each type of restraint is a subclass that knows how many atoms it involves,
+    how to parse its line in the restraints file, and how to measure how far
+    any number of models are from satisfying any number of restraints of that
+    type.  The last part is done in a single numpy expression by the
+    calculate_deviations() method, so adding a new type of restraint (e.g. an
+    angle or a dihedral) just means writing a new subclass and adding it to the
+    `restraint_types` dictionary below.  The coordinates found in any
+    particular model are kept by the parser, so the same restraints can be
+    shared between models.
+    """
+    restraint_type = None
+    num_atoms = 1
+
+    def __init__(self, atoms, position):
+        self.atoms = atoms          # A list of (residue id, atom name) tuples.
+        self.position = position    # The target for this kind of restraint.
+
+    @property
+    def residue_id(self):
+        return self.atoms[0][0]
+
+    @property
+    def atom_name(self):
+        return self.atoms[0][1]
+
+    @classmethod
+    def from_fields(cls, fields):
+        """
+        Create a restraint from the whitespace-separated fields of a line in a
+        rosetta constraint file.  The atoms are assumed to come first, as
+        (atom name, residue id) pairs.
+        """
+        atoms = [
+                (fields[2*i+2], fields[2*i+1])
+                for i in range(cls.num_atoms)]
+        return cls(atoms, cls.parse_position(fields))
+
+    @staticmethod
+    def parse_position(fields):
+        raise NotImplementedError
+
+    @staticmethod
+    def calculate_deviations(coords, positions):
+        """
+        Return an array of shape (..., N) indicating how far each of N
+        restraints is from being satisfied.  The coordinates are given as an
+        array of shape (..., N, num_atoms, 3), where any leading dimensions
+        (e.g. one per model) are arbitrary.  The targets are given as an array
+        with the position of each restraint stacked along the first axis.
+        """
+        raise NotImplementedError
+
+
+class CoordinateRestraint(Restraint):
+    # CoordinateConstraint <atom> <res> <ref atom> <ref res> <x> <y> <z> <func>
+    restraint_type = 'CoordinateConstraint'
+    num_atoms = 1
+
+    @staticmethod
+    def parse_position(fields):
+        return xyz_to_array(fields[5:8])
+
+    @staticmethod
+    def calculate_deviations(coords, positions):
+        return np.sqrt(np.sum((coords[..., 0, :] - positions)**2, axis=-1))
+
+
+class AtomPairRestraint(Restraint):
+    # AtomPair <atom 1> <res 1> <atom 2> <res 2> <func> <distance> ...
+    restraint_type = 'AtomPair'
+    num_atoms = 2
+
+    @staticmethod
+    def parse_position(fields):
+        return float(fields[6])
+
+    @staticmethod
+    def calculate_deviations(coords, positions):
+        difference = coords[..., 0, :] - coords[..., 1, :]
+        distances = np.sqrt(np.sum(difference**2, axis=-1))
+        return np.abs(distances - positions)
+
+
+restraint_types = {
+        CoordinateRestraint.restraint_type: CoordinateRestraint,
+        AtomPairRestraint.restraint_type: AtomPairRestraint,
+}
+
+class RestraintSet(object):
+    """
+    Compile a list of restraints into the arrays needed to evaluate them.
+
+    Every distinct atom involved in any restraint is assigned a row in a
+    coordinate array, and `atoms` maps (residue id, atom name) pairs to those
+    rows.  This lets the parser match each line of a PDB file against every
+    restraint with a single dictionary lookup, and it lets the restraints be
+    evaluated for one model, or for a whole stack of models, at once.
+    """
+
+    def __init__(self, restraints):
+        self.restraints = restraints
+        self.atoms = {}
+        self.atom_keys = []
+
+        for restraint in restraints:
+            for key in restraint.atoms:
+                if key not in self.atoms:
+                    self.atoms[key] = len(self.atom_keys)
+                    self.atom_keys.append(key)
+
+        # Group the restraints by type, so that each type's kernel only has to
+        # be called once.  For each type, keep an array with the coordinate
+        # rows of each restraint's atoms and an array with each restraint's
+        # target position.
+
+        self.groups = []
+        types = sorted(set(type(x) for x in restraints),
+                key=lambda x: x.restraint_type)
+
+        for cls in types:
+            members = [x for x in restraints if type(x) is cls]
+            rows = np.array([[self.atoms[k] for k in x.atoms] for x in members])
+            positions = np.array([x.position for x in members])
+            self.groups.append((cls, rows, positions))
+
+        # Dunbrack scores are collected for every residue that has a restrained
+        # atom.
+
+        self.residue_ids = set(x.residue_id for x in restraints)
+
+    def __len__(self):
+        return len(self.restraints)
+
+    def __iter__(self):
+        return iter(self.restraints)
+
+    @property
+    def num_atoms(self):
+        return len(self.atom_keys)
+
+    @property
+    def digest(self):
+        """
+        A hash of the restraints, which is stored in the cache so that the
+        metrics that depend on the restraints are only reused (e.g. by
+        structures that are symlinks to cached structures) if they were
+        calculated with the same restraints.
+        """
+        import hashlib
+        restraints = [
+                (x.restraint_type, x.atoms, np.asarray(x.position).tolist())
+                for x in self]
+        return hashlib.md5(json.dumps(restraints)).hexdigest()
+
+    @classmethod
+    def from_file(cls, path):
+        restraints = []
+        with open(path) as file:
+            for line in file:
                 fields = line.split()
-                dunbrack_index = fields.index('fa_dun')
-
-            elif score_table_match:
-                residue_id = score_table_match.group(1)
-                for restraint in restraints:
-                    if restraint.residue_id == residue_id:
-                        dunbrack_score = float(line.split()[dunbrack_index])
-                        dunbrack_scores.append(dunbrack_score)
-                        break
-
-            elif line.startswith('EXTRA_SCORE_'):
-                filter_value = float(line.rsplit()[-1:][0])
-                filter_name = " ".join(line.rsplit()[:-1])[12:]
-                record[filter_name] = filter_value
+                if not fields or line.startswith('#'):
+                    continue
+                if fields[0] not in restraint_types:
+                    print "Skipping unrecognized restraint: '{}...'".format(line[:46])
+                    continue
+                restraints.append(restraint_types[fields[0]].from_fields(fields))
+
+        return cls(restraints)
+
+    def empty_coords(self, *shape):
+        """
+        Return an array to hold the coordinates of every restrained atom,
+        filled with NaN so that atoms that are never found can be recognized.
+        Any arguments are prepended to the shape of the array, e.g. to hold
+        coordinates for a number of models.
+        """
+        return np.full(shape + (self.num_atoms, 3), np.nan)
+
+    def calculate_deviations(self, coords):
+        """
+        Return an array of shape (..., N) indicating how far each of the N
+        restraints is from being satisfied, given an array of shape (..., M, 3)
+        with the coordinates of the M restrained atoms.  The restraints are
+        ordered by type.  Restraints involving atoms that weren't found are
+        NaN.
+        """
+        deviations = [
+                cls.calculate_deviations(coords[..., rows, :], positions)
+                for cls, rows, positions in self.groups]
+
+        if not deviations:
+            return np.zeros(coords.shape[:-2] + (0,))
+
+        return np.concatenate(deviations, axis=-1)
+
+    def calculate_restraint_dist(self, coords):
+        """
+        Return the "restraint_dist" metric, i.e. the average deviation of all
+        the restraints that could be evaluated.  Like calculate_deviations(),
+        this works for one model or for a whole stack of models.  The metric
+        is NaN for any model where no restraint could be evaluated.
+        """
+        deviations = self.calculate_deviations(coords)
+        found = ~np.isnan(deviations)
+        total = np.where(found, deviations, 0).sum(axis=-1)
+        count = found.sum(axis=-1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / count
+
+def read_and_calculate(workspace, pdb_paths, workers=None, checkpoint=None,
+        checkpoint_size=500, checkpoint_interval=60, extractors=None,
+        failures=None, update_filters=True):
+    """
+    Calculate a variety of score and distance metrics for the given structures,
+    and return them as a RecordBlock.  If more than one worker is requested,
+    the structures are divided between that many processes.  Either way, the
+    records are returned in the same order as the given paths.  If a
+    checkpoint function is given, it will be called with a block of new
+    records as they're calculated (every `checkpoint_size` records or
+    `checkpoint_interval` seconds, whichever comes first), and with whatever
+    records remain if an error occurs.  By default, every installed metric
+    extractor is used.  Structures that can't be read are skipped, but if a
+    list of `failures` is given, a (path, ReadFailure) tuple will be added to
+    it for each one.  Any custom filters that are found are added to the
+    workspace's list of filters, unless `update_filters` is false.
+    """
+
+    if extractors is None:
+        extractors = ExtractorSet.from_workspace(workspace)
+
+    # Calculate score and distance metrics for each structure.  Each structure
+    # is parsed independently, so the work can be farmed out to a pool of
+    # processes.  The paths are divided into chunks, and each chunk is read
+    # into a single block of records.  ``imap()`` hands back the blocks in the
+    # order the chunks were given, so the output is the same no matter how
+    # many workers are used.
+
+    atoms_by_name = extractors.coords
+    records = RecordBlock(atoms_by_name, len(pdb_paths))
+    batch = RecordBlock(atoms_by_name)
+    filter_list = []
+    pool = None
+    last_checkpoint = time.time()
+    num_read = 0
+
+    chunk_size = max(1, min(100, len(pdb_paths) // (16 * (workers or 1))))
+    chunks = [
+            pdb_paths[i:i+chunk_size]
+            for i in range(0, len(pdb_paths), chunk_size)]
+
+    if workers > 1 and len(pdb_paths) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(
+                workers, _init_worker, (extractors,))
+        results = pool.imap(_read_and_calculate_worker, chunks)
+    else:
+        results = (read_and_calculate_chunk(x, extractors) for x in chunks)
+
+    try:
+        for block, errors, filters in results:
+            num_read += len(block) + len(errors)
+
+            # Update the user on our progress, because this is often slow.
+
+            sys.stdout.write("\rReading '{}' [{}/{}]".format(
+                os.path.dirname(pdb_paths[num_read - 1]),
+                num_read, len(pdb_paths)))
+            sys.stdout.flush()
+
+            for path, error in errors:
+                print "\n" + error.reason
+                if failures is not None:
+                    failures.append((path, error))
+
+            for filter_name in filters:
                 if filter_name not in filter_list:
                     filter_list.append(filter_name)
 
-            elif line.startswith('delta_buried_unsats'):
-                record['buried_unsat_score'] = float(line.split()[1])
-
-            elif line.startswith('loop_backbone_rmsd'):
-                record['loop_dist'] = float(line.split()[1])
-
-            elif (line.startswith('ATOM') or line.startswith('HETATM')):
-                atom_name = line[12:16].strip()
-                residue_id = line[22:26].strip()
-                residue_name = line[17:20].strip()
-
-                # Keep track of this model's sequence.
-                if line.startswith('ATOM'): 
-                    if residue_id != last_residue_id:
-                        sequence += residue_type_3to1_map.get(residue_name, 'X')
-                        last_residue_id = residue_id
-
-                # See if this atom was restrained.
-
-                for restraint in restraints:
-                    if (restraint.residue_id == residue_id and
-                            restraint.atom_name == atom_name):
-                        position = xyz_to_array(line[30:54].split())
-                        if restraint.restraint_type == 'CoordinateConstraint':
-                            distance = euclidean(restraint.position, position)
-                            restraint_distances.append(distance)
-                        elif restraint.restraint_type == 'AtomPair':
-                            restraint.atom1_coords = position
-                    if (restraint.residue2_id == residue_id and restraint.atom2_name == atom_name):
-                        if restraint.restraint_type == 'AtomPair':
-                             restraint.atom2_coords = xyz_to_array(line[30:54].split())
+            records.extend(block)
+            batch.extend(block)
 
-        for restraint in restraints:
-            if restraint.restraint_type == 'AtomPair':
-                restraint_distances.append(abs(euclidean(restraint.atom1_coords, restraint.atom2_coords) - restraint.position))
-        filter_path = workspace.filters_list
-        with open(filter_path, 'r+') as file:
-            filter_list_cached = yaml.load(file)
-            if not filter_list_cached:
-                filter_list_cached = []
-            new_filters = []
-            for f in filter_list:
-                if f not in filter_list_cached:
-                    new_filters.append(f)
-        if new_filters:
-            filter_list_to_cache = filter_list_cached + new_filters
-            with open(filter_path, 'w') as file:
-                yaml.dump(filter_list_to_cache,file)
-
-        record['sequence'] = sequence
-        if dunbrack_scores:
-            record['dunbrack_score'] = np.max(dunbrack_scores)
-        if restraint_distances:
-            record['restraint_dist'] = np.mean(restraint_distances)
-        records.append(record)
+            if checkpoint and (len(batch) >= checkpoint_size or
+                    time.time() - last_checkpoint > checkpoint_interval):
+                checkpoint(batch)
+                batch = RecordBlock(atoms_by_name)
+                last_checkpoint = time.time()
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if checkpoint and len(batch):
+            checkpoint(batch)
 
     if pdb_paths:
         sys.stdout.write('\n')
 
+    # Add any filters we haven't seen before to the workspace's list of
+    # filters.  This happens once for all the structures, rather than once per
+    # structure, because the file may be on a slow network drive.
+
+    if filter_list and update_filters:
+        pipeline.update_filters(
+                workspace.root_dir, filter_list, workspace.filters_list)
+
     return records
 
+def read_energy_tables(pdb_paths, residues, terms, extractors, workers=None):
+    """
+    Yield the per-residue score table of each of the given structures, as a
+    float32 array with a row for each of the given residues and a column for
+    each of the given terms (see EnergyExtractor).  Structures that can't be
+    read, or that don't have a score table, get NaN.  As with
+    read_and_calculate(), the structures can be divided between a number of
+    processes, and the tables are yielded in the same order as the paths.
+    """
+    chunk_size = max(1, min(100, len(pdb_paths) // (16 * (workers or 1))))
+    chunks = [
+            (pdb_paths[i:i+chunk_size], residues, terms)
+            for i in range(0, len(pdb_paths), chunk_size)]
+    pool = None
+    num_read = 0
+
+    if workers > 1 and len(pdb_paths) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(
+                workers, _init_worker, (extractors,))
+        results = pool.imap(_read_energies_worker, chunks)
+    else:
+        results = (read_energies_chunk(x, extractors) for x in chunks)
+
+    try:
+        for tables in results:
+            num_read += len(tables)
+            sys.stdout.write("\rReading energies '{}' [{}/{}]".format(
+                os.path.dirname(pdb_paths[num_read - 1]),
+                num_read, len(pdb_paths)))
+            sys.stdout.flush()
+
+            for table in tables:
+                yield table
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if pdb_paths:
+        sys.stdout.write('\n')
+
+def read_energies_chunk(args, extractors):
+    """
+    Return an array with the per-residue score tables of the given
+    structures, lined up with the given residues and terms.
+    """
+    pdb_paths, residues, terms = args
+    tables = np.full(
+            (len(pdb_paths), len(residues), len(terms)), np.nan,
+            dtype=np.float32)
+    residue_rows = dict((k, i) for i, k in enumerate(residues))
+    term_columns = dict((k, i) for i, k in enumerate(terms))
+
+    for i, path in enumerate(pdb_paths):
+        path, record, filters, error = read_and_calculate_one(
+                path, extractors, stop_after={'energies'})
+        if error:
+            print "\n" + error.reason
+            continue
+        if 'energies' not in record:
+            continue
+
+        energies = record['energies']
+        rows = [residue_rows.get(x) for x in energies.residues]
+        columns = [term_columns.get(x) for x in energies.terms]
+        src_rows = [j for j, x in enumerate(rows) if x is not None]
+        src_columns = [j for j, x in enumerate(columns) if x is not None]
+        if not src_rows or not src_columns:
+            continue
+
+        tables[i][np.ix_(
+            [rows[j] for j in src_rows],
+            [columns[j] for j in src_columns])] = \
+                    energies.table[np.ix_(src_rows, src_columns)]
+
+    return tables
+
+def read_and_calculate_chunk(pdb_paths, extractors):
+    """
+    Calculate metrics for each of the given structures.  Return a RecordBlock
+    with the metrics, a list of (path, ReadFailure) tuples for the structures
+    that couldn't be read, and a list of the custom filters that were found.
+    """
+    block = RecordBlock(extractors.coords, len(pdb_paths))
+    errors = []
+    filter_list = []
+
+    for path in pdb_paths:
+        row = block.new_row()
+        path, record, filters, error = read_and_calculate_one(
+                path, extractors, record=row)
+        if error:
+            row.discard()
+            errors.append((path, error))
+            continue
+        row.commit()
+        for filter_name in filters:
+            if filter_name not in filter_list:
+                filter_list.append(filter_name)
+
+    return block, errors, filter_list
+
+def read_and_calculate_one(path, extractors, stop_after=None, record=None):
+    """
+    Calculate score and distance metrics for a single structure, given an
+    `ExtractorSet`.  Return a tuple containing the given path, a record of the
+    metrics, a list of the custom filters found in the structure, and a
+    ReadFailure (which is None if the structure was read successfully).  If
+    `stop_after` is a set of metric names, the rest of the file will not be
+    read once all of those metrics have been found.  The record is a new
+    dictionary, unless one is given (e.g. a RecordRow, so the extractors
+    write straight into a RecordBlock).  If the structure can't be read,
+    None is returned instead of the record, but whatever was written to the
+    given record is left for the caller to discard.
+    """
+    if record is None:
+        record = {}
+    record['path'] = os.path.basename(path)
+    states = [{} for x in extractors]
+    prefix_table = extractors.prefix_table
+    pattern_extractors = extractors.pattern_extractors
+    consume = [x.consume for x in extractors]
+    consume_atom = [x.consume_atom for x in extractors]
+
+    for extractor, state in zip(extractors, states):
+        extractor.start(state)
+
+    # Read the PDB file, which we are assuming is gzipped.  The file is
+    # streamed rather than read all at once, so only a small part of it is
+    # ever in memory and we can stop as soon as we've seen what we need.
+
+    num_lines = 0
+
+    try:
+        # Hand each line to whichever extractors are interested in it.  The
+        # extractors are found by looking up the first few characters of the
+        # line, so lines that no extractor wants are skipped very quickly.
+        # Lines that don't match any prefix are offered to the extractors
+        # that recognize lines by regular expression instead.  Most of the
+        # lines are atoms, which several extractors want, so the residue id
+        # and atom name of each atom are only parsed once.
+
+        for line in iter_pdb_lines(path):
+            num_lines += 1
+            handled = False
+            key = line[:4]
+
+            if key == 'ATOM' or key == 'HETA':
+                atom_key = parse_atom_key(line)
+                for prefix, i in prefix_table.get(key, ()):
+                    if line.startswith(prefix):
+                        consume_atom[i](atom_key, line, record, states[i])
+                        handled = True
+            else:
+                for prefix, i in prefix_table.get(key, ()):
+                    if line.startswith(prefix):
+                        consume[i](line, record, states[i])
+                        handled = True
+
+            if not handled:
+                for i in pattern_extractors:
+                    if extractors[i].pattern.match(line):
+                        consume[i](line, record, states[i])
+
+            # Stop reading as soon as the caller has everything it asked for.
+
+            if stop_after and stop_after.issubset(record):
+                break
+
+    except (EnvironmentError, EOFError, zlib.error, struct.error) as error:
+        if is_truncated(error):
+            reason = "'{}' is truncated".format(path)
+            return path, None, [], ReadFailure(reason, True)
+        reason = "Failed to read '{}': {}".format(path, error)
+        return path, None, [], ReadFailure(reason, False)
+
+    if not num_lines:
+        return path, None, [], ReadFailure("{} is empty".format(path), True)
+
+    filter_list = []
+    for extractor, state in zip(extractors, states):
+        extractor.finish(record, state)
+        filter_list += extractor.custom_metrics(state)
+
+    record['metric_groups'] = ','.join(sorted(extractors.groups))
+
+    return path, record, filter_list, None
+
+class MetricExtractor(object):
+    """
+    Extract one or more metrics from the lines of a PDB file.
+
+    Every metric reported by load() is calculated by one of these extractors,
+    and all of them share a single pass through each file.  Each extractor
+    declares the line prefixes it wants to see (each at least 4 characters
+    long) and/or a regular expression for lines that can't be recognized by
+    prefix, and the parser only hands it lines that match.  The `columns`
+    attribute lists the metrics the extractor adds to each record.
+
+    An extractor is created once per load() and used to read every model, so
+    anything it needs to remember about the model being read should be kept in
+    the `state` dictionary passed to each method, not on the extractor itself.
+    The restraints and loops for the workspace are available as
+    `self.restraints` and `self.loops`.
+
+    An extractor can also keep the coordinates of some atoms, by naming the
+    array in `coords` and listing the (residue id, atom name) pairs it holds in
+    `atom_keys`.  Its finish() method should then add an array of shape
+    (len(atom_keys), 3) to the record under that name.  These arrays are
+    stored separately from the rest of the metrics (see cache.read_coords()).
+
+    Each extractor belongs to a named `group` of metrics, and has a rough
+    `cost` relative to the other groups (1 means it only looks at a handful of
+    lines).  Callers can ask load() for only the groups they need, and the
+    other groups are calculated later, if and when they're asked for.  If an
+    extractor adds metrics that aren't known in advance (i.e. that aren't
+    listed in `columns`), it should set `custom` to true.  If its metrics
+    depend on the restraints, it should set `restrained` to true, so that
+    they're calculated again rather than reused from a cache that was made
+    with different restraints (see read_linked_records()).
+
+    Some metrics are also written to the score files (``*.sc``) that Rosetta
+    keeps next to the models it makes.  Reading them from there is much
+    faster than reading the models themselves, so extractors that can get all
+    their metrics from a score file should implement consume_scores().
+
+    Other packages can provide their own extractors by subclassing this class
+    and registering the subclass with the ``pull_into_place.extractors`` entry
+    point, just like they can provide their own commands.
+    """
+    prefixes = ()
+    pattern = None
+    columns = ()
+    coords = None
+    atom_keys = ()
+    group = None
+    cost = 1
+    custom = False
+    restrained = False
+
+    def __init__(self, restraints, loops=()):
+        self.restraints = restraints
+        self.loops = loops
+
+    def start(self, state):
+        """
+        Prepare to read a new model.
+        """
+        pass
+
+    def consume(self, line, record, state):
+        """
+        Extract information from a line that matched one of this extractor's
+        prefixes or its pattern.
+        """
+        raise NotImplementedError
+
+    def consume_atom(self, atom_key, line, record, state):
+        """
+        Extract information from an ATOM or HETATM line that matched one of
+        this extractor's prefixes.  The (residue id, atom name) key of the
+        atom has already been parsed (see parse_atom_key()).  By default, the
+        line is just passed on to consume().
+        """
+        self.consume(line, record, state)
+
+    def finish(self, record, state):
+        """
+        Add any metrics that depend on the whole model to the record.
+        """
+        pass
+
+    def consume_scores(self, scores, record, state):
+        """
+        Add this extractor's metrics to the record, given a dictionary with the
+        scores listed for the model in a score file.  Return false unless
+        every one of this extractor's metrics was found, in which case the
+        model itself will be read.
+        """
+        return False
+
+    def custom_metrics(self, state):
+        """
+        Return the names of any metrics (i.e. custom filters) that weren't
+        known in advance but were found in the model that was just read.
+        These are added to the workspace's list of filters.
+        """
+        return []
+
+
+class ScoreExtractor (MetricExtractor):
+    prefixes = 'pose', 'delta_buried_unsats', 'loop_backbone_rmsd'
+    group = 'scores'
+    columns = 'total_score', 'buried_unsat_score', 'loop_dist'
+    score_terms = 'total_score', 'delta_buried_unsats', 'loop_backbone_rmsd'
+
+    def consume(self, line, record, state):
+        fields = line.split()
+        column = dict(zip(self.prefixes, self.columns)).get(fields[0])
+        if column:
+            record[column] = float(fields[1])
+
+    def consume_scores(self, scores, record, state):
+        if any(term not in scores for term in self.score_terms):
+            return False
+        for term, column in zip(self.score_terms, self.columns):
+            record[column] = scores[term]
+        return True
+
+
+class FilterExtractor (MetricExtractor):
+    prefixes = 'EXTRA_SCORE_',
+    group = 'filters'
+    custom = True
+
+    def start(self, state):
+        state['filters'] = []
+
+    def consume(self, line, record, state):
+        filter_value = float(line.rsplit()[-1:][0])
+        filter_name = " ".join(line.rsplit()[:-1])[12:]
+        record[filter_name] = filter_value
+        if filter_name not in state['filters']:
+            state['filters'].append(filter_name)
+
+    def consume_scores(self, scores, record, state):
+        # Filters only show up in score files if the protocol reports them
+        # there, so the score file has to list every filter that's known for
+        # this workspace.  If no filters are known yet, the model has to be
+        # read to find out which filters it has.
+        known_filters = state.get('known_filters')
+        if not known_filters:
+            return False
+        for term, value in scores.items():
+            if term.startswith(self.prefixes[0]):
+                record[term[12:]] = value
+                state['filters'].append(term[12:])
+        return all(x in state['filters'] for x in known_filters)
+
+    def custom_metrics(self, state):
+        return state['filters']
+
+
+class DunbrackExtractor (MetricExtractor):
+    # Only the rows of the per-residue score table for restrained residues are
+    # considered.  The 'label' line gives the column with the Dunbrack score.
+    prefixes = 'label',
+    pattern = re.compile(r'^[A-Z]{3}(?:_[A-Z])?_([1-9]+) ')
+    columns = 'dunbrack_score',
+    group = 'dunbrack'
+    cost = 2
+    restrained = True
+
+    def start(self, state):
+        state['index'] = None
+        state['scores'] = []
+
+    def consume(self, line, record, state):
+        if line.startswith('label'):
+            state['index'] = line.split().index('fa_dun')
+        elif state['index'] is not None:
+            residue_id = self.pattern.match(line).group(1)
+            if residue_id in self.restraints.residue_ids:
+                score = float(line.split()[state['index']])
+                state['scores'].append(score)
+
+    def finish(self, record, state):
+        if state['scores']:
+            record['dunbrack_score'] = np.max(state['scores'])
+
+
+class SequenceExtractor (MetricExtractor):
+    prefixes = 'ATOM',
+    columns = 'sequence',
+    group = 'sequence'
+    cost = 3
+
+    def start(self, state):
+        state['sequence'] = []
+        state['last_residue_id'] = None
+
+    def consume(self, line, record, state):
+        self.consume_atom(parse_atom_key(line), line, record, state)
+
+    def consume_atom(self, atom_key, line, record, state):
+        residue_id = atom_key[0]
+        if residue_id != state['last_residue_id']:
+            residue_name = line[17:20].strip()
+            state['sequence'].append(
+                    residue_type_3to1_map.get(residue_name, 'X'))
+            state['last_residue_id'] = residue_id
+
+    def finish(self, record, state):
+        record['sequence'] = ''.join(state['sequence'])
+
+
+class RestraintExtractor (MetricExtractor):
+    prefixes = 'ATOM', 'HETATM'
+    columns = 'restraint_dist',
+    coords = 'restraint_coords'
+    group = 'restraints'
+    cost = 3
+    restrained = True
+
+    def __init__(self, restraints, loops=()):
+        MetricExtractor.__init__(self, restraints, loops)
+        self.atom_keys = restraints.atom_keys
+
+    def start(self, state):
+        state['coords'] = self.restraints.empty_coords()
+
+    def consume(self, line, record, state):
+        self.consume_atom(parse_atom_key(line), line, record, state)
+
+    def consume_atom(self, atom_key, line, record, state):
+        row = self.restraints.atoms.get(atom_key)
+        if row is not None:
+            state['coords'][row] = xyz_to_array(line[30:54].split())
+
+    def finish(self, record, state):
+        restraint_dist = \
+                self.restraints.calculate_restraint_dist(state['coords'])
+        if not np.isnan(restraint_dist):
+            record['restraint_dist'] = restraint_dist
+        record[self.coords] = state['coords']
+
+
+class LoopExtractor (MetricExtractor):
+    # Keep the backbone coordinates of the loops, e.g. for clustering.
+    prefixes = 'ATOM',
+    coords = 'loop_coords'
+    group = 'loops'
+    cost = 3
+    backbone_atoms = 'N', 'CA', 'C'
+
+    def __init__(self, restraints, loops=()):
+        MetricExtractor.__init__(self, restraints, loops)
+        self.atom_keys = [
+                (str(residue_id), atom_name)
+                for start, stop in loops
+                for residue_id in range(start, stop + 1)
+                for atom_name in self.backbone_atoms]
+        self.atoms = dict((k, i) for i, k in enumerate(self.atom_keys))
+
+    def start(self, state):
+        state['coords'] = np.full((len(self.atom_keys), 3), np.nan)
+
+    def consume(self, line, record, state):
+        self.consume_atom(parse_atom_key(line), line, record, state)
+
+    def consume_atom(self, atom_key, line, record, state):
+        row = self.atoms.get(atom_key)
+        if row is not None:
+            state['coords'][row] = xyz_to_array(line[30:54].split())
+
+    def finish(self, record, state):
+        if self.atom_keys:
+            record[self.coords] = state['coords']
+
+
+class EnergyExtractor (MetricExtractor):
+    # Keep the whole per-residue score table, as an Energies tuple.  This
+    # isn't one of the builtin extractors, because the table is much bigger
+    # than every other metric put together.  It's only used by
+    # load_energies(), which stores the tables separately from the cache.
+    prefixes = 'label', '#END_POSE_ENERGIES_TABLE'
+    pattern = re.compile(r'^\S+_(\d+) ')
+    columns = 'energies',
+    group = 'energies'
+    cost = 2
+
+    def start(self, state):
+        state['terms'] = None
+        state['residues'] = []
+        state['rows'] = []
+
+    def consume(self, line, record, state):
+        if 'energies' in record:
+            return
+        elif line.startswith('label'):
+            state['terms'] = line.split()[1:]
+        elif line.startswith('#END_POSE_ENERGIES_TABLE'):
+            record['energies'] = cache.Energies(
+                    state['residues'], state['terms'],
+                    np.array(state['rows'], dtype=np.float32))
+        elif state['terms'] is not None:
+            fields = line.split()
+            state['residues'].append(self.pattern.match(line).group(1))
+            state['rows'].append([float(x) for x in fields[1:]])
+
+
+builtin_extractors = [
+        ScoreExtractor,
+        FilterExtractor,
+        DunbrackExtractor,
+        SequenceExtractor,
+        RestraintExtractor,
+        LoopExtractor,
+]
+
+def load_extractors():
+    """
+    Return the classes of every metric extractor installed on this system,
+    i.e. the ones that come with PIP plus any provided by other packages via
+    the ``pull_into_place.extractors`` entry point.
+    """
+    from pkg_resources import iter_entry_points
+    extractors = list(builtin_extractors)
+    for entry_point in iter_entry_points(group='pull_into_place.extractors'):
+        extractor = entry_point.load()
+        if extractor not in extractors:
+            extractors.append(extractor)
+    return extractors
+
+class ExtractorSet(object):
+    """
+    Instantiate a number of metric extractors and build the table used to
+    dispatch each line of a PDB file to the extractors that want it.  The
+    table maps the first 4 characters of each prefix to a list of (prefix,
+    extractor index) tuples.  By default, every installed extractor is used.
+    """
+
+    def __init__(self, restraints, extractor_classes=None, loops=()):
+        if extractor_classes is None:
+            extractor_classes = load_extractors()
+
+        self.restraints = restraints
+        self.loops = loops
+        self.extractor_classes = list(extractor_classes)
+        self.extractors = [cls(restraints, loops) for cls in extractor_classes]
+        self.prefix_table = {}
+        self.pattern_extractors = []
+
+        for i, extractor in enumerate(self.extractors):
+            for prefix in extractor.prefixes:
+                if len(prefix) < 4:
+                    raise ValueError("{}: prefix '{}' is shorter than 4 characters".format(type(extractor).__name__, prefix))
+                self.prefix_table.setdefault(prefix[:4], []).append((prefix, i))
+            if extractor.pattern is not None:
+                self.pattern_extractors.append(i)
+
+    @classmethod
+    def from_workspace(cls, workspace, extractor_classes=None):
+        """
+        Create extractors for the restraints and loops of the given workspace.
+        The restraints are used to calculate the "restraint_dist" metric,
+        which reflects how well each structure achieves the desired geometry.
+        Note that this is calculated whether or not restraints were used to
+        create the structures in question.  For example, the validation runs
+        don't use restraints but the restraint distance is a very important
+        metric for deciding which designs worked.
+        """
+        restraints = RestraintSet.from_file(workspace.restraints_path)
+        try:
+            loops = workspace.loop_segments
+        except Exception:
+            loops = []
+        return cls(restraints, extractor_classes, loops)
+
+    def __len__(self):
+        return len(self.extractors)
+
+    def __iter__(self):
+        return iter(self.extractors)
+
+    def __getitem__(self, i):
+        return self.extractors[i]
+
+    @property
+    def columns(self):
+        return [x for extractor in self for x in extractor.columns]
+
+    @property
+    def groups(self):
+        """
+        The names of the groups of metrics calculated by these extractors,
+        cheapest first.
+        """
+        groups = {}
+        for extractor in self:
+            name = group_name(extractor)
+            groups[name] = max(groups.get(name, 0), extractor.cost)
+        return sorted(groups, key=lambda x: (groups[x], x))
+
+    def groups_for_columns(self, columns):
+        """
+        Return the names of the groups needed to calculate the given metrics.
+        Metrics that aren't declared by any extractor are assumed to be custom
+        metrics, e.g. filters.
+        """
+        groups = set()
+        for column in columns:
+            if column == 'path':
+                continue
+            owners = [x for x in self if column in x.columns]
+            if not owners:
+                owners = [x for x in self if x.custom]
+            groups.update(group_name(x) for x in owners)
+        return [x for x in self.groups if x in groups]
+
+    def select(self, groups):
+        """
+        Return a new set with only the extractors in the given groups.
+        """
+        unknown = set(groups) - set(self.groups)
+        if unknown:
+            raise ValueError("unknown metric group(s): {}".format(
+                ', '.join(sorted(unknown))))
+        return ExtractorSet(
+                self.restraints,
+                [cls for cls, x in zip(self.extractor_classes, self)
+                    if group_name(x) in groups],
+                self.loops)
+
+    @property
+    def coords(self):
+        """
+        Map the name of each coordinate array kept by these extractors to the
+        atoms it holds.
+        """
+        return collections.OrderedDict(
+                (x.coords, list(x.atom_keys))
+                for x in self if x.coords and x.atom_keys)
+
+def group_name(extractor):
+    return extractor.group or type(extractor).__name__
+
+# The reason a structure couldn't be read, and whether or not it seemed to be
+# incomplete (i.e. empty or truncated), which usually means that it's still
+# being written.
+ReadFailure = collections.namedtuple('ReadFailure', 'reason incomplete')
+
+def is_truncated(error):
+    """
+    Return true if the given exception (raised while reading a gzipped file)
+    indicates that the file ended early.  Depending on how much of the file
+    there is, the gzip module either runs out of data while parsing the header
+    or the trailer, or reads part of the compressed data as the trailer and
+    fails the checksum.
+    """
+    if isinstance(error, (EOFError, struct.error)):
+        return True
+    message = str(error)
+    return 'CRC check failed' in message or 'Incorrect length' in message
+
+def iter_pdb_lines(path, block_size=1024*1024):
+    """
+    Iterate over the lines of a gzipped PDB file without reading the whole file
+    into memory.  The file is read and decompressed `block_size` bytes at a
+    time, which is much larger than the blocks that ``gzip`` reads by default
+    and therefore makes fewer trips to slow (e.g. network) file systems.
+    """
+    with open(path, 'rb', block_size) as raw_file:
+        with gzip.GzipFile(fileobj=raw_file) as file:
+            remainder = ''
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    break
+                lines = (remainder + block).split('\n')
+                remainder = lines.pop()
+                for line in lines:
+                    yield line + '\n'
+
+            if remainder:
+                yield remainder
+
+def _init_worker(extractors):
+    # Each worker process gets its own copy of the extractors, which are sent
+    # once when the pool is created rather than once per structure.  Ctrl-C is
+    # left for the parent process to handle, so that it can shut the pool down
+    # cleanly.
+    global _worker_extractors
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_extractors = extractors
+
+def _read_and_calculate_worker(pdb_paths):
+    return read_and_calculate_chunk(pdb_paths, _worker_extractors)
+
+def _init_load_worker():
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _load_worker(args):
+    pdb_dir, workspace, extractors, kwargs = args
+    return load(pdb_dir, workspace=workspace, extractors=extractors, **kwargs)
+
+def _read_energies_worker(args):
+    return read_energies_chunk(args, _worker_extractors)
+
+def parse_atom_key(line):
+    """
+    Return the (residue id, atom name) tuple that identifies the atom on the
+    given ATOM or HETATM line, in the same form as the keys of the restrained
+    atoms (see RestraintSet).
+    """
+    return line[22:26].strip(), line[12:16].strip()
+
 def xyz_to_array(xyz):
     """
     Convert a list of strings representing a 3D coordinate to floats and return
@@ -304,13 +2716,27 @@ class Design (object):
     scores, 500 restraint distances, and a "representative" (i.e. lowest
     scoring) model.  The representative has its own score and restraint
     distance, plus a path to a PDB structure.
+
+    If a list of `columns` is given, only those metrics (plus the scores,
+    which are needed to pick the representative) are loaded.  The metrics,
+    loops, and resfile can also be given, if they've already been loaded
+    (see load_designs()).
     """
 
-    def __init__(self, directory):
+    def __init__(self, directory, columns=None, structures=None, loops=None,
+            resfile=None):
         self.directory = directory
-        self.structures = load(directory)
-        self.loops = pipeline.load_loops(directory)
-        self.resfile = pipeline.load_resfile(directory)
+        if structures is None:
+            if columns is not None:
+                columns = list(columns) + ['total_score']
+            structures = load(directory, columns=columns)
+        if loops is None:
+            loops = pipeline.load_loops(directory)
+        if resfile is None:
+            resfile = pipeline.load_resfile(directory)
+        self.structures = structures
+        self.loops = loops
+        self.resfile = resfile
         self.representative = self.rep = np.argmin(self.scores)
 
     def __getitem__(self, key):
@@ -87,6 +87,8 @@ setup(
             define_command('make_web_logo', '[analysis]'),
             define_command('push_data'),
             define_command('plot_funnels', '[analysis]'),
+            define_command('query_models', '[analysis]'),
+            define_command('rescore_restraints', '[analysis]'),
         ],
     },
 )
@@ -0,0 +1,19 @@
+#!/usr/bin/env python2
+
+import os, sys, pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import helpers
+
+@pytest.fixture
+def workspace(tmpdir):
+    """
+    A workspace with a handful of the sample models from the KSI demo (see
+    helpers.make_workspace()).
+    """
+    return helpers.make_workspace(str(tmpdir))
+
+@pytest.fixture
+def pdb_dir(workspace):
+    return workspace.output_dir
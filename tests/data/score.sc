@@ -0,0 +1,8 @@
+SEQUENCE: 
+SCORE: total_score delta_buried_unsats    fa_atr loop_backbone_rmsd EXTRA_SCORE_[[+]]Foldability Score EXTRA_SCORE_[[-]]Phe54 RMSD description
+SCORE:   -1484.920               2.000 -1234.567              0.717                              0.010                       1.026 model_0
+SCORE:   -1482.660               3.000 -1230.004              0.509                              0.120                       0.987 model_1
+SCORE:   -1484.920               2.000 -1234.567              0.717                              0.010                       1.026 model_2
+SCORE:   -1482.660               3.000 -1230.004              0.509                              0.120                       0.987 model_3
+SCORE:   -1469.371               5.000 -1225.100              1.342                             -0.050                       2.311 model_4
+SCORE:   -1401.250               0.000 -1201.998             12.500                              0.330                      10.250 model_0_with_a_longer_name_0001
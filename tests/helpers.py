@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+
+"""\
+Functions shared by the tests, most of which need a workspace with some models
+in it.  The models are the sample output from the KSI demo.
+"""
+
+import os, glob, gzip, math, shutil
+import numpy as np, pandas as pd
+from pull_into_place import pipeline, structures
+
+demo_dir = os.path.join(
+        os.path.dirname(__file__), '..', 'demos', 'ksi', 'algosb_exercise')
+sample_paths = sorted(
+        glob.glob(os.path.join(demo_dir, 'sample_output', '*.pdb.gz')))
+
+def make_workspace(root, num_models=4):
+    """
+    Make a workspace with the given number of sample models from the KSI demo,
+    plus one model that's missing a restrained atom.  The demo only has
+    coordinate restraints, so an atom pair restraint is added as well.
+    """
+    workspace = pipeline.RestrainedModels(root)
+    workspace.make_dirs()
+
+    shutil.copy(os.path.join(demo_dir, 'inputs', 'loops'), root)
+    with open(os.path.join(demo_dir, 'inputs', 'restraints')) as file:
+        restraints = file.read()
+    with open(workspace.restraints_path, 'w') as file:
+        file.write(restraints.rstrip() + '\n')
+        file.write('AtomPair OE1 38 CA 38 HARMONIC 6.0 1.0\n')
+
+    for i in range(num_models):
+        add_model(workspace.output_dir, 'model_{}.pdb.gz'.format(i), i)
+
+    restraints = structures.RestraintSet.from_file(workspace.restraints_path)
+    missing_atom = restraints.atom_keys[0]
+
+    with gzip.open(sample_paths[0]) as file:
+        lines = [x for x in file if atom_key(x) != missing_atom]
+    with gzip.open(os.path.join(
+            workspace.output_dir, 'model_{}.pdb.gz'.format(num_models)),
+            'w') as file:
+        file.writelines(lines)
+
+    return workspace
+
+def add_model(pdb_dir, name, i=0):
+    """
+    Copy one of the sample models into the given directory, under the given
+    name, and return its path.
+    """
+    path = os.path.join(pdb_dir, name)
+    shutil.copy(sample_paths[i % len(sample_paths)], path)
+    return path
+
+def touch(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+def baseline_restraint_dist(pdb_path, restraints):
+    """
+    Calculate the restraint distance for one model the slow way, i.e. by
+    looking up the atoms of each restraint and measuring it on its own.
+    """
+    xyz = {}
+    with gzip.open(pdb_path) as file:
+        for line in file:
+            if line.startswith(('ATOM', 'HETATM')):
+                xyz[atom_key(line)] = [float(x) for x in line[30:54].split()]
+
+    deviations = []
+    for restraint in restraints:
+        if not all(x in xyz for x in restraint.atoms):
+            continue
+        if isinstance(restraint, structures.CoordinateRestraint):
+            deviations.append(
+                    distance(xyz[restraint.atoms[0]], restraint.position))
+        elif isinstance(restraint, structures.AtomPairRestraint):
+            deviations.append(abs(
+                    distance(*[xyz[x] for x in restraint.atoms]) -
+                    restraint.position))
+        else:
+            raise ValueError("no baseline for '{}' restraints".format(
+                restraint.restraint_type))
+
+    if not deviations:
+        return np.nan
+    return sum(deviations) / len(deviations)
+
+def atom_key(line):
+    return line[22:26].strip(), line[12:16].strip()
+
+def distance(a, b):
+    return math.sqrt(sum((x - y)**2 for x, y in zip(a, b)))
+
+def assert_close(actual, expected, message=''):
+    # Coordinates are cached as float32, so distances calculated from the
+    # cache only agree with the PDB files to about 5 significant figures.
+    actual, expected = np.asarray(actual), np.asarray(expected)
+    assert actual.shape == expected.shape, message
+    assert np.allclose(actual, expected, rtol=1e-5, atol=1e-4, equal_nan=True), \
+            "{}: {} != {}".format(message, actual, expected)
+
+def assert_frames_equal(actual, expected, message=''):
+    assert list(actual.columns) == list(expected.columns), message
+    assert len(actual) == len(expected), message
+    for name in expected.columns:
+        x, y = actual[name].values, expected[name].values
+        same = [(a == b) or (pd.isnull(a) and pd.isnull(b)) for a, b in zip(x, y)]
+        assert all(same), "{}: '{}' differs".format(message, name)
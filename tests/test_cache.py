@@ -0,0 +1,68 @@
+#!/usr/bin/env python2
+
+import os, glob
+import numpy as np, pandas as pd
+from pull_into_place import structures, cache
+from helpers import add_model, assert_close, assert_frames_equal
+
+def test_round_trip(pdb_dir):
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+
+    structures.load(pdb_dir)
+    records = cache.read_cache(cache_path)
+    coords = cache.read_all_coords(cache_path, mmap_mode=None)
+
+    # Add the kinds of columns that the models in this workspace don't have,
+    # i.e. strings with missing values and integers.
+
+    records['label'] = ['a', np.nan] + ['b'] * (len(records) - 2)
+    records['count'] = np.arange(len(records))
+    failures = [dict(path='broken.pdb.gz', reason='Not a gzipped file',
+        file_size=10, file_mtime=1.0)]
+
+    cache.write_cache(cache_path, records, coords, failures)
+
+    assert_frames_equal(cache.read_cache(cache_path), records)
+    assert_frames_equal(
+            pd.concat(cache.iter_cache(cache_path, chunk_size=2)), records)
+    assert cache.is_categorical(cache.read_cache(cache_path)['sequence'])
+    assert cache.read_failures(cache_path) == failures
+
+    for name, (atoms, xyz) in coords.items():
+        stored = cache.read_coords(cache_path, name)
+        assert stored.atoms == atoms, name
+        assert_close(stored.xyz, xyz, name)
+
+def test_coords(pdb_dir):
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+    records = structures.load(pdb_dir)
+    schema = cache.read_schema(cache_path)
+
+    # The rows of the coordinates line up with the rows returned by load(),
+    # even after models are added.
+
+    add_model(pdb_dir, 'model_9.pdb.gz', 1)
+    records = structures.load(pdb_dir)
+    coords = structures.load_coords(pdb_dir, 'restraint_coords')
+    model_0 = list(records['path']).index('model_0.pdb.gz')
+    model_9 = list(records['path']).index('model_9.pdb.gz')
+    model_1 = list(records['path']).index('model_1.pdb.gz')
+
+    assert len(coords.xyz) == len(records)
+    assert_close(coords.xyz[model_9], coords.xyz[model_1])
+    assert not np.allclose(coords.xyz[model_9], coords.xyz[model_0])
+
+    # Each version of the cache has its own coordinate files, and the files
+    # of old versions are cleaned up.
+
+    cache.write_cache(cache_path, cache.read_cache(cache_path),
+            cache.read_all_coords(cache_path, mmap_mode=None))
+    new_schema = cache.read_schema(cache_path)
+    assert new_schema['generation'] != schema['generation']
+
+    coord_files = glob.glob(os.path.join(pdb_dir, 'metrics.*.npy'))
+    assert len(coord_files) == 2 * len(new_schema['coords'])
+    for entry in schema['coords']:
+        assert not os.path.exists(os.path.join(pdb_dir, entry['file']))
+    for entry in new_schema['coords']:
+        assert os.path.exists(os.path.join(pdb_dir, entry['file']))
@@ -0,0 +1,33 @@
+#!/usr/bin/env python2
+
+import os
+from pull_into_place import structures, cache, database
+
+def test_count(workspace, pdb_dir):
+    assert database.count(workspace) == 0
+    records = structures.load(pdb_dir)
+
+    assert database.count(workspace) == len(records) == 5
+    assert database.count(workspace, stage='restrained_models') == 5
+    assert database.count(workspace, stage='fixbb_designs') == 0
+
+    where = 'restraint_dist < {}'.format(records['restraint_dist'].median())
+    assert database.count(workspace, where) == \
+            len(database.query(workspace, where))
+
+def test_sync(workspace, pdb_dir):
+    # Directories cached without updating the database (e.g. by cluster jobs)
+    # aren't added when they're loaded again, because the cache is up to
+    # date, but they are when the database is synced.
+
+    cache_path = os.path.join(pdb_dir, 'metrics.npz')
+    structures.load(pdb_dir, update_db=False)
+    generation = cache.read_schema(cache_path)['generation']
+
+    structures.load(pdb_dir)
+    assert cache.read_schema(cache_path)['generation'] == generation
+    assert database.num_models(pdb_dir, workspace) == 0
+
+    database.sync(workspace)
+    assert cache.read_schema(cache_path)['generation'] == generation
+    assert database.num_models(pdb_dir, workspace) == 5
@@ -0,0 +1,85 @@
+#!/usr/bin/env python2
+
+import os
+import numpy as np
+from klab import scripting
+from pull_into_place import pipeline, structures
+from helpers import assert_close, assert_frames_equal, baseline_restraint_dist
+
+def make_links(workspace):
+    """
+    Make the first round of fixbb designs, with inputs that are symlinks to
+    the restrained models, like the ``pick_models_to_design`` command does.
+    """
+    fixbb = pipeline.FixbbDesigns(workspace.root_dir, 1)
+    fixbb.make_dirs()
+    for name in sorted(os.listdir(workspace.output_dir)):
+        if name.endswith('.pdb.gz'):
+            scripting.relative_symlink(
+                    os.path.join(workspace.output_dir, name),
+                    os.path.join(fixbb.input_dir, name))
+    return fixbb
+
+def load(pdb_dir, **kwargs):
+    report = {}
+    records = structures.load(pdb_dir, job_report=report, **kwargs)
+    return records.sort_values('path').reset_index(drop=True), report
+
+def test_reuse(workspace):
+    restrained, report = load(workspace.output_dir)
+    fixbb = make_links(workspace)
+
+    records, report = load(fixbb.input_dir)
+    assert report['linked_records'] == 5
+    assert report['new_records'] == report['backfilled_records'] == 0
+    assert_frames_equal(records, restrained)
+
+    for name in 'restraint_coords', 'loop_coords':
+        restrained_coords = structures.load_coords(workspace.output_dir, name)
+        linked_coords = structures.load_coords(fixbb.input_dir, name)
+        assert_close(linked_coords.xyz, restrained_coords.xyz, name)
+
+    # Links to models that have changed since they were cached aren't reused.
+
+    os.utime(os.path.join(workspace.output_dir, 'model_0.pdb.gz'), (1, 1))
+    os.remove(os.path.join(fixbb.input_dir, 'metrics.npz'))
+    records, report = load(fixbb.input_dir)
+    assert report['linked_records'] == 4
+    assert report['new_records'] == 1
+
+def test_different_restraints(workspace):
+    restrained, report = load(workspace.output_dir)
+    fixbb = make_links(workspace)
+
+    # The design step has its own restraints, so the restraint distances and
+    # the Dunbrack scores of the restrained models can't be reused.
+
+    with open(os.path.join(fixbb.focus_dir, 'restraints'), 'w') as file:
+        file.write('AtomPair CA 40 CA 50 HARMONIC 8.0 1.0\n')
+        file.write('CoordinateConstraint OE1 38 CA 1 0.0 0.0 0.0 HARMONIC 0.0 1.0\n')
+    assert fixbb.restraints_path.startswith(fixbb.focus_dir)
+    restraints = structures.RestraintSet.from_file(fixbb.restraints_path)
+
+    expected = np.array([
+            baseline_restraint_dist(
+                os.path.join(fixbb.input_dir, x), restraints)
+            for x in restrained['path']])
+
+    records, report = load(fixbb.input_dir)
+    assert report['linked_records'] == 5
+    assert report['backfilled_records'] == 5
+    assert_close(records['restraint_dist'].values, expected)
+    assert_frames_equal(records[['path', 'total_score', 'sequence']],
+            restrained[['path', 'total_score', 'sequence']])
+
+    records, report = load(fixbb.input_dir)
+    assert report['old_records'] == 5
+    assert report['backfilled_records'] == 0
+    assert_close(records['restraint_dist'].values, expected)
+
+    # The same goes for recalculating everything.
+
+    records, report = load(fixbb.input_dir, use_cache=False)
+    assert report['new_records'] == 5
+    assert report['linked_records'] == 0
+    assert_close(records['restraint_dist'].values, expected)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python2
+
+import os, gzip, json, pytest
+from pull_into_place import pipeline, structures, cache, database
+from helpers import add_model, touch, assert_close, assert_frames_equal
+
+def load(pdb_dir, **kwargs):
+    report = {}
+    records = structures.load(pdb_dir, job_report=report, **kwargs)
+    return records, report
+
+def recompress(path, gzip_mtime):
+    # Only the timestamp in the gzip header changes, so the file keeps its
+    # size and can be given back its modification time.
+    with gzip.open(path) as file:
+        content = file.read()
+    with open(path, 'wb') as raw_file:
+        with gzip.GzipFile('model.pdb', 'wb', fileobj=raw_file,
+                mtime=gzip_mtime) as file:
+            file.write(content)
+
+def test_fingerprints(pdb_dir):
+    path = os.path.join(pdb_dir, 'model_0.pdb.gz')
+    recompress(path, 1)
+    touch(path, 1000)
+
+    records, report = load(pdb_dir, check_hash=True)
+    assert report['new_records'] == 5
+
+    records, report = load(pdb_dir)
+    assert report['new_records'] == report['stale_records'] == 0
+    assert report['old_records'] == 5
+
+    # Models that change are read again.
+
+    touch(path, 2000)
+    records, report = load(pdb_dir)
+    assert report['new_records'] == report['stale_records'] == 1
+
+    # Models that are deleted are dropped.
+
+    os.remove(os.path.join(pdb_dir, 'model_1.pdb.gz'))
+    records, report = load(pdb_dir)
+    assert report['new_records'] == 0
+    assert report['stale_records'] == 1
+    assert 'model_1.pdb.gz' not in set(records['path'])
+
+    # Models that are overwritten without changing their size or modification
+    # time are only caught by the hash.
+
+    load(pdb_dir, check_hash=True)
+    size = os.path.getsize(path)
+    recompress(path, 2)
+    touch(path, 2000)
+    assert os.path.getsize(path) == size
+
+    records, report = load(pdb_dir)
+    assert report['new_records'] == 0
+    records, report = load(pdb_dir, check_hash=True)
+    assert report['new_records'] == report['stale_records'] == 1
+
+def test_resume_from_journal(pdb_dir, monkeypatch):
+    journal_path = os.path.join(pdb_dir, 'metrics.journal')
+    read_and_calculate_one = structures.read_and_calculate_one
+    calls = []
+
+    def interrupt_third_model(path, *args, **kwargs):
+        calls.append(path)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return read_and_calculate_one(path, *args, **kwargs)
+
+    monkeypatch.setattr(
+            structures, 'read_and_calculate_one', interrupt_third_model)
+    with pytest.raises(KeyboardInterrupt):
+        structures.load(pdb_dir)
+    monkeypatch.undo()
+
+    # The models read before the interruption were journaled, and aren't
+    # read again.
+
+    assert os.path.exists(journal_path)
+    assert not os.path.exists(os.path.join(pdb_dir, 'metrics.npz'))
+
+    records, report = load(pdb_dir)
+    assert report['old_records'] == 2
+    assert report['new_records'] == 3
+    assert not os.path.exists(journal_path)
+
+    expected = structures.load(pdb_dir, use_cache=False)
+    assert_frames_equal(records, expected)
+
+    # A journal whose last line was cut off is read up to that line.
+
+    with open(journal_path, 'w') as file:
+        file.write('{"num_rows": 1, "colu')
+
+    records, report = load(pdb_dir)
+    assert report['old_records'] == 5
+    assert_frames_equal(records, expected)
+
+def test_failures(pdb_dir):
+    broken_path = os.path.join(pdb_dir, 'broken.pdb.gz')
+    truncated_path = os.path.join(pdb_dir, 'truncated.pdb.gz')
+
+    with open(broken_path, 'w') as file:
+        file.write('not a gzipped file\n')
+    with open(add_model(pdb_dir, 'truncated.pdb.gz'), 'rb') as file:
+        content = file.read()
+    with open(truncated_path, 'wb') as file:
+        file.write(content[:len(content) // 2])
+
+    # Files that can't be read are remembered, except for files that seem to
+    # still be being written.
+
+    records, report = load(pdb_dir)
+    assert len(records) == 5
+    assert report['failed_records'] == 1
+    assert report['deferred_records'] == 1
+
+    schema = cache.read_schema(os.path.join(pdb_dir, 'metrics.npz'))
+    assert [x['path'] for x in schema['failures']] == ['broken.pdb.gz']
+
+    records, report = load(pdb_dir, in_progress_age=0)
+    assert report['new_records'] == 0
+    assert report['failed_records'] == 2
+    assert report['deferred_records'] == 0
+
+    records, report = load(pdb_dir)
+    assert report['new_records'] == 0
+    assert report['failed_records'] == 2
+
+    # Files that change are tried again.
+
+    add_model(pdb_dir, 'truncated.pdb.gz')
+    records, report = load(pdb_dir)
+    assert report['new_records'] == 1
+    assert report['failed_records'] == 1
+    assert len(records) == 6
+
+def test_workers(pdb_dir):
+    for i in range(4, 12):
+        add_model(pdb_dir, 'model_{}.pdb.gz'.format(i + 1), i)
+
+    records = structures.load(pdb_dir, use_cache=False)
+    coords = cache.read_all_coords(
+            os.path.join(pdb_dir, 'metrics.npz'), mmap_mode=None)
+
+    parallel_records = structures.load(pdb_dir, use_cache=False, workers=3)
+    parallel_coords = cache.read_all_coords(
+            os.path.join(pdb_dir, 'metrics.npz'), mmap_mode=None)
+
+    assert len(records) == 13
+    assert_frames_equal(parallel_records, records)
+    for name, (atoms, xyz) in coords.items():
+        assert parallel_coords[name].atoms == atoms
+        assert_close(parallel_coords[name].xyz, xyz, name)
+
+def test_columns(pdb_dir):
+    records = structures.load(pdb_dir)
+    columns = ['restraint_dist', 'sequence', 'not_a_metric']
+
+    # Only the given columns are read from an up to date cache, and the ones
+    # that don't exist are left out.
+
+    cached = structures.load(pdb_dir, columns=columns)
+    assert list(cached.columns) == ['path', 'restraint_dist', 'sequence']
+    assert_frames_equal(cached, records[cached.columns])
+
+    # If the cache isn't up to date, it's updated first.
+
+    touch(os.path.join(pdb_dir, 'model_0.pdb.gz'), 1000)
+    cached = structures.load(pdb_dir, columns=columns)
+    assert list(cached.columns) == ['path', 'restraint_dist', 'sequence']
+    assert_frames_equal(
+            cached.sort_values('path').reset_index(drop=True),
+            records[cached.columns].sort_values('path').reset_index(drop=True))
+
+def test_groups(workspace, pdb_dir):
+    # An empty list of groups means just the scores.
+
+    records, report = load(pdb_dir, groups=[])
+    assert report['new_records'] == 5
+    assert 'total_score' in records
+    assert 'restraint_dist' not in records
+
+    # Records that don't have every metric yet aren't added to the database.
+
+    assert database.num_models(pdb_dir, workspace) == 0
+    records, report = load(pdb_dir, columns=['sequence'])
+    assert report['backfilled_records'] == 5
+    assert database.num_models(pdb_dir, workspace) == 0
+
+    records, report = load(pdb_dir)
+    assert report['backfilled_records'] == 5
+    assert 'restraint_dist' in records
+    assert database.num_models(pdb_dir, workspace) == 5
+
+def test_metrics_only(workspace, pdb_dir):
+    # Only the score file and the list of remote models were fetched, so the
+    # metrics that come from the models themselves are left blank.
+
+    for name in os.listdir(pdb_dir):
+        os.remove(os.path.join(pdb_dir, name))
+
+    remote_models = dict(
+            ('model_{}.pdb.gz'.format(i), (1000, 100)) for i in range(3))
+    with open(os.path.join(pdb_dir, pipeline.remote_models_name), 'w') as file:
+        json.dump(remote_models, file)
+    with open(os.path.join(pdb_dir, 'score.sc'), 'w') as file:
+        for i in range(2):
+            json.dump({
+                'decoy': 'model_{}'.format(i),
+                'total_score': -100.0 - i,
+                'delta_buried_unsats': 1.0,
+                'loop_backbone_rmsd': 0.5,
+            }, file)
+            file.write('\n')
+
+    records, report = load(pdb_dir)
+    assert report['scored_records'] == 2
+    assert report['unfetched_records'] == 1
+    assert list(records['total_score']) == [-100.0, -101.0]
+    assert records['restraint_dist'].isnull().all()
+    assert records['sequence'].isnull().all()
+    assert database.num_models(pdb_dir, workspace) == 2
+
+    records, report = load(pdb_dir)
+    assert report['old_records'] == 2
+    assert records['restraint_dist'].isnull().all()
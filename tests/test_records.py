@@ -0,0 +1,58 @@
+#!/usr/bin/env python2
+
+import numpy as np
+from pull_into_place import structures
+from helpers import assert_close, assert_frames_equal
+
+atoms_by_name = {'coords': [('1', 'CA'), ('2', 'CA')]}
+xyz = np.arange(6, dtype=np.float32).reshape(2, 3)
+
+def test_rows():
+    # Writing rows directly into a block gives the same block as appending
+    # dictionaries.
+
+    records = [
+            {'path': 'a.pdb.gz', 'total_score': -1.0, 'coords': xyz},
+            {'path': 'b.pdb.gz', 'total_score': -2.0, 'sequence': 'AC'},
+    ]
+    appended = structures.RecordBlock(atoms_by_name, capacity=1)
+    written = structures.RecordBlock(atoms_by_name, capacity=1)
+
+    for record in records:
+        appended.append(record)
+        row = written.new_row()
+        for name, value in record.items():
+            row[name] = value
+        row.commit()
+
+    written_records = written.to_frame()
+    appended_records = appended.to_frame()
+    assert len(written_records) == 2
+    assert_frames_equal(
+            written_records[sorted(written_records.columns)],
+            appended_records[sorted(appended_records.columns)])
+    assert_close(written.coords['coords'], appended.coords['coords'])
+
+def test_discard():
+    block = structures.RecordBlock(atoms_by_name)
+    block.append({'path': 'a.pdb.gz', 'total_score': -1.0})
+
+    # Discarded rows leave no trace, not even the columns that only they had.
+
+    row = block.new_row()
+    row['path'] = 'b.pdb.gz'
+    row['total_score'] = -2.0
+    row['coords'] = xyz
+    row['restraint_dist'] = 0.5
+    assert 'restraint_dist' in row
+    row.discard()
+
+    row = block.new_row()
+    row['path'] = 'c.pdb.gz'
+    row.commit()
+
+    records = block.to_frame()
+    assert list(records['path']) == ['a.pdb.gz', 'c.pdb.gz']
+    assert list(records.columns) == ['total_score', 'path']
+    assert np.isnan(records['total_score'][1])
+    assert np.isnan(block.coords['coords']).all()
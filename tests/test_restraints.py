@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+
+import os
+import numpy as np
+from pull_into_place import structures
+from helpers import assert_close, baseline_restraint_dist
+
+def expected_restraint_dist(workspace, records):
+    restraints = structures.RestraintSet.from_file(workspace.restraints_path)
+    return np.array([
+            baseline_restraint_dist(
+                os.path.join(workspace.output_dir, x), restraints)
+            for x in records['path']])
+
+def test_load(workspace):
+    # Metrics calculated one model at a time while reading the PDB files.
+    records = structures.load(workspace.output_dir, use_cache=False)
+    expected = expected_restraint_dist(workspace, records)
+
+    assert np.isnan(expected).sum() == 0
+    assert_close(records['restraint_dist'].values, expected)
+
+def test_calculate_restraint_dist(workspace):
+    # The same metric calculated for every cached model at once.
+    records = structures.load(workspace.output_dir)
+    expected = expected_restraint_dist(workspace, records)
+
+    restraints = structures.RestraintSet.from_file(workspace.restraints_path)
+    coords = structures.load_coords(workspace.output_dir, 'restraint_coords')
+    xyz = np.array(coords.xyz, dtype=float)
+    assert coords.atoms == restraints.atom_keys
+
+    assert_close(restraints.calculate_restraint_dist(xyz), expected)
+
+    # Models missing some of the restrained atoms are scored with the
+    # restraints that are left, and models missing all of them are NaN.
+
+    xyz[0] = np.nan
+    assert np.isnan(restraints.calculate_restraint_dist(xyz)[0])
+
+def test_rescore_restraints(workspace, tmpdir):
+    records = structures.load(workspace.output_dir)
+    expected = expected_restraint_dist(workspace, records)
+
+    # The cached coordinates are used again without reading the PDB files.
+
+    rescored = structures.rescore_restraints(
+            workspace.output_dir, column='check_dist')
+    assert list(rescored['path']) == list(records['path'])
+    assert_close(rescored['check_dist'].values, expected)
+
+    # Atoms that weren't restrained when the cache was made are read from the
+    # PDB files, and kept for next time.
+
+    restraints_path = str(tmpdir.join('new_restraints'))
+    with open(restraints_path, 'w') as file:
+        file.write('AtomPair CA 40 CA 50 HARMONIC 8.0 1.0\n')
+    new_restraints = structures.RestraintSet.from_file(restraints_path)
+    new_expected = np.array([
+            baseline_restraint_dist(
+                os.path.join(workspace.output_dir, x), new_restraints)
+            for x in records['path']])
+
+    rescored = structures.rescore_restraints(
+            workspace.output_dir, restraints_path)
+    assert_close(rescored['restraint_dist'].values, new_expected)
+
+    coords = structures.load_coords(workspace.output_dir, 'restraint_coords')
+    assert set(new_restraints.atom_keys) <= set(coords.atoms)
+
+    records = structures.load(workspace.output_dir)
+    assert_close(records['restraint_dist'].values, new_expected)
+    assert_close(records['check_dist'].values, expected)
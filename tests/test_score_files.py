@@ -0,0 +1,57 @@
+#!/usr/bin/env python2
+
+import os, shutil
+from pull_into_place import structures
+from helpers import touch
+
+score_path = os.path.join(os.path.dirname(__file__), 'data', 'score.sc')
+
+def test_iter_score_file():
+    rows = dict(structures.iter_score_file(score_path))
+    assert len(rows) == 6
+
+    # The names of the filters have spaces in them, and the tags aren't lined
+    # up with the header.
+
+    assert rows['model_4'] == {
+            'total_score': -1469.371,
+            'delta_buried_unsats': 5.0,
+            'fa_atr': -1225.1,
+            'loop_backbone_rmsd': 1.342,
+            'EXTRA_SCORE_[[+]]Foldability Score': -0.05,
+            'EXTRA_SCORE_[[-]]Phe54 RMSD': 2.311,
+    }
+    assert rows['model_0_with_a_longer_name_0001']['total_score'] == -1401.25
+
+def test_parse_score_row():
+    header = 'SCORE: total_score    fa_atr description'
+    assert structures.parse_score_row(
+            header, 'SCORE:     -12.500    -3.000 m') == [
+                    ('total_score', '-12.500'),
+                    ('fa_atr', '-3.000'),
+                    ('description', 'm')]
+
+    # Rows that aren't aligned are still understood if the names don't have
+    # spaces in them, but rows with the wrong number of values are skipped.
+
+    assert structures.parse_score_row(
+            header, 'SCORE: -12.5 -3.0 m')[:2] == [
+                    ('total_score', '-12.5'), ('fa_atr', '-3.0')]
+    assert structures.parse_score_row(
+            header, 'SCORE:     -12.500 m') is None
+
+def test_load(pdb_dir):
+    for name in os.listdir(pdb_dir):
+        touch(os.path.join(pdb_dir, name), 1000)
+    shutil.copy(score_path, pdb_dir)
+
+    report = {}
+    records = structures.load(
+            pdb_dir, columns=['total_score', 'loop_dist'], job_report=report)
+    records = records.sort_values('path')
+
+    assert report['scored_records'] == 5
+    assert report['new_records'] == 0
+    assert list(records['total_score']) == \
+            [-1484.92, -1482.66, -1484.92, -1482.66, -1469.371]
+    assert list(records['loop_dist']) == [0.717, 0.509, 0.717, 0.509, 1.342]
@@ -0,0 +1,62 @@
+#!/usr/bin/env python2
+
+import os
+from pull_into_place import pipeline, structures, cache
+from helpers import assert_close, assert_frames_equal
+
+def load(pdb_dir, **kwargs):
+    report = {}
+    records = structures.load(pdb_dir, job_report=report, **kwargs)
+    return records.sort_values('path').reset_index(drop=True), report
+
+def load_coords(pdb_dir):
+    # The coordinates are in the same order as the cached records.
+    paths = structures.load(pdb_dir)['path'].values
+    coords = structures.load_coords(pdb_dir, 'restraint_coords')
+    return coords.xyz[paths.argsort()]
+
+def test_write_sidecar(workspace, pdb_dir):
+    expected, report = load(pdb_dir, use_cache=False)
+    expected_coords = load_coords(pdb_dir)
+    expected_filters = pipeline.load_filters(pdb_dir)
+    assert expected_filters
+
+    for name in os.listdir(pdb_dir):
+        if name.startswith('metrics.'):
+            os.remove(os.path.join(pdb_dir, name))
+    os.remove(workspace.filters_list)
+
+    # Sidecars are written by cluster jobs, which shouldn't touch the list of
+    # filters (or take its lock).
+
+    pdb_paths = [
+            os.path.join(pdb_dir, 'model_{}.pdb.gz'.format(i))
+            for i in range(3)]
+    sidecar_path = structures.write_sidecar(pdb_paths, '1')
+    assert os.path.basename(sidecar_path) == 'metrics.1.sidecar'
+    assert not os.path.exists(workspace.filters_list)
+
+    # The sidecar is merged the next time the directory is loaded, along with
+    # the filters it found.
+
+    records, report = load(pdb_dir)
+    assert report['sidecar_records'] == 3
+    assert report['new_records'] == 2
+    assert_frames_equal(records, expected)
+    assert sorted(pipeline.load_filters(pdb_dir)) == sorted(expected_filters)
+
+    assert_close(load_coords(pdb_dir), expected_coords)
+
+    # The cache remembers which sidecars have been merged, so they aren't
+    # merged again, even when the cache is rewritten.
+
+    schema = cache.read_schema(os.path.join(pdb_dir, 'metrics.npz'))
+    assert [x['path'] for x in schema['sidecars']] == ['metrics.1.sidecar']
+
+    os.utime(pdb_paths[0], None)
+    records, report = load(pdb_dir)
+    assert report['sidecar_records'] == 0
+    assert report['new_records'] == 1
+
+    schema = cache.read_schema(os.path.join(pdb_dir, 'metrics.npz'))
+    assert [x['path'] for x in schema['sidecars']] == ['metrics.1.sidecar']